@@ -0,0 +1,43 @@
+"""
+CLI script to compare the ingestion speed of execute_values against COPY (text and binary), table by table.
+Ticks are read back from the existing tables and inserted into temporary copies of them.
+"""
+
+if __name__ == "__main__":
+
+    from simplebt.db import DbTicks
+    from simplebt.db.utils import INGESTION_METHODS, benchmark_ingestion, format_ingestion_report, read_sample_ticks
+    from simplebt.resources.config import TICKS_SCHEMA_NAME
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion of ticks")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of ticks to insert per table")
+    parser.add_argument(
+        "--tables", type=str, action="extend", nargs="+",
+        help="Tables to benchmark. Default: all the tick tables",
+    )
+    parser.add_argument("--methods", type=str, action="extend", nargs="+", choices=INGESTION_METHODS)
+
+    args = parser.parse_args()
+
+    conn = DbTicks.open_conn()
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"select table_name from information_schema.tables where table_schema = '{TICKS_SCHEMA_NAME}' order by table_name;"
+        )
+        tables = [r[0] for r in cursor.fetchall()]
+    if args.tables:
+        tables = [t for t in tables if t in args.tables]
+
+    results = []
+    for table in tables:
+        parsed = DbTicks.parse_table_name(table)
+        if parsed is None:
+            print(f"Skipping {table}")
+            continue
+        contract, tick_type = parsed
+        db = DbTicks(contract=contract, tick_type=tick_type, db_connection=conn)
+        ticks = read_sample_ticks(db=db, limit=args.rows)
+        if ticks:
+            results += benchmark_ingestion(db=db, rows=ticks, methods=args.methods or INGESTION_METHODS)
+    print(format_ingestion_report(results))
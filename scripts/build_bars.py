@@ -0,0 +1,59 @@
+"""
+CLI script to aggregate the historical ticks stored in Postgres into bars, written into the DbBars tables.
+Backtests run with bar_size set will then replay the bars instead of the ticks.
+"""
+
+if __name__ == "__main__":
+
+    from simplebt.historical_data.utils.bars import build_bars
+    from simplebt.utils.ib import start_ib
+    import argparse
+    import datetime
+    import pathlib
+    from ib_insync import Contract, ContractDetails, Future
+    from typing import List
+
+    parser = argparse.ArgumentParser(description="Build bars from the stored ticks")
+    parser.add_argument("--client-id", type=int, help="Client ID to use when connecting to the gateway")
+    parser.add_argument("--port", type=int, default=4002, help="Port the gateway is listening on (4001, 4002)")
+    parser.add_argument("--timeout", type=int)
+    parser.add_argument("--symbol", type=str, help="Example ES")
+    parser.add_argument("--exchange", type=str, default="", help="Example GLOBEX")
+    parser.add_argument(
+        "--expiries", type=str, action="extend", nargs="+",
+        help="Expiries to aggregate. The `extend` action stores them in a list",
+    )
+    parser.add_argument(
+        "--bar-size", type=str, default="1 min",
+        help="Example '1 min', '500 ticks', '1000 volume', '5000000 dollars'",
+    )
+    parser.add_argument(
+        "--tick-types", type=str, nargs="+", default=["TRADES", "BID_ASK"],
+        help="BID_ASK bars can only be time bars",
+    )
+    parser.add_argument("--cache-dir", type=pathlib.Path, help="Read the ticks from this columnar cache instead of Postgres")
+    parser.add_argument("--start-date", type=lambda d: datetime.datetime.strptime(d, "%Y%m%d").date(), help="Example 20210601")
+    parser.add_argument("--end-date", type=lambda d: datetime.datetime.strptime(d, "%Y%m%d").date(), help="Example 20210630")
+
+    args = parser.parse_args()
+
+    ib = start_ib(client_id=args.client_id, port=args.port, timeout=args.timeout)
+    contracts: List[ContractDetails] = ib.reqContractDetails(
+        Future(symbol=args.symbol, exchange=args.exchange, includeExpired=True)
+    )
+    ib.disconnect()
+
+    cs: List[Contract] = [c.contract for c in contracts if c.contract is not None]
+    if args.expiries is not None:
+        cs = list(filter(lambda c: c.lastTradeDateOrContractMonth in args.expiries, cs))
+    for c in cs:
+        for tick_type in args.tick_types:
+            print(f"Building {args.bar_size} {tick_type} bars of {args.symbol} {c.lastTradeDateOrContractMonth}")
+            build_bars(
+                contract=c,
+                tick_type=tick_type,
+                bar_size=args.bar_size,
+                start_date=args.start_date,
+                end_date=args.end_date,
+                cache_dir=args.cache_dir,
+            )
@@ -0,0 +1,66 @@
+"""
+CLI script to stitch the stored ticks of consecutive expiries into one continuous stream in the columnar cache.
+Backtests run with tick_cache_dir set will then replay it as a single contract, printed at the end.
+"""
+
+if __name__ == "__main__":
+
+    from simplebt.historical_data.utils.continuous import ADJUSTMENTS, build_continuous_future
+    from simplebt.resources.config import TICKS_CACHE_DIR
+    from simplebt.utils.ib import start_ib
+    import argparse
+    import datetime
+    import pathlib
+    from ib_insync import Contract, ContFuture, ContractDetails, Future
+    from typing import List
+
+    parser = argparse.ArgumentParser(description="Build a continuous future from the stored ticks of its expiries")
+    parser.add_argument("--client-id", type=int, help="Client ID to use when connecting to the gateway")
+    parser.add_argument("--port", type=int, default=4002, help="Port the gateway is listening on (4001, 4002)")
+    parser.add_argument("--timeout", type=int)
+    parser.add_argument("--symbol", type=str, help="Example ES")
+    parser.add_argument("--exchange", type=str, default="", help="Example GLOBEX")
+    parser.add_argument(
+        "--expiries", type=str, action="extend", nargs="+",
+        help="Expiries to stitch. The `extend` action stores them in a list",
+    )
+    parser.add_argument("--roll", type=str, default="5 days", help="Example '5 days' before the last trade date, or 'volume'")
+    parser.add_argument("--adjustment", type=str, choices=ADJUSTMENTS, help="Back-adjust the prices before every roll")
+    parser.add_argument(
+        "--cache-dir", type=pathlib.Path, default=TICKS_CACHE_DIR,
+        help=f"Default: {TICKS_CACHE_DIR}, set through $SIMPLEBT_TICKS_CACHE_DIR",
+    )
+    parser.add_argument(
+        "--source-cache-dir", type=pathlib.Path,
+        help="Read the ticks of the expiries from this columnar cache instead of Postgres",
+    )
+    parser.add_argument(
+        "--start-date", type=lambda d: datetime.datetime.strptime(d, "%Y%m%d").date(), required=True,
+        help="Example 20210601",
+    )
+    parser.add_argument(
+        "--end-date", type=lambda d: datetime.datetime.strptime(d, "%Y%m%d").date(), required=True,
+        help="Example 20211231",
+    )
+
+    args = parser.parse_args()
+
+    ib = start_ib(client_id=args.client_id, port=args.port, timeout=args.timeout)
+    contracts: List[ContractDetails] = ib.reqContractDetails(
+        Future(symbol=args.symbol, exchange=args.exchange, includeExpired=True)
+    )
+    ib.disconnect()
+
+    cs: List[Contract] = [c.contract for c in contracts if c.contract is not None]
+    if args.expiries is not None:
+        cs = list(filter(lambda c: c.lastTradeDateOrContractMonth in args.expiries, cs))
+    cont: ContFuture = build_continuous_future(
+        contracts=cs,
+        start_date=args.start_date,
+        end_date=args.end_date,
+        roll_rule=args.roll,
+        adjustment=args.adjustment,
+        cache_dir=args.cache_dir,
+        source_cache_dir=args.source_cache_dir,
+    )
+    print(f"Built {cont}")
@@ -0,0 +1,56 @@
+"""
+CLI script to export the historical ticks stored in Postgres into the local columnar cache.
+Backtests run with tick_cache_dir set will then replay them without a database connection.
+"""
+
+if __name__ == "__main__":
+
+    from simplebt.historical_data.utils.cache import build_ticks_cache
+    from simplebt.resources.config import TICKS_CACHE_DIR
+    from simplebt.utils.ib import start_ib
+    import argparse
+    import datetime
+    import pathlib
+    from ib_insync import Contract, ContractDetails, Future
+    from typing import List
+
+    parser = argparse.ArgumentParser(description="Build the columnar ticks cache")
+    parser.add_argument("--client-id", type=int, help="Client ID to use when connecting to the gateway")
+    parser.add_argument("--port", type=int, default=4002, help="Port the gateway is listening on (4001, 4002)")
+    parser.add_argument("--timeout", type=int)
+    parser.add_argument("--symbol", type=str, help="Example ES")
+    parser.add_argument("--exchange", type=str, default="", help="Example GLOBEX")
+    parser.add_argument(
+        "--expiries", type=str, action="extend", nargs="+",
+        help="Expiries to cache. The `extend` action stores them in a list",
+    )
+    parser.add_argument(
+        "--cache-dir", type=pathlib.Path, default=TICKS_CACHE_DIR,
+        help=f"Default: {TICKS_CACHE_DIR}, set through $SIMPLEBT_TICKS_CACHE_DIR",
+    )
+    parser.add_argument("--start-date", type=lambda d: datetime.datetime.strptime(d, "%Y%m%d").date(), help="Example 20210601")
+    parser.add_argument("--end-date", type=lambda d: datetime.datetime.strptime(d, "%Y%m%d").date(), help="Example 20210630")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild the days already in the cache")
+
+    args = parser.parse_args()
+
+    ib = start_ib(client_id=args.client_id, port=args.port, timeout=args.timeout)
+    contracts: List[ContractDetails] = ib.reqContractDetails(
+        Future(symbol=args.symbol, exchange=args.exchange, includeExpired=True)
+    )
+    ib.disconnect()
+
+    cs: List[Contract] = [c.contract for c in contracts if c.contract is not None]
+    if args.expiries is not None:
+        cs = list(filter(lambda c: c.lastTradeDateOrContractMonth in args.expiries, cs))
+    for c in cs:
+        for tick_type in ("TRADES", "BID_ASK"):
+            print(f"Caching {args.symbol} {c.lastTradeDateOrContractMonth} {tick_type}")
+            build_ticks_cache(
+                contract=c,
+                tick_type=tick_type,
+                cache_dir=args.cache_dir,
+                start_date=args.start_date,
+                end_date=args.end_date,
+                overwrite=args.overwrite,
+            )
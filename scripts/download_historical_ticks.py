@@ -5,6 +5,7 @@ CLI script to download historical ticks. Works for both active and expired futur
 if __name__ == "__main__":
     
     from simplebt.historical_data.utils.ticks import download_and_store_hist_ticks
+    from simplebt.historical_data.utils.ticks_async import DownloadJob, download_and_store_hist_ticks_concurrently
     from simplebt.utils.ib import start_ib
     import datetime
     from ib_insync import Contract, ContractDetails, Future
@@ -18,6 +19,8 @@ if __name__ == "__main__":
     parser.add_argument("--symbol", type=str, help="Example ES")
     parser.add_argument("--exchange", type=str, default="", help="Example GLOBEX. Otherwise will get data from all exchanges")
     parser.add_argument("--expiries", type=str, action="extend", nargs="+", help="Expiries to download. The `extend` action stores them in a list")
+    parser.add_argument("--copy", action="store_true", help="Insert the ticks with COPY instead of execute_values")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of expiries to download at the same time")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--bid-ask", action="store_true")
     group.add_argument("--trades", action="store_true")
@@ -36,6 +39,8 @@ if __name__ == "__main__":
     SYMBOL: str = args.symbol
     EXCHANGE: str = args.exchange
     EXPIRIES: List[str] = args.expiries
+    USE_COPY: bool = args.copy
+    CONCURRENCY: int = args.concurrency
 
     ib = start_ib(client_id=CLIENT_ID, port=PORT, timeout=TIMEOUT)
     contracts: List[ContractDetails] = ib.reqContractDetails(
@@ -53,13 +58,17 @@ if __name__ == "__main__":
         reverse=False
     )
     print(",".join([c.lastTradeDateOrContractMonth for c in cs]))
+    jobs: List[DownloadJob] = []
     for n, c in enumerate(cs):
-        print(f"Round {n}: {SYMBOL} {c.lastTradeDateOrContractMonth} {TICK_TYPE}")
         if n == 0:
             START_DATETIME = datetime.datetime.strptime(c.lastTradeDateOrContractMonth, "%Y%m%d") - datetime.timedelta(days=90)
         else:
             START_DATETIME = datetime.datetime.strptime(cs[n - 1].lastTradeDateOrContractMonth, "%Y%m%d")
         START_DATETIME = START_DATETIME.replace(tzinfo=datetime.timezone.utc)
+        if CONCURRENCY > 1:
+            jobs.append(DownloadJob(contract=c, tick_type=TICK_TYPE, start_datetime=START_DATETIME))
+            continue
+        print(f"Round {n}: {SYMBOL} {c.lastTradeDateOrContractMonth} {TICK_TYPE}")
         download_and_store_hist_ticks(
             client_id=CLIENT_ID,
             port=PORT,
@@ -67,4 +76,16 @@ if __name__ == "__main__":
             contract=c,
             start_datetime=START_DATETIME,
             tick_type=TICK_TYPE,
+            use_copy=USE_COPY,
+        )
+    if jobs:
+        download_and_store_hist_ticks_concurrently(
+            client_id=CLIENT_ID,
+            port=PORT,
+            timeout=TIMEOUT,
+            jobs=jobs,
+            concurrency=CONCURRENCY,
+            use_copy=USE_COPY,
         )
+        for job in jobs:
+            print(f"{job.name}: {job.n_ticks} ticks, {job.n_timeouts} timeouts, stopped at {job.end_datetime}")
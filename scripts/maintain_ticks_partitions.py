@@ -0,0 +1,50 @@
+"""
+CLI script to cluster, vacuum and freeze the old partitions of the partitioned tick tables,
+see DbTicks.maintain_partitions. Run it e.g. nightly: partitions are only maintained once unless --force is given.
+"""
+
+if __name__ == "__main__":
+
+    from simplebt.db import DbTicks
+    from simplebt.resources.config import TICKS_SCHEMA_NAME
+    import argparse
+    import datetime
+    import logging
+
+    parser = argparse.ArgumentParser(description="Maintain the old partitions of the tick tables")
+    parser.add_argument(
+        "--tables", type=str, action="extend", nargs="+",
+        help="Tables to maintain. Default: all the partitioned tick tables",
+    )
+    parser.add_argument(
+        "--older-than-days", type=int, default=7,
+        help="Only the partitions that ended at least this many days ago",
+    )
+    parser.add_argument("--no-cluster", action="store_true", help="Only vacuum, freeze and analyze")
+    parser.add_argument("--force", action="store_true", help="Also redo the partitions maintained already")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = DbTicks.open_conn()
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"select c.relname from pg_class c join pg_namespace n on n.oid = c.relnamespace "
+            f"where n.nspname = '{TICKS_SCHEMA_NAME}' and c.relkind = 'p' order by c.relname;"
+        )
+        tables = [r[0] for r in cursor.fetchall()]
+    if args.tables:
+        tables = [t for t in tables if t in args.tables]
+
+    for table in tables:
+        parsed = DbTicks.parse_table_name(table)
+        if parsed is None:
+            print(f"Skipping {table}")
+            continue
+        contract, tick_type = parsed
+        db = DbTicks(contract=contract, tick_type=tick_type, db_connection=conn)
+        partitions = db.maintain_partitions(
+            older_than=datetime.timedelta(days=args.older_than_days), cluster=not args.no_cluster, force=args.force
+        )
+        print(f"{table}: {len(partitions)} partitions maintained")
+    conn.close()
@@ -0,0 +1,43 @@
+"""
+CLI script to convert the tick tables from the pk layout, keyed on "<time>_<ix>" strings, to the compact one,
+keyed on (time, seq) with real prices. Tables are converted one by one, in batches, see DbTicks.migrate_to_compact.
+Stop the downloads meanwhile: the old table of each contract is dropped at the end of its migration.
+"""
+
+if __name__ == "__main__":
+
+    from simplebt.db import DbTicks
+    from simplebt.resources.config import TICKS_SCHEMA_NAME
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description="Migrate the tick tables to the compact layout")
+    parser.add_argument(
+        "--tables", type=str, action="extend", nargs="+",
+        help="Tables to migrate. Default: all the tick tables",
+    )
+    parser.add_argument("--batch-size", type=int, default=100000, help="Number of rows copied per transaction")
+    parser.add_argument("--no-price-check", action="store_true", help="Don't stop at prices that real rounds")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = DbTicks.open_conn()
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"select table_name from information_schema.tables where table_schema = '{TICKS_SCHEMA_NAME}' order by table_name;"
+        )
+        tables = [r[0] for r in cursor.fetchall()]
+    if args.tables:
+        tables = [t for t in tables if t in args.tables]
+
+    for table in tables:
+        parsed = DbTicks.parse_table_name(table)
+        if parsed is None:
+            print(f"Skipping {table}")
+            continue
+        contract, tick_type = parsed
+        db = DbTicks(contract=contract, tick_type=tick_type, db_connection=conn)
+        rows = db.migrate_to_compact(batch_size=args.batch_size, check_prices=not args.no_price_check)
+        print(f"{table}: {rows} rows")
+    conn.close()
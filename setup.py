@@ -18,6 +18,9 @@ setuptools.setup(
         "pandas==1.2.0",
         "psycopg2-binary==2.8.6",
     ],
+    extras_require={
+        "results": ["pyarrow==4.0.1"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3.9.6",
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1,329 @@
+"""
+Performance analytics of a backtest, computed with numpy over the fills and the PnLSingle stream of a run.
+
+The events of a run are turned into arrays once (RunArrays), from the history returned by Backtester.run()
+or from the files of an ArrowResultsSink. All the metrics below are then vectorized, cheap enough to
+summarize thousands of sweep results.
+
+Equity is realized plus unrealized PnL, in currency, starting from 0. It's sampled at every fill, marked at the
+fill price, and at every PnLSingle event, marked at the touch. Times are int64 nanoseconds since the epoch.
+"""
+import datetime
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from simplebt.events.generic import Event
+from simplebt.events.market import FillEvent, PnLSingleEvent
+from simplebt.position import get_multiplier
+from simplebt.results import BacktestResults
+from simplebt.utils import to_ns
+
+FILL_DTYPES: Dict[str, np.dtype] = {
+    "time": np.dtype(np.int64),
+    "con_id": np.dtype(np.int64),
+    "side": np.dtype(np.int64),
+    "lots": np.dtype(np.int64),
+    "price": np.dtype(np.float64),
+    "multiplier": np.dtype(np.float64),
+    "arrival_bid": np.dtype(np.float64),
+    "arrival_ask": np.dtype(np.float64),
+}
+PNL_DTYPES: Dict[str, np.dtype] = {
+    "time": np.dtype(np.int64),
+    "con_id": np.dtype(np.int64),
+    "equity": np.dtype(np.float64),
+}
+_NS_PER_DAY = 86400 * 1000000000
+
+
+@dataclass(frozen=True)
+class RunArrays:
+    """
+    fills: one array per column of FILL_DTYPES. side is 1 for buys and -1 for sells.
+    The arrival bid and ask are the touch when the order reached the market, NaN if unknown.
+    pnl: one array per column of PNL_DTYPES, equity being realized plus unrealized PnL of the contract.
+    Both are in the order the events were delivered.
+    """
+    fills: Dict[str, np.ndarray]
+    pnl: Dict[str, np.ndarray]
+
+    @classmethod
+    def from_history(cls, events: Iterable[Event]) -> "RunArrays":
+        """
+        From the events of a run, e.g. the history returned by Backtester.run(), plus the PnLSingleEvents
+        collected with Backtester.subscribe() if the equity should be marked between fills too
+        """
+        fill_events: List[FillEvent] = []
+        pnl_events: List[PnLSingleEvent] = []
+        for e in events:
+            if isinstance(e, FillEvent):
+                fill_events.append(e)
+            elif isinstance(e, PnLSingleEvent):
+                pnl_events.append(e)
+        fill_rows = [
+            (
+                to_ns(e.time),
+                e.trade.order.contract.conId,
+                e.fill.order_action.value,
+                e.fill.lots,
+                e.fill.price,
+                get_multiplier(e.trade.order.contract),
+                e.trade.arrival.bid if e.trade.arrival is not None else np.nan,
+                e.trade.arrival.ask if e.trade.arrival is not None else np.nan,
+            )
+            for e in fill_events
+        ]
+        pnl_rows = [
+            (to_ns(e.time), e.pnl.conId, e.pnl.realizedPnL + e.pnl.unrealizedPnL)
+            for e in pnl_events
+        ]
+        return cls(fills=_rows_to_columns(fill_rows, FILL_DTYPES), pnl=_rows_to_columns(pnl_rows, PNL_DTYPES))
+
+    @classmethod
+    def from_results(cls, results: BacktestResults) -> "RunArrays":
+        """From the files of a run stored by an ArrowResultsSink"""
+        fills: pd.DataFrame = results.read("fills")
+        fill_columns = {
+            "time": _to_ns(fills["time"]),
+            "con_id": fills["con_id"].to_numpy(),
+            "side": np.where(fills["action"].to_numpy() == "BUY", 1, -1),
+            "lots": fills["lots"].to_numpy(),
+            "price": fills["price"].to_numpy(),
+            "multiplier": fills["multiplier"].to_numpy(),
+            "arrival_bid": fills["arrival_bid"].to_numpy(),
+            "arrival_ask": fills["arrival_ask"].to_numpy(),
+        }
+        pnl_columns = _rows_to_columns([], PNL_DTYPES)
+        if "pnl" in results.tables:
+            pnl: pd.DataFrame = results.read("pnl", columns=["time", "con_id", "unrealized_pnl", "realized_pnl"])
+            pnl_columns = {
+                "time": _to_ns(pnl["time"]),
+                "con_id": pnl["con_id"].to_numpy(),
+                "equity": (pnl["realized_pnl"] + pnl["unrealized_pnl"]).to_numpy(),
+            }
+        return cls(
+            fills={c: fill_columns[c].astype(dtype) for c, dtype in FILL_DTYPES.items()},
+            pnl={c: pnl_columns[c].astype(dtype) for c, dtype in PNL_DTYPES.items()},
+        )
+
+
+def _rows_to_columns(rows: List[tuple], dtypes: Dict[str, np.dtype]) -> Dict[str, np.ndarray]:
+    if not rows:
+        return {c: np.empty(0, dtype=dtype) for c, dtype in dtypes.items()}
+    return {c: np.array(values, dtype=dtype) for (c, dtype), values in zip(dtypes.items(), zip(*rows))}
+
+
+def _to_ns(times: pd.Series) -> np.ndarray:
+    return pd.DatetimeIndex(times).tz_convert("UTC").tz_localize(None).to_numpy().astype("datetime64[ns]").astype(np.int64)
+
+
+def _group_starts(keys: np.ndarray) -> np.ndarray:
+    """Start index of every run of equal keys, in a sorted array"""
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.int64)
+
+
+def _grouped_cumsum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Cumulative sum restarting at every group start"""
+    cumsum: np.ndarray = np.cumsum(values)
+    offsets: np.ndarray = cumsum[starts] - values[starts]
+    return cumsum - np.repeat(offsets, np.diff(np.r_[starts, len(values)]))
+
+
+@dataclass(frozen=True)
+class _ContractFills:
+    """The fills sorted by contract then delivery order, with the running position and equity of each contract"""
+    order: np.ndarray
+    con_id: np.ndarray
+    starts: np.ndarray
+    position: np.ndarray
+    equity: np.ndarray
+
+
+def _contract_fills(fills: Dict[str, np.ndarray]) -> _ContractFills:
+    order: np.ndarray = np.argsort(fills["con_id"], kind="stable")
+    con_id: np.ndarray = fills["con_id"][order]
+    starts: np.ndarray = _group_starts(con_id)
+    signed_lots: np.ndarray = (fills["side"] * fills["lots"])[order]
+    price: np.ndarray = fills["price"][order]
+    multiplier: np.ndarray = fills["multiplier"][order]
+    position: np.ndarray = _grouped_cumsum(signed_lots, starts)
+    cash: np.ndarray = _grouped_cumsum(-signed_lots * price * multiplier, starts)
+    # Average cost accounting gives the same realized + unrealized PnL as cash + position marked at the fill price
+    return _ContractFills(
+        order=order, con_id=con_id, starts=starts, position=position, equity=cash + position * price * multiplier
+    )
+
+
+def _equity_samples(run: RunArrays) -> Dict[str, np.ndarray]:
+    """Equity samples of every contract, fills first and PnL events second, each in delivery order"""
+    cf: _ContractFills = _contract_fills(run.fills)
+    n_fills, n_pnl = len(cf.order), len(run.pnl["time"])
+    return {
+        "time": np.concatenate([run.fills["time"][cf.order], run.pnl["time"]]),
+        "con_id": np.concatenate([cf.con_id, run.pnl["con_id"]]),
+        "equity": np.concatenate([cf.equity, run.pnl["equity"]]),
+        # Fills are delivered before the PnL events of the same time
+        "rank": np.concatenate([np.zeros(n_fills, dtype=np.int64), np.ones(n_pnl, dtype=np.int64)]),
+        "seq": np.concatenate([cf.order, np.arange(n_pnl)]),
+    }
+
+
+def equity_curve(run: RunArrays, con_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Equity of the portfolio, or of one contract, after every fill and PnL event
+    :return: times, equity
+    """
+    s: Dict[str, np.ndarray] = _equity_samples(run)
+    if con_id is not None:
+        keep: np.ndarray = s["con_id"] == con_id
+        s = {c: a[keep] for c, a in s.items()}
+    # Changes of the equity of each contract, summed up in time order across contracts
+    by_contract: np.ndarray = np.lexsort((s["seq"], s["rank"], s["time"], s["con_id"]))
+    equity: np.ndarray = s["equity"][by_contract]
+    starts: np.ndarray = _group_starts(s["con_id"][by_contract])
+    deltas: np.ndarray = np.diff(np.r_[0., equity])
+    deltas[starts] = equity[starts]
+    in_time: np.ndarray = np.lexsort((s["seq"][by_contract], s["rank"][by_contract], s["time"][by_contract]))
+    return s["time"][by_contract][in_time], np.cumsum(deltas[in_time])
+
+
+def resample_equity(
+    times: np.ndarray,
+    equity: np.ndarray,
+    step: datetime.timedelta,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Last equity at or before every point of the grid start, start + step, ..., end. 0 before the first sample.
+    By default the grid covers the samples
+    """
+    if len(times) == 0 and (start is None or end is None):
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    step_ns: int = int(step / datetime.timedelta(microseconds=1)) * 1000
+    start_ns: int = to_ns(start) if start is not None else int(times[0]) // step_ns * step_ns
+    end_ns: int = to_ns(end) if end is not None else int(times[-1])
+    grid: np.ndarray = np.arange(start_ns, end_ns + step_ns, step_ns, dtype=np.int64)
+    ix: np.ndarray = np.searchsorted(times, grid, side="right") - 1
+    return grid, np.where(ix >= 0, equity[np.maximum(ix, 0)], 0.)
+
+
+def drawdowns(equity: np.ndarray) -> np.ndarray:
+    """Distance below the running peak of the equity, which starts at 0. Non positive"""
+    return equity - np.maximum.accumulate(np.maximum(equity, 0.))
+
+
+def max_drawdown(equity: np.ndarray) -> float:
+    """Largest loss from a peak, as a positive amount"""
+    return float(-drawdowns(equity).min()) if len(equity) else 0.
+
+
+def sharpe_ratio(equity: np.ndarray, periods_per_year: float = 252.) -> float:
+    """Annualized Sharpe ratio of the PnL of every period of a resampled equity curve. NaN without variance"""
+    pnl: np.ndarray = np.diff(np.r_[0., equity])
+    std: float = float(pnl.std(ddof=1)) if len(pnl) > 1 else 0.
+    return float(pnl.mean() / std * np.sqrt(periods_per_year)) if std > 0 else np.nan
+
+
+def round_trips(run: RunArrays) -> Dict[str, np.ndarray]:
+    """
+    PnL of every round trip, from the fill opening a position to the fill closing or flipping it
+    :return: con_id, time of the closing fill and pnl of every round trip, in the order of the contracts
+    """
+    cf: _ContractFills = _contract_fills(run.fills)
+    signed_lots: np.ndarray = (run.fills["side"] * run.fills["lots"])[cf.order]
+    before: np.ndarray = cf.position - signed_lots
+    closes: np.ndarray = (before != 0) & ((cf.position == 0) | (np.sign(cf.position) != np.sign(before)))
+    ix: np.ndarray = np.flatnonzero(closes)
+    equity: np.ndarray = cf.equity[ix]
+    pnl: np.ndarray = np.diff(np.r_[0., equity])
+    # The first round trip of every contract starts from 0
+    first: np.ndarray = np.r_[True, cf.con_id[ix][1:] != cf.con_id[ix][:-1]] if len(ix) else np.empty(0, dtype=bool)
+    pnl[first] = equity[first]
+    return {"con_id": cf.con_id[ix], "time": run.fills["time"][cf.order][ix], "pnl": pnl}
+
+
+def hit_rate(run: RunArrays) -> float:
+    """Share of the round trips with a positive PnL. NaN if there are none"""
+    pnl: np.ndarray = round_trips(run)["pnl"]
+    return float((pnl > 0).mean()) if len(pnl) else np.nan
+
+
+def slippage(run: RunArrays) -> np.ndarray:
+    """
+    Cost of every fill against the touch on arrival, in currency: what was paid above the arrival ask
+    for buys, or received below the arrival bid for sells. NaN when no quote was known on arrival
+    """
+    f: Dict[str, np.ndarray] = run.fills
+    bid: np.ndarray = np.where(f["arrival_bid"] > 0, f["arrival_bid"], np.nan)
+    ask: np.ndarray = np.where(f["arrival_ask"] > 0, f["arrival_ask"], np.nan)
+    per_lot: np.ndarray = np.where(f["side"] > 0, f["price"] - ask, bid - f["price"])
+    return per_lot * f["lots"] * f["multiplier"]
+
+
+def turnover(run: RunArrays) -> Tuple[int, float]:
+    """:return: lots traded, notional traded"""
+    f: Dict[str, np.ndarray] = run.fills
+    return int(f["lots"].sum()), float((f["lots"] * f["price"] * f["multiplier"]).sum())
+
+
+def per_contract(run: RunArrays) -> pd.DataFrame:
+    """Fills, turnover, PnL, drawdown, round trips, hit rate and slippage of every contract"""
+    f: Dict[str, np.ndarray] = run.fills
+    con_ids, inverse = np.unique(np.r_[f["con_id"], run.pnl["con_id"]], return_inverse=True)
+    fill_ix: np.ndarray = inverse[:len(f["con_id"])]
+    n: int = len(con_ids)
+    trips: Dict[str, np.ndarray] = round_trips(run)
+    trip_ix: np.ndarray = np.searchsorted(con_ids, trips["con_id"])
+    n_trips: np.ndarray = np.bincount(trip_ix, minlength=n)
+    costs: np.ndarray = slippage(run)
+    known: np.ndarray = ~np.isnan(costs)
+    stats = {
+        "fills": np.bincount(fill_ix, minlength=n),
+        "lots": np.bincount(fill_ix, weights=f["lots"], minlength=n).astype(np.int64),
+        "notional": np.bincount(fill_ix, weights=f["lots"] * f["price"] * f["multiplier"], minlength=n),
+        "pnl": np.zeros(n),
+        "max_drawdown": np.zeros(n),
+        "round_trips": n_trips,
+        "hit_rate": np.bincount(trip_ix, weights=trips["pnl"] > 0, minlength=n) / np.where(n_trips > 0, n_trips, np.nan),
+        "slippage": np.bincount(fill_ix[known], weights=costs[known], minlength=n),
+    }
+    for i, con_id in enumerate(con_ids.tolist()):
+        _, equity = equity_curve(run, con_id=con_id)
+        if len(equity):
+            stats["pnl"][i] = equity[-1]
+            stats["max_drawdown"][i] = max_drawdown(equity)
+    return pd.DataFrame(stats, index=pd.Index(con_ids, name="con_id"))
+
+
+def summarize(
+    run: RunArrays, step: datetime.timedelta = datetime.timedelta(days=1), periods_per_year: float = 252.
+) -> Dict[str, float]:
+    """
+    Headline numbers of a run
+    :param step: resampling period of the equity for the Sharpe ratio, periods_per_year being the number of such periods
+    """
+    times, equity = equity_curve(run)
+    _, resampled = resample_equity(times, equity, step=step)
+    lots, notional = turnover(run)
+    costs: np.ndarray = slippage(run)
+    costed: np.ndarray = ~np.isnan(costs)
+    trips: Dict[str, np.ndarray] = round_trips(run)
+    return {
+        "pnl": float(equity[-1]) if len(equity) else 0.,
+        "max_drawdown": max_drawdown(equity),
+        "sharpe": sharpe_ratio(resampled, periods_per_year=periods_per_year),
+        "round_trips": len(trips["pnl"]),
+        "hit_rate": float((trips["pnl"] > 0).mean()) if len(trips["pnl"]) else np.nan,
+        "lots": lots,
+        "notional": notional,
+        "slippage": float(np.nansum(costs)),
+        "slippage_per_lot": float(np.nansum(costs) / run.fills["lots"][costed].sum()) if costed.any() else np.nan,
+    }
+
+
+def summarize_backtest(bt, history: List[Event]) -> Dict[str, float]:
+    """summarize() of the history of a run, e.g. as the summarize function of a sweep. Equity is marked at the fills only"""
+    return summarize(RunArrays.from_history(history))
@@ -1,25 +1,34 @@
 import collections
-import itertools
+import heapq
 import logging
 import datetime
-import queue
-from typing import Dict, List, Optional
+import pathlib
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple, Type, Union
 import ib_insync as ibi
+import numpy as np
 
+from simplebt.checkpoint import Checkpoint, read_checkpoint, write_checkpoint
+from simplebt.db import DbPool
+from simplebt.events.bus import EventBus
 from simplebt.events.generic import Event
 from simplebt.events.orders import OrderReceivedEvent, OrderCanceledEvent
+from simplebt.historical_data.utils.bars import parse_bar_size
 from simplebt.market import Market
 from simplebt.events.market import FillEvent, PnLSingleEvent, PendingTickersEvent
-from simplebt.orders import Order
-from simplebt.position import Position, PnLSingle
-from simplebt.strategy import StrategyInterface
-from simplebt.ticker import TickByTickBidAsk, Ticker
+from simplebt.orders import Order, OrderIntent
+from simplebt.position import Portfolio, Position, PnLSingle, calc_unrealized_pnls
+from simplebt.profiling import Profiler
+from simplebt.results import ResultsSink
+from simplebt.strategy import BatchStrategyInterface, StrategyInterface
+from simplebt.ticker import AllLastTickBatch, BarBatch, BidAskTickBatch, TickByTickBidAsk, Ticker
 from simplebt.trade import StrategyTrade
 
 
 logger = logging.getLogger("Backtester")
 logger.setLevel(logging.INFO)
 
+PNL_POLICIES: Tuple[str, ...] = ("tick", "step", "interval")
+
 
 class Backtester:
     def __init__(
@@ -29,33 +38,259 @@ class Backtester:
         end_time: datetime.datetime,
         time_step: datetime.timedelta,
         # shuffle_events: bool = None,
+        loader_window: Optional[datetime.timedelta] = None,
+        merge_tick_types: bool = False,
+        server_side_cursor: bool = False,
+        db_connection=None,
+        db_pool: Optional[DbPool] = None,
+        binary_results: bool = False,
+        tick_cache_dir: Optional[pathlib.Path] = None,
+        event_driven: bool = False,
+        heartbeat: Optional[datetime.timedelta] = None,
+        heartbeat_origin: Optional[datetime.datetime] = None,
+        skip_closed_sessions: bool = False,
+        profile: bool = False,
+        bar_size: Optional[str] = None,
+        pnl_policy: str = "tick",
+        pnl_interval: Optional[datetime.timedelta] = None,
+        results_sink: Optional[ResultsSink] = None,
+        history_limit: Optional[int] = None,
+        checkpoint_path: Optional[pathlib.Path] = None,
+        checkpoint_every: Optional[datetime.timedelta] = None,
     ):
+        """
+        :param loader_window: Have every Market prefetch its ticks one window at a time (e.g. 1 hour)
+        instead of running a query per time_step.
+        :param merge_tick_types: Have every Market read trades and bid/ask ticks with a single query.
+        :param server_side_cursor: Fill the prefetch windows from forward-only named cursors.
+        :param db_connection: Share one database connection across all the Markets' loaders.
+        :param db_pool: Have all the Markets' loaders borrow their connections from this pool (see get_shared_pool).
+        With server_side_cursor, every stream holds one of them for the whole run: maxconn must be larger than
+        the number of streams, one per contract, or two without merge_tick_types.
+        :param binary_results: Fetch the prefetch windows in the binary COPY format.
+        :param tick_cache_dir: Replay the ticks from the local columnar cache (see build_ticks_cache)
+        instead of the database.
+        :param event_driven: Instead of visiting every time_step, jump straight to the next time_step
+        at which at least one market has ticks. Idle stretches are skipped.
+        :param heartbeat: Only used with event_driven. Also stop every heartbeat (a multiple of time_step),
+        ticks or not, for strategies that need to be called regularly.
+        :param heartbeat_origin: Only used with heartbeat. Beat at heartbeat_origin + n * heartbeat instead of
+        from start_time, e.g. to keep the heartbeats of a longer run that this one is a part of.
+        :param skip_closed_sessions: While all the markets are closed, jump to the next session open
+        without loading any tick nor calling the strategy.
+        :param profile: Record wall time, call counts and latencies of every phase of the loop in self.profiler.
+        :param bar_size: Replay the bars of this size (e.g. "1 min") stored in the DbBars tables instead of the ticks,
+        through the same strategy interface. Bars are delivered at their close: time_step must divide the bar size
+        and start_time fall on a bar boundary. See build_bars to aggregate them from the ticks.
+        :param pnl_policy: When to emit the PnLSingleEvents of the held positions: "tick" for every distinct quote,
+        "step" for the last quote of every time_step, "interval" for the last quote at most once every pnl_interval.
+        :param results_sink: Stream the order, cancel, fill (and PnL) events to this sink as they are delivered,
+        e.g. an ArrowResultsSink writing them to Parquet files. It's closed at the end of run().
+        :param history_limit: Only keep the last history_limit events of the history returned by run(). 0 keeps none,
+        None keeps them all.
+        :param checkpoint_path: Save a Checkpoint of the run there every checkpoint_every and at the end of run(),
+        to resume it with restore() after a crash or extend it to a later end_time.
+        :param checkpoint_every: Backtest time between two checkpoints, e.g. 1 day. Only used with checkpoint_path.
+        """
         if start_time.tzinfo != datetime.timezone.utc:
             raise ValueError(f"Parameter start_time should have tzinfo=datetime.timezone.utc, got {start_time.tzinfo}")
+        self.start_time = start_time
         self.time = start_time
         if end_time.tzinfo != datetime.timezone.utc:
             raise ValueError(f"Parameter end_time should have tzinfo=datetime.timezone.utc, got {end_time.tzinfo}")
         self.end_time = end_time
         self.time_step = time_step
-       
+        self.event_driven = event_driven
+        self.heartbeat = heartbeat
+        self.skip_closed_sessions = skip_closed_sessions
+        if pnl_policy not in PNL_POLICIES:
+            raise ValueError(f"pnl_policy should be one of {PNL_POLICIES}, got {pnl_policy}")
+        if pnl_policy == "interval" and pnl_interval is None:
+            raise ValueError("pnl_policy interval requires a pnl_interval")
+        self.pnl_policy: str = pnl_policy
+        self.pnl_interval: Optional[datetime.timedelta] = pnl_interval
+        self._last_pnl_time: Dict[int, datetime.datetime] = {}
+        if checkpoint_every is not None and checkpoint_path is None:
+            raise ValueError("checkpoint_every requires a checkpoint_path")
+        self.checkpoint_path: Optional[pathlib.Path] = checkpoint_path
+        self.checkpoint_every: Optional[datetime.timedelta] = checkpoint_every
+        self._next_checkpoint: Optional[datetime.datetime] = (
+            start_time + checkpoint_every if checkpoint_every is not None else None
+        )
+        self._next_heartbeat: Optional[datetime.datetime] = None
+        if heartbeat and heartbeat_origin is not None:
+            n, remainder = divmod(start_time - heartbeat_origin, heartbeat)
+            self._next_heartbeat = heartbeat_origin + (n + bool(remainder)) * heartbeat
+        if bar_size is not None and parse_bar_size(bar_size).duration % time_step:
+            raise ValueError(f"time_step {time_step} should divide bar_size {bar_size}, or bar closes are skipped")
+        streams_ticks: bool = (
+            server_side_cursor and loader_window is not None and bar_size is None and tick_cache_dir is None
+        )
+        if db_pool is not None and streams_ticks:
+            self._check_pool_size(db_pool=db_pool, streams=len(contracts) * (1 if merge_tick_types else 2))
+
         self.mkts: Dict[int, Market] = {
-            c.conId: Market(contract=c, start_time=start_time)
+            c.conId: Market(
+                contract=c,
+                start_time=start_time,
+                loader_window=loader_window,
+                merge_tick_types=merge_tick_types,
+                server_side_cursor=server_side_cursor,
+                db_connection=db_connection,
+                db_pool=db_pool,
+                binary_results=binary_results,
+                tick_cache_dir=tick_cache_dir,
+                end_time=end_time,
+                skip_closed_sessions=skip_closed_sessions,
+                bar_size=bar_size,
+            )
             for c in contracts
         }
-        self._positions: List[Position] = [Position(c) for c in contracts]
+        self._portfolio: Portfolio = Portfolio(contracts)
 
-        self._events: "queue.Queue[Event]" = queue.Queue()
+        self._events: EventBus = EventBus()
         # self.shuffle_events: bool = shuffle_events or False
-        self._bt_history_of_events: List[Event] = []
+        self._bt_history_of_events: Deque[Event] = collections.deque(maxlen=history_limit)
+        # Number of events recorded since start_time, including those of the runs resumed from
+        self._history_count: int = 0
+        self.results_sink: Optional[ResultsSink] = results_sink
+        self._subscribe_results(record_history=history_limit != 0)
+
+        self.strat: Union[StrategyInterface, BatchStrategyInterface] = None
+        # Ticks of the current window of a BatchStrategyInterface, and the end of that window
+        self._window_tickers: Dict[int, List[Ticker]] = {}
+        self._window_end: Optional[datetime.datetime] = None
+        self._strat_subscriptions: List[Tuple[Type[Event], Callable[[Event], None]]] = []
+        self.profiler: Optional[Profiler] = Profiler() if profile else None
 
-        self.strat: StrategyInterface = None
+    def _subscribe_results(self, record_history: bool):
+        """Have the order, cancel and fill events recorded in the history and written to the results sink"""
+        if record_history:
+            for event_type in (OrderReceivedEvent, OrderCanceledEvent, FillEvent):
+                self._events.subscribe(event_type, self._record_history)
+        if self.results_sink is not None:
+            for event_type in (OrderReceivedEvent, OrderCanceledEvent, FillEvent):
+                self._events.subscribe(event_type, self.results_sink.write)
+            if self.results_sink.include_pnl:
+                self._events.subscribe(PnLSingleEvent, self.results_sink.write)
 
-    def set_strat(self, strat: StrategyInterface):
+    @staticmethod
+    def _check_pool_size(db_pool: DbPool, streams: int):
+        """One pooled connection held by every ticks stream, and at least one left for the other queries"""
+        if db_pool.maxconn <= streams:
+            raise ValueError(
+                f"{streams} ticks streams need a db_pool with maxconn > {streams}, got {db_pool.maxconn}: "
+                f"e.g. DbPool(maxconn={streams + 1})"
+            )
+
+    def set_strat(self, strat: Union[StrategyInterface, BatchStrategyInterface]):
+        for event_type, callback in self._strat_subscriptions:
+            self._events.unsubscribe(event_type, callback)
         self.strat = strat
+        self._window_tickers, self._window_end = {}, None
+        if isinstance(strat, BatchStrategyInterface):
+            if strat.window % self.time_step:
+                raise ValueError(f"time_step {self.time_step} should divide the window {strat.window} of the strategy")
+            self._strat_subscriptions = [(PendingTickersEvent, self._collect_window)]
+            self._events.subscribe(PendingTickersEvent, self._collect_window)
+            return
+        # The strategy methods are looked up at every call, so that they can be wrapped after subscribing
+        callbacks: Dict[Type[Event], Callable[[Event], None]] = {
+            PendingTickersEvent: lambda e: self.strat.on_pending_tickers_event(tickers=e.tickers),
+            OrderReceivedEvent: lambda e: self.strat.on_new_order_event(trade=e.trade),
+            OrderCanceledEvent: lambda e: self.strat.on_new_order_event(trade=e.trade),
+            FillEvent: lambda e: self.strat.on_exec_details_event(trade=e.trade, fill=e.fill),
+            PnLSingleEvent: lambda e: self.strat.on_pnl_single_event(pnl=e.pnl),
+        }
+        self._strat_subscriptions = [(event_type, callbacks[event_type]) for event_type in strat.event_subscriptions]
+        for event_type, callback in self._strat_subscriptions:
+            self._events.subscribe(event_type, callback)
+
+    def subscribe(self, event_type: Type[Event], callback: Callable[[Event], None]):
+        """Have callback called with every event of that type, e.g. to collect analytics during the run"""
+        self._events.subscribe(event_type, callback)
+
+    def _record_history(self, event: Event):
+        self._bt_history_of_events.append(event)
+        self._history_count += 1
+
+    @property
+    def history_offset(self) -> int:
+        """Number of events recorded before the first one of the history returned by run()"""
+        return self._history_count - len(self._bt_history_of_events)
+
+    def checkpoint(self, resume_time: Optional[datetime.datetime] = None) -> Checkpoint:
+        """
+        The state of the run between two steps
+        :param resume_time: the next time to process when resuming, self.time by default
+        """
+        return Checkpoint(
+            time=resume_time if resume_time is not None else self.time,
+            start_time=self.start_time,
+            end_time=self.end_time,
+            time_step=self.time_step,
+            markets={con_id: mkt.get_state() for con_id, mkt in self.mkts.items()},
+            portfolio=self._portfolio,
+            last_pnl_time=dict(self._last_pnl_time),
+            next_heartbeat=self._next_heartbeat,
+            history_offset=self._history_count,
+            window=(self._window_end, self._window_tickers) if self._window_end is not None else None,
+            strategy_state=self.strat.get_state() if self.strat is not None else None,
+        )
+
+    def save_checkpoint(self, path: Optional[pathlib.Path] = None, resume_time: Optional[datetime.datetime] = None):
+        path = path if path is not None else self.checkpoint_path
+        if path is None:
+            raise ValueError("No checkpoint_path to save the checkpoint to")
+        checkpoint: Checkpoint = self.checkpoint(resume_time=resume_time)
+        write_checkpoint(checkpoint=checkpoint, path=path)
+        logger.debug(f"Checkpoint at {checkpoint.time} saved to {path}")
+
+    def restore(self, path: Optional[pathlib.Path] = None):
+        """
+        Resume from a checkpoint saved by a run with the same contracts, start_time and time_step.
+        end_time may be later than the checkpointed one, to extend a finished run. Set the strategy first,
+        so that its state is restored too. The history returned by run() only has the events after the checkpoint.
+        """
+        path = path if path is not None else self.checkpoint_path
+        if path is None:
+            raise ValueError("No checkpoint_path to restore the checkpoint from")
+        cp: Checkpoint = read_checkpoint(path=path)
+        if set(cp.markets) != set(self.mkts):
+            raise ValueError(f"Checkpoint is for conIds {sorted(cp.markets)}, got {sorted(self.mkts)}")
+        if cp.start_time != self.start_time or cp.time_step != self.time_step:
+            raise ValueError(
+                f"Checkpoint is for start_time {cp.start_time} and time_step {cp.time_step}, "
+                f"got {self.start_time} and {self.time_step}"
+            )
+        self.time = cp.time
+        for con_id, state in cp.markets.items():
+            self.mkts[con_id].set_state(state)
+        self._portfolio = cp.portfolio
+        self._last_pnl_time = dict(cp.last_pnl_time)
+        self._next_heartbeat = cp.next_heartbeat
+        self._history_count = cp.history_offset
+        self._window_end, self._window_tickers = cp.window if cp.window is not None else (None, {})
+        self._bt_history_of_events.clear()
+        if self.checkpoint_every is not None:
+            self._next_checkpoint = self._align_to_clock(self.time + self.checkpoint_every)
+        if self.strat is not None:
+            self.strat.set_state(cp.strategy_state)
+        logger.info(f"Resuming at {self.time} from the checkpoint {path}")
+
+    def _maybe_checkpoint(self, resume_time: datetime.datetime):
+        """Called between two steps, resume_time being the next time to process"""
+        if self._next_checkpoint is not None and resume_time >= self._next_checkpoint:
+            self.save_checkpoint(resume_time=resume_time)
+            self._next_checkpoint = self._align_to_clock(resume_time + self.checkpoint_every)
 
     # @property
     def positions(self) -> List[Position]:
-        return self._positions
+        return list(self._portfolio)
+
+    @property
+    def portfolio(self) -> Portfolio:
+        return self._portfolio
 
     def get_best(self, contract: ibi.Contract) -> TickByTickBidAsk:
         return self.mkts[contract.conId].get_book_best()
@@ -66,6 +301,18 @@ class Backtester:
         self._events.put(OrderReceivedEvent(time=trade.time, trade=trade))
         return trade
 
+    def place_orders(self, orders: List[Order]) -> List[StrategyTrade]:
+        """place_order() for a batch of orders, added to each Market in one go"""
+        by_market: Dict[int, List[Order]] = {}
+        for order in orders:
+            by_market.setdefault(order.contract.conId, []).append(order)
+        trades: List[StrategyTrade] = []
+        for con_id, mkt_orders in by_market.items():
+            trades += self.mkts[con_id].add_orders(orders=mkt_orders)
+        for trade in trades:
+            self._events.put(OrderReceivedEvent(time=trade.time, trade=trade))
+        return trades
+
     def cancel_order(self, order: Order) -> StrategyTrade:
         mkt: Market = self.mkts[order.contract.conId]
         # if random.randint(0, 10) > 1:  # some randomness here
@@ -74,30 +321,32 @@ class Backtester:
         return canceled_trade
 
     def _update_positions(self, fill_events: List[FillEvent]):
-        def update_single_position(position: Position):
-            # if position.contract in map(lambda e: e.trade.order.contract, fill_events):
-            for event in filter(lambda x: x.trade.order.contract == position.contract, fill_events):
-                position.update(fill=event.fill)
-            return position
-
-        self._positions = list(map(lambda p: update_single_position(p), self._positions))
+        for event in fill_events:
+            self._portfolio.update(con_id=event.trade.order.contract.conId, fill=event.fill)
 
-    def _set_mkts_time(self, time: datetime.datetime):
-        for mkt in self.mkts.values():
-            mkt.set_time(time=time)
+    def _set_mkts_time(self, time: datetime.datetime, due: Optional[Set[int]] = None):
+        """
+        :param due: conIds of the markets that have ticks at time. The others are moved to time without loading.
+        None means all markets are loaded.
+        """
+        for con_id, mkt in self.mkts.items():
+            if due is None or con_id in due:
+                mkt.set_time(time=time)
+            else:
+                mkt.skip_to(time=time)
 
     def _add_new_mkt_events_to_queue(self):
         fill_events: List[FillEvent] = self._get_mkts_fill_events()
         pending_tickers: PendingTickersEvent = self._get_pending_tickers_events()
-        pnls: List[PnLSingleEvent] = list(itertools.chain(
-            *(self._get_pnl_events(ticker=t) for t in pending_tickers.tickers))
-        )
+        pnls: List[PnLSingleEvent] = []
+        if self._events.has_subscribers(PnLSingleEvent):
+            pnls = self._get_pnl_events(tickers=pending_tickers.tickers)
 
         for e in fill_events:
             self._events.put(e)
         for e in pnls:
             self._events.put(e)
-        if pending_tickers:
+        if pending_tickers.tickers:
             self._events.put(pending_tickers)  # IBKR pass these in batches
 
     def _get_mkts_fill_events(self) -> List[FillEvent]:
@@ -116,59 +365,224 @@ class Backtester:
                 _tickers.append(_t)
         return PendingTickersEvent(time=self.time, tickers=_tickers)
 
-    def _get_pnl_events(self, ticker: Ticker) -> List[PnLSingleEvent]:
+    def _get_pnl_events(self, tickers: List[Ticker]) -> List[PnLSingleEvent]:
         """
-        If there are change best, the method calculates a pnl and spits an event
+        Unrealized PnL of the held positions of the tickers with new bid/ask ticks, following pnl_policy.
+        The PnLs of all the contracts are computed at once over the quotes to emit.
         """
+        held: List[Tuple[Position, np.ndarray, np.ndarray]] = []
+        for ticker in tickers:
+            position: Position = self._portfolio[ticker.contract.conId]
+            if position.position == 0 or len(ticker.bidasks) == 0:
+                continue
+            if self.pnl_policy == "interval":
+                last: Optional[datetime.datetime] = self._last_pnl_time.get(ticker.contract.conId)
+                if last is not None and self.time - last < self.pnl_interval:
+                    continue
+                self._last_pnl_time[ticker.contract.conId] = self.time
+            bid, ask = ticker.bidasks.bid, ticker.bidasks.ask
+            if self.pnl_policy == "tick":
+                ix: np.ndarray = self._first_unique_quotes(bid=bid, ask=ask)
+                held.append((position, bid[ix], ask[ix]))
+            else:  # the last quote only
+                held.append((position, bid[-1:], ask[-1:]))
+        if not held:
+            return []
+
+        counts: List[int] = [len(bid) for _, bid, _ in held]
+        positions: List[Position] = [p for p, _, _ in held]
+        unrealized_pnls: np.ndarray = calc_unrealized_pnls(
+            bid=np.concatenate([bid for _, bid, _ in held]),
+            ask=np.concatenate([ask for _, _, ask in held]),
+            position=np.repeat([p.position for p in positions], counts),
+            avg_cost=np.repeat([p.avg_cost for p in positions], counts),
+            multiplier=np.repeat([p.multiplier for p in positions], counts),
+        )
+        owners: List[Position] = [p for p, n in zip(positions, counts) for _ in range(n)]
         pnl_events: List[PnLSingleEvent] = []
-        position: Position = next(filter(lambda p: p.contract == ticker.contract, self.positions()))
-        if position.position != 0:
-            change_bests_ticks = filter(lambda tick: isinstance(tick, TickByTickBidAsk), ticker.tickByTicks)
-            change_bests_prices = ((i.bid, i.ask) for i in change_bests_ticks)
-            unique_change_bests_prices = collections.OrderedDict.fromkeys(change_bests_prices)
-            for bid, ask in unique_change_bests_prices:
-                pnl = self._calc_unrealized_pnl(bid=bid, ask=ask, position=position)
-                pnl_events.append(PnLSingleEvent(time=self.time, pnl=pnl))
+        for position, unrealized_pnl in zip(owners, unrealized_pnls.tolist()):
+            pnl = PnLSingle(
+                conId=position.contract.conId,
+                position=position.position,
+                unrealizedPnL=unrealized_pnl,
+                realizedPnL=position.realized_pnl,
+            )
+            pnl_events.append(PnLSingleEvent(time=self.time, pnl=pnl))
         return pnl_events
 
     @staticmethod
-    def _calc_unrealized_pnl(bid: float, ask: float, position: Position) -> PnLSingle:
-        if position.position > 0:
-            delta = bid - position.avg_cost
-        else:
-            delta = position.avg_cost - ask
-        unrealized_pnl: float = delta * abs(position.position)
-        if isinstance(position.contract, ibi.Future):
-            unrealized_pnl *= float(position.contract.multiplier)
-        logger.debug(f"With bid={bid} ask={ask} - unrealized PNL on contract {position.contract.symbol}: {unrealized_pnl}")
-        return PnLSingle(conId=position.contract.conId, position=position.position, unrealizedPnL=unrealized_pnl)
+    def _first_unique_quotes(bid: np.ndarray, ask: np.ndarray) -> np.ndarray:
+        """Indices of the first occurrence of every distinct (bid, ask) pair, in order of appearance"""
+        if len(bid) == 1:
+            return np.zeros(1, dtype=np.int64)
+        # One complex number per pair: np.unique on 1d arrays is much faster than on rows
+        _, first = np.unique(bid + 1j * ask, return_index=True)
+        return np.sort(first)
 
     def _forward_event_to_strategy(self, event: Event):
-        if isinstance(event, PendingTickersEvent):
-            self.strat.on_pending_tickers_event(tickers=event.tickers)
-        elif isinstance(event, OrderReceivedEvent) or isinstance(event, OrderCanceledEvent):
-            self._bt_history_of_events.append(event)
-            self.strat.on_new_order_event(trade=event.trade)
-        elif isinstance(event, FillEvent):
-            self._bt_history_of_events.append(event)
-            self.strat.on_exec_details_event(trade=event.trade, fill=event.fill)
-        elif isinstance(event, PnLSingleEvent):
-            self.strat.on_pnl_single_event(pnl=event.pnl)
+        """Order and fill events are recorded in the history first, then passed to the subscribers"""
+        self._events.dispatch(event)
+
+    def _collect_window(self, event: PendingTickersEvent):
+        for ticker in event.tickers:
+            self._window_tickers.setdefault(ticker.contract.conId, []).append(ticker)
+        if self._window_end is None:
+            # First time on the start_time + n * window grid at or after the ticks
+            n, remainder = divmod(self.time - self.start_time, self.strat.window)
+            self._window_end = self.start_time + (n + bool(remainder)) * self.strat.window
+
+    def _flush_window(self):
+        """Hand the ticks of the window to the batch strategy and send its orders, stamped at the end of the window"""
+        tickers: List[Ticker] = []
+        for batches in self._window_tickers.values():
+            bars: List[BarBatch] = [t.bars for t in batches if t.bars is not None]
+            bidask_bars: List[BarBatch] = [t.bidask_bars for t in batches if t.bidask_bars is not None]
+            tickers.append(Ticker(
+                contract=batches[0].contract,
+                trades=AllLastTickBatch.concat(t.trades for t in batches),
+                bidasks=BidAskTickBatch.concat(t.bidasks for t in batches),
+                bars=BarBatch.concat(bars) if bars else None,
+                bidask_bars=BarBatch.concat(bidask_bars) if bidask_bars else None,
+            ))
+        time: datetime.datetime = self._window_end
+        self._window_tickers, self._window_end = {}, None
+        intents: Optional[List[OrderIntent]] = self.strat.on_ticks_window(time=time, tickers=tickers)
+        if intents:
+            self.place_orders(orders=[intent.to_order(time=time) for intent in intents])
+
+    def _step(self, due: Optional[Set[int]] = None):
+        logger.debug(f"Next timestamp: {self.time}")
+        if self._window_end is not None and self._window_end < self.time:
+            # The event-driven clock skipped the end of the window: close it before moving the markets,
+            # so that the orders reach them as they would have at the end of the window
+            self._flush_window()
+        self._events.next_step()
+        self._set_mkts_time(time=self.time, due=due)
+        self._add_new_mkt_events_to_queue()
+        if isinstance(self.strat, StrategyInterface):
+            self.strat.set_time(self.time)
+        while self._events:
+            self._forward_event_to_strategy(event=self._events.pop())
+        if self._window_end is not None and self._window_end <= self.time:
+            self._flush_window()
+            while self._events:
+                self._forward_event_to_strategy(event=self._events.pop())
+
+    def _align_to_clock(self, time: datetime.datetime) -> datetime.datetime:
+        """First time on the start_time + n * time_step grid at or after time"""
+        n, remainder = divmod(time - self.start_time, self.time_step)
+        if remainder:
+            n += 1
+        return self.start_time + n * self.time_step
+
+    def _get_next_session_open(self) -> datetime.datetime:
+        """First time on the clock at which a market is open. Past end_time if none opens again"""
+        next_opens: List[datetime.datetime] = [
+            t for t in (mkt.get_next_open(time=self.time) for mkt in self.mkts.values()) if t is not None
+        ]
+        if not next_opens:
+            return self._align_to_clock(self.end_time + self.time_step)
+        return self._align_to_clock(min(next_opens))
+
+    def _push_next_tick_time(self, heap: List[Tuple[datetime.datetime, int]], con_id: int, time: datetime.datetime):
+        next_tick_time: Optional[datetime.datetime] = self.mkts[con_id].get_next_tick_time(time=time)
+        if next_tick_time is not None and next_tick_time <= self.end_time:
+            heapq.heappush(heap, (self._align_to_clock(next_tick_time), con_id))
+
+    def _run_event_driven(self):
+        """
+        Keep a heap with the next tick time of every market and jump straight to the earliest one.
+        Only the markets with ticks at that time are loaded. Ticks that are not on the clock grid are
+        skipped, as the fixed clock would do.
+        """
+        heap: List[Tuple[datetime.datetime, int]] = []
+        for con_id in self.mkts:
+            self._push_next_tick_time(heap=heap, con_id=con_id, time=self.time)
+        if self.heartbeat and self._next_heartbeat is None:
+            self._next_heartbeat = self.time
+
+        while heap or self._next_heartbeat is not None:
+            next_times: List[datetime.datetime] = [heap[0][0]] if heap else []
+            if self._next_heartbeat is not None:
+                next_times.append(self._next_heartbeat)
+            self.time = min(next_times)
+            if self.time > self.end_time:
+                break
+            due: Set[int] = set()
+            while heap and heap[0][0] == self.time:
+                due.add(heapq.heappop(heap)[1])
+            self._step(due=due)
+            for con_id in due:
+                self._push_next_tick_time(heap=heap, con_id=con_id, time=self.time + self.time_step)
+            if self._next_heartbeat is not None and self._next_heartbeat <= self.time:
+                self._next_heartbeat = self._align_to_clock(self._next_heartbeat + self.heartbeat)
+            # Resuming right after this step pushes the same next tick times to the heap
+            self._maybe_checkpoint(resume_time=self.time + self.time_step)
+        self.time = self._align_to_clock(self.end_time + self.time_step)
+
+    def _instrument(self):
+        """Have the profiler time the phases of the loop, down to each market, loader and strategy callback"""
+        p: Profiler = self.profiler
+        p.wrap(self, "_set_mkts_time", "set_mkts_time")
+        p.wrap(self, "_get_mkts_fill_events", "get_mkts_fill_events")
+        p.wrap(self, "_get_pnl_events", "get_pnl_events")
+        p.wrap(self, "_forward_event_to_strategy", "forward_event_to_strategy")
+        if isinstance(self.strat, BatchStrategyInterface):
+            p.wrap(self, "_flush_window", "flush_window")
+            p.wrap(self.strat, "on_ticks_window", "strategy.on_ticks_window")
         else:
-            raise ValueError(f"Got unexpected event: {event}")
+            callbacks = (
+                "set_time", "on_pending_tickers_event", "on_new_order_event", "on_exec_details_event", "on_pnl_single_event"
+            )
+            for name in callbacks:
+                p.wrap(self.strat, name, f"strategy.{name}")
+        for mkt in self.mkts.values():
+            c: ibi.Contract = mkt.contract
+            prefix = f"market[{c.symbol} {c.lastTradeDateOrContractMonth} {c.conId}]"
+            p.wrap(mkt, "set_time", f"{prefix}.set_time")
+            p.wrap(mkt, "skip_to", f"{prefix}.skip_to")
+            p.wrap(mkt, "_update_cal_and_get_event", f"{prefix}.calendar")
+            p.wrap(mkt, "_process_pending_orders", f"{prefix}.matching")
+            loaders = {
+                "merged": mkt._ticks_loader,
+                "trades": mkt._trades_loader,
+                "bidask": mkt._bidask_loader,
+                "bars": mkt._bars_loader,
+            }
+            for loader_name, loader in loaders.items():
+                if loader is not None:
+                    p.wrap(loader, "get_ticks_batch_by_time", f"{prefix}.loader.{loader_name}.get_ticks")
+                    p.wrap(loader, "get_next_tick_time", f"{prefix}.loader.{loader_name}.next_tick_time")
 
     def run(self) -> List[Event]:
+        """
+        :return: the history of order and fill events, capped by history_limit. After restore(), only those
+        following the checkpoint: history_offset events came before.
+        With profile=True, the stats of every phase of the loop are in self.profiler.stats
+        """
         if not self.strat:
             raise AttributeError("First set a strategy")
-        while self.time <= self.end_time:
-            logger.debug(f"Next timestamp: {self.time}")
-            self._set_mkts_time(time=self.time)
-            self._add_new_mkt_events_to_queue()
-            self.strat.set_time(self.time)
-            while not self._events.empty():
-                e = self._events.get_nowait()
-                self._forward_event_to_strategy(event=e)
-            self.time += self.time_step
+        if self.profiler is not None:
+            self._instrument()
+        if self.event_driven:
+            self._run_event_driven()
+        else:
+            while self.time <= self.end_time:
+                if self.skip_closed_sessions and not any(mkt.is_open(self.time) for mkt in self.mkts.values()):
+                    self.time = self._get_next_session_open()
+                    continue
+                self._step()
+                self.time += self.time_step
+                self._maybe_checkpoint(resume_time=self.time)
+        if self._window_end is not None and self._window_end <= self.end_time:
+            # The event-driven clock stops at the last tick, before the end of its window
+            self._flush_window()
+            while self._events:
+                self._forward_event_to_strategy(event=self._events.pop())
 
+        if self.checkpoint_path is not None:
+            self.save_checkpoint()
+        if self.results_sink is not None:
+            self.results_sink.close()
         logger.info("Hey jerk! We're done backtesting. You happy with the results?")
-        return self._bt_history_of_events
+        return list(self._bt_history_of_events)
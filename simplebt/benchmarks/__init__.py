@@ -0,0 +1,31 @@
+from ._scenarios import (
+    DB_LOADER_MODES,
+    BenchmarkResult,
+    CountingStrategy,
+    bench_backtester_run,
+    bench_cached_loaders,
+    bench_db_loaders,
+    bench_market_set_time,
+    bench_pending_orders,
+    bench_position_update,
+    format_report,
+)
+from ._synthetic import SyntheticSession, generate_day, synthetic_contracts, write_synthetic_cache, write_synthetic_db
+
+__all__ = (
+    "DB_LOADER_MODES",
+    "BenchmarkResult",
+    "CountingStrategy",
+    "SyntheticSession",
+    "bench_backtester_run",
+    "bench_cached_loaders",
+    "bench_db_loaders",
+    "bench_market_set_time",
+    "bench_pending_orders",
+    "bench_position_update",
+    "format_report",
+    "generate_day",
+    "synthetic_contracts",
+    "write_synthetic_cache",
+    "write_synthetic_db",
+)
@@ -0,0 +1,76 @@
+"""
+Run the benchmark suite on synthetic ticks: python -m simplebt.benchmarks
+"""
+import argparse
+import datetime
+import pathlib
+import tempfile
+from typing import List
+
+from simplebt.benchmarks import (
+    DB_LOADER_MODES,
+    BenchmarkResult,
+    SyntheticSession,
+    bench_backtester_run,
+    bench_cached_loaders,
+    bench_db_loaders,
+    bench_market_set_time,
+    bench_pending_orders,
+    bench_position_update,
+    format_report,
+    synthetic_contracts,
+    write_synthetic_cache,
+    write_synthetic_db,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the backtester on synthetic ticks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--contracts", type=int, default=2, help="Number of synthetic contracts")
+    parser.add_argument("--days", type=int, default=1, help="Number of synthetic sessions")
+    parser.add_argument("--rate", type=float, default=5., help="Average bid/ask ticks per second")
+    parser.add_argument("--orders", type=int, action="extend", nargs="+", help="Resting orders for the order book scenario")
+    parser.add_argument("--exchange", type=str, default="CMES", help="Calendar of the synthetic contracts")
+    parser.add_argument(
+        "--db", action="store_true",
+        help="Also benchmark the DB loaders: the ticks are written into the tick tables of the synthetic contracts",
+    )
+    args = parser.parse_args()
+
+    session = SyntheticSession(bidask_rate=args.rate)
+    first_day = datetime.date(2021, 6, 1)
+    days: List[datetime.date] = [first_day + datetime.timedelta(days=i) for i in range(args.days)]
+    contracts = synthetic_contracts(n=args.contracts, exchange=args.exchange)
+    start_time = datetime.datetime.combine(first_day, session.session_start, tzinfo=datetime.timezone.utc)
+    end_time = (
+        datetime.datetime.combine(days[-1], session.session_start, tzinfo=datetime.timezone.utc) + session.session_length
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = pathlib.Path(tmp)
+        n_ticks = write_synthetic_cache(cache_dir=cache_dir, contracts=contracts, days=days, seed=args.seed, session=session)
+        print(f"Generated {n_ticks} ticks for {len(contracts)} contracts over {len(days)} sessions")
+
+        results: List[BenchmarkResult] = [
+            bench_cached_loaders(cache_dir=cache_dir, contract=contracts[0], start_time=start_time, end_time=end_time),
+            bench_market_set_time(cache_dir=cache_dir, contract=contracts[0], start_time=start_time, end_time=end_time),
+        ]
+        for n_orders in args.orders or [10, 1000, 10000]:
+            results.append(bench_pending_orders(
+                cache_dir=cache_dir, contract=contracts[0], start_time=start_time, n_orders=n_orders, seed=args.seed,
+            ))
+        results.append(bench_position_update(contract=contracts[0], seed=args.seed))
+        if args.db:
+            write_synthetic_db(contracts=contracts[:1], days=days, seed=args.seed, session=session)
+            for mode in DB_LOADER_MODES:
+                results.append(bench_db_loaders(contract=contracts[0], start_time=start_time, end_time=end_time, mode=mode))
+        for event_driven in (False, True):
+            results.append(bench_backtester_run(
+                cache_dir=cache_dir, contracts=contracts, start_time=start_time, end_time=end_time, event_driven=event_driven,
+            ))
+        for pnl_policy in ("step", "interval"):
+            results.append(bench_backtester_run(
+                cache_dir=cache_dir, contracts=contracts, start_time=start_time, end_time=end_time, event_driven=True,
+                pnl_policy=pnl_policy,
+            ))
+        print(format_report(results))
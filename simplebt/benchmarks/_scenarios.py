@@ -0,0 +1,274 @@
+"""
+Throughput scenarios of the engine on synthetic ticks. Every scenario returns a BenchmarkResult.
+"""
+import datetime
+import pathlib
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+import numpy as np
+from ib_insync import Contract
+
+from simplebt.backtester import Backtester
+from simplebt.db import DbPool
+from simplebt.historical_data.load.cache import CachedBidAskTicksLoader, CachedTradesTicksLoader
+from simplebt.historical_data.load.ticks import BidAskTicksLoader, MergedTicksLoader, TradesTicksLoader
+from simplebt.market import Market
+from simplebt.orders import LmtOrder, MktOrder, OrderAction
+from simplebt.position import PnLSingle, Position
+from simplebt.strategy import StrategyInterface
+from simplebt.ticker import BidAskTickBatch, Ticker
+from simplebt.trade import Fill, StrategyTrade
+from simplebt.utils import to_ns
+
+
+@dataclass(frozen=True)
+class BenchmarkResult:
+    name: str
+    seconds: float
+    ticks: int = 0
+    events: int = 0
+
+    @property
+    def ticks_per_sec(self) -> float:
+        return self.ticks / self.seconds if self.seconds > 0 else float("inf")
+
+    @property
+    def events_per_sec(self) -> float:
+        return self.events / self.seconds if self.seconds > 0 else float("inf")
+
+
+def format_report(results: List[BenchmarkResult]) -> str:
+    lines = [f"{'scenario':<60}{'seconds':>10}{'ticks':>12}{'ticks/sec':>14}{'events':>10}{'events/sec':>14}"]
+    for r in results:
+        lines.append(
+            f"{r.name:<60}{r.seconds:>10.3f}{r.ticks:>12}{r.ticks_per_sec:>14.0f}{r.events:>10}{r.events_per_sec:>14.0f}"
+        )
+    return "\n".join(lines)
+
+
+class CountingStrategy(StrategyInterface):
+    """
+    Counts the ticks and events it receives. Every order_every pending tickers it sends a 1 lot order,
+    alternating market and limit orders and buys and sells, so that fills and PnL events are exercised too.
+    """
+    def __init__(self, bt: Backtester, order_every: Optional[int] = 50):
+        self.bt = bt
+        self.order_every = order_every
+        self.time: Optional[datetime.datetime] = None
+        self.n_ticks: int = 0
+        self.n_events: int = 0
+        self._n_tickers: int = 0
+
+    def set_time(self, time: datetime.datetime):
+        self.time = time
+
+    def on_pending_tickers_event(self, tickers: List[Ticker]):
+        self.n_events += 1
+        for ticker in tickers:
+            self.n_ticks += len(ticker.trades) + len(ticker.bidasks)
+            self._n_tickers += 1
+            if self.order_every and self._n_tickers % self.order_every == 0:
+                self._send_order(ticker)
+
+    def on_new_order_event(self, trade: StrategyTrade):
+        self.n_events += 1
+
+    def on_exec_details_event(self, trade: StrategyTrade, fill: Fill):
+        self.n_events += 1
+
+    def on_pnl_single_event(self, pnl: PnLSingle):
+        self.n_events += 1
+
+    def get_state(self) -> Tuple[int, int, int]:
+        return self.n_ticks, self.n_events, self._n_tickers
+
+    def set_state(self, state: Tuple[int, int, int]):
+        self.n_ticks, self.n_events, self._n_tickers = state
+
+    def _send_order(self, ticker: Ticker):
+        n: int = self._n_tickers // self.order_every
+        action = OrderAction.BUY if n % 2 else OrderAction.SELL
+        if n % 4 < 2:
+            self.bt.place_order(MktOrder(contract=ticker.contract, action=action, lots=1, time=self.time))
+        else:
+            best = self.bt.get_best(ticker.contract)
+            price = best.bid if action == OrderAction.BUY else best.ask
+            self.bt.place_order(LmtOrder(contract=ticker.contract, action=action, lots=1, price=price, time=self.time))
+
+
+def bench_backtester_run(
+    cache_dir: pathlib.Path,
+    contracts: List[Contract],
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    event_driven: bool = False,
+    order_every: Optional[int] = 50,
+    pnl_policy: str = "tick",
+) -> BenchmarkResult:
+    """Backtester.run() over all the contracts with a 1 second clock. PnL events every minute with pnl_policy interval"""
+    bt = Backtester(
+        contracts=contracts,
+        start_time=start_time,
+        end_time=end_time,
+        time_step=datetime.timedelta(seconds=1),
+        tick_cache_dir=cache_dir,
+        event_driven=event_driven,
+        pnl_policy=pnl_policy,
+        pnl_interval=datetime.timedelta(minutes=1) if pnl_policy == "interval" else None,
+    )
+    strat = CountingStrategy(bt=bt, order_every=order_every)
+    bt.set_strat(strat)
+    t0 = time.perf_counter()
+    bt.run()
+    seconds = time.perf_counter() - t0
+    clock = "event driven" if event_driven else "fixed clock"
+    return BenchmarkResult(
+        name=f"Backtester.run ({clock}, {len(contracts)} contracts, {pnl_policy} PnL)",
+        seconds=seconds,
+        ticks=strat.n_ticks,
+        events=strat.n_events,
+    )
+
+
+def bench_market_set_time(
+    cache_dir: pathlib.Path,
+    contract: Contract,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+) -> BenchmarkResult:
+    """Market.set_time() every second, without orders"""
+    mkt = Market(start_time=start_time, contract=contract, tick_cache_dir=cache_dir, end_time=end_time)
+    step = datetime.timedelta(seconds=1)
+    n_ticks: int = 0
+    t = start_time
+    t0 = time.perf_counter()
+    while t <= end_time:
+        mkt.set_time(t)
+        n_ticks += len(mkt._mkt_trades) + len(mkt._change_bests)
+        t += step
+    return BenchmarkResult(name="Market.set_time", seconds=time.perf_counter() - t0, ticks=n_ticks)
+
+
+def bench_pending_orders(
+    cache_dir: pathlib.Path,
+    contract: Contract,
+    start_time: datetime.datetime,
+    n_orders: int = 1000,
+    n_ticks: int = 10000,
+    seed: int = 0,
+) -> BenchmarkResult:
+    """
+    Market._process_pending_orders() with n_orders resting limit orders, away from the touch,
+    against a batch of n_ticks bid/ask ticks
+    """
+    mkt = Market(start_time=start_time, contract=contract, tick_cache_dir=cache_dir)
+    rng = np.random.default_rng(seed)
+    bid: np.ndarray = 4000. + np.cumsum(rng.choice(np.array([-0.25, 0., 0.25]), size=n_ticks))
+    mkt._change_bests = BidAskTickBatch({
+        "time": np.full(n_ticks, to_ns(start_time), dtype=np.int64),
+        "bid": bid,
+        "ask": bid + 0.25,
+        "bid_size": np.ones(n_ticks, dtype=np.int64),
+        "ask_size": np.ones(n_ticks, dtype=np.int64),
+    })
+    # Resting orders out of reach of the simulated quotes, so that the book stays the same across ticks
+    distance: float = float(np.abs(bid - 4000.).max()) + 1.
+    for i in range(n_orders):
+        if i % 2:
+            action, price = OrderAction.BUY, 4000. - distance - i * 0.25
+        else:
+            action, price = OrderAction.SELL, 4000. + distance + i * 0.25
+        mkt.add_order(LmtOrder(contract=contract, action=action, lots=1, price=price, time=start_time))
+    t0 = time.perf_counter()
+    fill_events = mkt._process_pending_orders()
+    return BenchmarkResult(
+        name=f"Market._process_pending_orders ({n_orders} orders)",
+        seconds=time.perf_counter() - t0,
+        ticks=n_ticks,
+        events=len(fill_events),
+    )
+
+
+def bench_position_update(contract: Contract, n_fills: int = 100000, seed: int = 0) -> BenchmarkResult:
+    """Position.update() with random fills"""
+    rng = np.random.default_rng(seed)
+    t = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+    fills = [
+        Fill(time=t, price=price, lots=lots, order_action=OrderAction.BUY if buy else OrderAction.SELL)
+        for price, lots, buy in zip(
+            (4000. + rng.integers(-100, 100, n_fills) * 0.25).tolist(),
+            rng.integers(1, 10, n_fills).tolist(),
+            (rng.random(n_fills) < 0.5).tolist(),
+        )
+    ]
+    position = Position(contract)
+    t0 = time.perf_counter()
+    for fill in fills:
+        position.update(fill)
+    return BenchmarkResult(name="Position.update", seconds=time.perf_counter() - t0, events=n_fills)
+
+
+def bench_cached_loaders(
+    cache_dir: pathlib.Path,
+    contract: Contract,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+) -> BenchmarkResult:
+    """get_ticks_batch_by_time() of the cached trades and bid/ask loaders, every second"""
+    loaders = (
+        CachedTradesTicksLoader(contract, cache_dir=cache_dir),
+        CachedBidAskTicksLoader(contract, cache_dir=cache_dir),
+    )
+    step = datetime.timedelta(seconds=1)
+    n_ticks: int = 0
+    t = start_time
+    t0 = time.perf_counter()
+    while t <= end_time:
+        for loader in loaders:
+            n_ticks += len(loader.get_ticks_batch_by_time(time=t))
+        t += step
+    return BenchmarkResult(name="Cached loaders", seconds=time.perf_counter() - t0, ticks=n_ticks)
+
+
+DB_LOADER_MODES: Tuple[str, ...] = ("query", "window", "binary", "server_side_cursor", "merged")
+
+
+def bench_db_loaders(
+    contract: Contract,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    mode: str = "window",
+    window: datetime.timedelta = datetime.timedelta(minutes=5),
+    db_connection=None,
+    pool: Optional[DbPool] = None,
+) -> BenchmarkResult:
+    """
+    get_ticks_batch_by_time() of the DB trades and bid/ask loaders, every second, e.g. over the tables written
+    by write_synthetic_db(). Needs a database.
+    :param mode: One of DB_LOADER_MODES: a query per second, window buffers filled by range queries, by binary COPY
+    or from server-side cursors, or the merged loader of both tick types with window buffers
+    """
+    if mode not in DB_LOADER_MODES:
+        raise ValueError(f"mode should be one of {DB_LOADER_MODES}, got {mode}")
+    kwargs = dict(db_connection=db_connection, pool=pool)
+    if mode != "query":
+        kwargs.update(window=window, binary=mode == "binary", server_side_cursor=mode == "server_side_cursor")
+    loaders: Tuple[Union[TradesTicksLoader, BidAskTicksLoader, MergedTicksLoader], ...]
+    if mode == "merged":
+        loaders = (MergedTicksLoader(contract, **kwargs),)
+    else:
+        loaders = (TradesTicksLoader(contract, **kwargs), BidAskTicksLoader(contract, **kwargs))
+    step = datetime.timedelta(seconds=1)
+    n_ticks: int = 0
+    t = start_time
+    t0 = time.perf_counter()
+    while t <= end_time:
+        for loader in loaders:
+            batches = loader.get_ticks_batch_by_time(time=t)
+            n_ticks += sum(len(b) for b in batches) if isinstance(batches, tuple) else len(batches)
+        t += step
+    seconds = time.perf_counter() - t0
+    for loader in loaders:
+        loader.close()
+    return BenchmarkResult(name=f"DB loaders ({mode})", seconds=seconds, ticks=n_ticks)
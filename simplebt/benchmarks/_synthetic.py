@@ -0,0 +1,188 @@
+"""
+Seeded synthetic tick streams, written in the tick cache format so that Markets can replay them without Postgres,
+or into the tick tables of the synthetic contracts to benchmark the DB loaders.
+
+Arrivals follow a Poisson process per second whose intensity has an intraday U shape (busy open and close)
+and switches between a calm and a bursty regime, as futures sessions do around news and sweeps.
+Quotes move one tick at a time around a random walk mid; trades print at the touch.
+"""
+import datetime
+import pathlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+import numpy as np
+from ib_insync import Contract, Future
+from ib_insync.objects import HistoricalTickBidAsk, HistoricalTickLast, TickAttribBidAsk, TickAttribLast
+from simplebt.db import DbPool, DbTicks
+from simplebt.historical_data.load.cache import CACHE_COLUMNS, DAY_FORMAT, get_cache_table_dir
+from simplebt.historical_data.utils.cache import write_cache_day
+from simplebt.utils import from_ns, to_ns
+
+_NS_PER_SEC = 1000000000
+
+
+@dataclass(frozen=True)
+class SyntheticSession:
+    """
+    :param bidask_rate: average number of bid/ask ticks per second, before the intraday profile and the bursts
+    :param trade_ratio: trades per bid/ask tick
+    :param burst_prob: probability, every second, of entering a burst
+    :param burst_length: average burst length in seconds
+    :param burst_multiplier: intensity multiplier during bursts
+    :param open_close_boost: intensity multiplier at the open and at the close, relative to midday
+    """
+    session_start: datetime.time = datetime.time(13, 30)
+    session_length: datetime.timedelta = datetime.timedelta(hours=6, minutes=30)
+    bidask_rate: float = 5.
+    trade_ratio: float = 0.3
+    burst_prob: float = 0.002
+    burst_length: float = 30.
+    burst_multiplier: float = 10.
+    open_close_boost: float = 3.
+    start_price: float = 4000.
+    tick_size: float = 0.25
+    mean_size: float = 5.
+
+
+def synthetic_contracts(n: int, exchange: str = "CMES") -> List[Contract]:
+    return [
+        Future(conId=i + 1, symbol=f"SYN{i}", lastTradeDateOrContractMonth="20991231", multiplier="50", exchange=exchange)
+        for i in range(n)
+    ]
+
+
+def generate_day(
+    day: datetime.date, rng: np.random.Generator, session: SyntheticSession = SyntheticSession()
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """:return: the columns of the BID_ASK and TRADES ticks of one day, in the tick cache format"""
+    n_secs: int = int(session.session_length.total_seconds())
+    start_ns: int = to_ns(datetime.datetime.combine(day, session.session_start, tzinfo=datetime.timezone.utc))
+    secs: np.ndarray = start_ns + np.arange(n_secs, dtype=np.int64) * _NS_PER_SEC
+
+    intensity: np.ndarray = session.bidask_rate * _intraday_profile(n_secs, session.open_close_boost)
+    intensity *= np.where(_bursts(n_secs, rng, session), session.burst_multiplier, 1.)
+
+    n_quotes: np.ndarray = rng.poisson(intensity)
+    quote_times: np.ndarray = np.repeat(secs, n_quotes)
+    moves: np.ndarray = rng.choice(np.array([-1, 0, 1]), size=len(quote_times), p=[0.3, 0.4, 0.3])
+    bid: np.ndarray = session.start_price + np.cumsum(moves) * session.tick_size
+    bidask = {
+        "time": quote_times,
+        "bid": bid,
+        "ask": bid + session.tick_size,
+        "bid_size": rng.geometric(1 / session.mean_size, size=len(quote_times)),
+        "ask_size": rng.geometric(1 / session.mean_size, size=len(quote_times)),
+    }
+
+    n_trades: np.ndarray = rng.poisson(intensity * session.trade_ratio)
+    trade_times: np.ndarray = np.repeat(secs, n_trades)
+    # Trades print at the touch of the last quote of the second, or of the first one if there is none yet
+    last_quote: np.ndarray = np.maximum(np.searchsorted(quote_times, trade_times, side="right") - 1, 0)
+    at_ask: np.ndarray = rng.random(len(trade_times)) < 0.5
+    if len(quote_times) > 0:
+        price = np.where(at_ask, bidask["ask"][last_quote], bidask["bid"][last_quote])
+    else:
+        price = np.full(len(trade_times), session.start_price)
+    trades = {
+        "time": trade_times,
+        "price": price,
+        "size": rng.geometric(1 / session.mean_size, size=len(trade_times)),
+    }
+    return {
+        tick_type: {c: columns[c].astype(dtype) for c, dtype in CACHE_COLUMNS[tick_type].items()}
+        for tick_type, columns in (("BID_ASK", bidask), ("TRADES", trades))
+    }
+
+
+def write_synthetic_cache(
+    cache_dir: pathlib.Path,
+    contracts: List[Contract],
+    days: List[datetime.date],
+    seed: int = 0,
+    session: SyntheticSession = SyntheticSession(),
+) -> int:
+    """
+    Generate the ticks of every contract and day into cache_dir, readable with Market(tick_cache_dir=cache_dir)
+    :return: the total number of ticks written
+    """
+    rng = np.random.default_rng(seed)
+    n_ticks: int = 0
+    for contract in contracts:
+        for day in days:
+            for tick_type, columns in generate_day(day=day, rng=rng, session=session).items():
+                table_dir = get_cache_table_dir(contract=contract, tick_type=tick_type, cache_dir=cache_dir)
+                table_dir.mkdir(parents=True, exist_ok=True)
+                write_cache_day(day_dir=table_dir / day.strftime(DAY_FORMAT), arrays=columns)
+                n_ticks += len(columns["time"])
+    return n_ticks
+
+
+def write_synthetic_db(
+    contracts: List[Contract],
+    days: List[datetime.date],
+    seed: int = 0,
+    session: SyntheticSession = SyntheticSession(),
+    db_connection=None,
+    pool: Optional[DbPool] = None,
+) -> int:
+    """
+    Same ticks as write_synthetic_cache() with the same seed, written into the DbTicks tables of the contracts.
+    The tables are emptied first.
+    :return: the total number of ticks written
+    """
+    rng = np.random.default_rng(seed)
+    dbs: Dict[str, Dict[int, DbTicks]] = {
+        tick_type: {
+            c.conId: DbTicks(contract=c, tick_type=tick_type, db_connection=db_connection, pool=pool) for c in contracts
+        }
+        for tick_type in ("BID_ASK", "TRADES")
+    }
+    for db in (db for by_contract in dbs.values() for db in by_contract.values()):
+        db.create_table()
+        with db.cursor() as cursor:
+            cursor.execute(f"truncate {db.table_ref.schema}.{db.table_ref.table};")
+    n_ticks: int = 0
+    for contract in contracts:
+        for day in days:
+            for tick_type, columns in generate_day(day=day, rng=rng, session=session).items():
+                n_ticks += dbs[tick_type][contract.conId].insert_copy(_to_historical_ticks(tick_type, columns))
+    for db in (db for by_contract in dbs.values() for db in by_contract.values()):
+        db.close()
+    return n_ticks
+
+
+def _to_historical_ticks(
+    tick_type: str, columns: Dict[str, np.ndarray]
+) -> List[Union[HistoricalTickBidAsk, HistoricalTickLast]]:
+    """The ticks as downloaded from IB, the input of DbTicks.insert_copy()"""
+    times: List[datetime.datetime] = [from_ns(t) for t in columns["time"].tolist()]
+    if tick_type == "BID_ASK":
+        return [
+            HistoricalTickBidAsk(
+                time=t, tickAttribBidAsk=TickAttribBidAsk(), priceBid=bid, priceAsk=ask, sizeBid=bid_size, sizeAsk=ask_size,
+            )
+            for t, bid, ask, bid_size, ask_size in zip(
+                times, columns["bid"].tolist(), columns["ask"].tolist(),
+                columns["bid_size"].tolist(), columns["ask_size"].tolist(),
+            )
+        ]
+    return [
+        HistoricalTickLast(time=t, tickAttribLast=TickAttribLast(), price=price, size=size, exchange="", specialConditions="")
+        for t, price, size in zip(times, columns["price"].tolist(), columns["size"].tolist())
+    ]
+
+
+def _intraday_profile(n_secs: int, boost: float) -> np.ndarray:
+    """U shape: boost at the ends of the session, 1 in the middle"""
+    x: np.ndarray = np.linspace(-1., 1., n_secs)
+    return 1. + (boost - 1.) * x ** 2
+
+
+def _bursts(n_secs: int, rng: np.random.Generator, session: SyntheticSession) -> np.ndarray:
+    """Seconds in a burst: bursts start with probability burst_prob and last an exponential time"""
+    in_burst = np.zeros(n_secs, dtype=bool)
+    starts: np.ndarray = np.flatnonzero(rng.random(n_secs) < session.burst_prob)
+    lengths: np.ndarray = np.ceil(rng.exponential(session.burst_length, size=len(starts))).astype(np.int64)
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        in_burst[start:start + length] = True
+    return in_burst
@@ -0,0 +1,75 @@
+import bisect
+import itertools
+from typing import Dict, Iterator, List, Tuple
+
+from simplebt.orders import LmtOrder, MktOrder, Order, OrderAction
+from simplebt.trade import StrategyTrade
+
+
+class PendingOrdersBook:
+    """
+    The trades with pending orders of a Market.
+    Limit orders are kept sorted by limit price on each side, so that a bid/ask tick only visits the orders it crosses.
+    Market orders cross every tick and are kept apart in a FIFO.
+    """
+    def __init__(self):
+        self._seqs = itertools.count()
+        self._trades: Dict[int, StrategyTrade] = {}  # seq -> trade, in order of arrival
+        self._seq_by_order: Dict[Order, int] = {}
+        self._mkt_orders: Dict[int, StrategyTrade] = {}  # insertion-ordered dict used as a FIFO with O(1) removal
+        self._buy_lmt_orders: List[Tuple[float, int]] = []  # (price, seq) sorted ascending
+        self._sell_lmt_orders: List[Tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._trades)
+
+    def __iter__(self) -> Iterator[StrategyTrade]:
+        return iter(list(self._trades.values()))
+
+    def add(self, trade: StrategyTrade):
+        order: Order = trade.order
+        seq: int = next(self._seqs)
+        if isinstance(order, MktOrder):
+            self._mkt_orders[seq] = trade
+        elif isinstance(order, LmtOrder):
+            bisect.insort(self._lmt_orders(order.action), (order.price, seq))
+        else:
+            raise ValueError(f"Unsupported order type: {type(order).__name__}")
+        self._trades[seq] = trade
+        self._seq_by_order[order] = seq
+
+    def remove(self, trade: StrategyTrade):
+        order: Order = trade.order
+        seq: int = self._seq_by_order.pop(order)
+        del self._trades[seq]
+        if isinstance(order, MktOrder):
+            del self._mkt_orders[seq]
+        else:
+            orders = self._lmt_orders(order.action)
+            del orders[bisect.bisect_left(orders, (order.price, seq))]
+
+    def get_trade(self, order: Order) -> StrategyTrade:
+        if order not in self._seq_by_order:
+            raise ValueError(f"No pending order {order}")
+        return self._trades[self._seq_by_order[order]]
+
+    def crossed(self, bid: float, ask: float) -> List[StrategyTrade]:
+        """
+        The trades whose order may be (partially) filled by a bid/ask tick, in order of arrival:
+        all market orders, buy limit orders with price >= ask and sell limit orders with price <= bid.
+        """
+        first_buy: int = bisect.bisect_left(self._buy_lmt_orders, (ask, -1))
+        last_sell: int = bisect.bisect_right(self._sell_lmt_orders, (bid, float("inf")))
+        seqs: List[int] = list(self._mkt_orders)
+        seqs += (seq for _, seq in self._buy_lmt_orders[first_buy:])
+        seqs += (seq for _, seq in self._sell_lmt_orders[:last_sell])
+        seqs.sort()
+        return [self._trades[seq] for seq in seqs]
+
+    def _lmt_orders(self, action: OrderAction) -> List[Tuple[float, int]]:
+        if action == OrderAction.BUY:
+            return self._buy_lmt_orders
+        elif action == OrderAction.SELL:
+            return self._sell_lmt_orders
+        else:
+            raise ValueError("Unknown order Action")
@@ -0,0 +1,54 @@
+"""
+Snapshots of a Backtester between two steps, to resume a crashed run or extend a finished one to a later end_time.
+
+Only the state that can't be rebuilt is stored: the clock, the best quote, session state and pending trades
+of each Market, the positions, the PnL emission state and what the strategy returns from get_state().
+Loaders hold no state that matters: they reposition themselves on the clock when the run resumes.
+Everything is pickled in one go, so that the trades shared by the markets and the strategy stay shared.
+"""
+import datetime
+import os
+import pathlib
+import pickle
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from simplebt.market import MarketState
+from simplebt.position import Portfolio
+from simplebt.ticker import Ticker
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """
+    :param time: the next time of the clock to process
+    :param history_offset: number of events recorded in the history of the run before this checkpoint
+    :param window: end and ticks of the window a BatchStrategyInterface is getting
+    """
+    time: datetime.datetime
+    start_time: datetime.datetime
+    end_time: datetime.datetime
+    time_step: datetime.timedelta
+    markets: Dict[int, MarketState]
+    portfolio: Portfolio
+    last_pnl_time: Dict[int, datetime.datetime]
+    next_heartbeat: Optional[datetime.datetime]
+    history_offset: int
+    window: Optional[Tuple[datetime.datetime, Dict[int, List[Ticker]]]] = None
+    strategy_state: Any = None
+
+
+def write_checkpoint(checkpoint: Checkpoint, path: pathlib.Path):
+    """Write into a temporary file first and swap it in, so that a crash never leaves a half-written checkpoint"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: pathlib.Path) -> Checkpoint:
+    with open(path, "rb") as f:
+        checkpoint = pickle.load(f)
+    if not isinstance(checkpoint, Checkpoint):
+        raise ValueError(f"{path} is not a backtest checkpoint")
+    return checkpoint
@@ -1,5 +1,6 @@
+from ._pool import DbPool, close_shared_pool, execute_prepared, get_shared_pool
 from ._db import Db, TableRef
 from ._db_bars import DbBars
 from ._db_ticks import DbTicks
 
-__all__ = ("Db", "DbBars", "DbTicks", "TableRef")
+__all__ = ("Db", "DbBars", "DbPool", "DbTicks", "TableRef", "close_shared_pool", "execute_prepared", "get_shared_pool")
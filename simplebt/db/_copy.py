@@ -0,0 +1,207 @@
+"""
+Bulk loading through COPY ... FROM STDIN, in the text or the binary COPY format.
+Rows are encoded column by column with numpy into an in-memory buffer that is sent to the server
+every time it grows past buffer_size bytes.
+The other way round, read_copy_binary() parses the output of COPY ... TO STDOUT (FORMAT binary) into arrays.
+"""
+import io
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from simplebt.db._db import TableRef
+
+COPY_FORMATS: Tuple[str, ...] = ("text", "binary")
+
+# Binary COPY: signature, flags field and header extension length, then a -1 field count as trailer
+_BINARY_HEADER: bytes = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_BINARY_TRAILER: bytes = struct.pack(">h", -1)
+# Binary timestamps are microseconds since 2000-01-01 UTC
+_PG_EPOCH_US: int = 946684800 * 1000000
+
+# Big-endian numpy dtype of each fixed-width type in the binary format
+_BINARY_DTYPES: Dict[str, str] = {
+    "timestamptz": ">i8",
+    "float4": ">f4",
+    "float8": ">f8",
+    "int2": ">i2",
+    "int4": ">i4",
+    "int8": ">i8",
+    "bool": ">u1",
+}
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+@dataclass(frozen=True)
+class CopyColumn:
+    """
+    :param pg_type: one of timestamptz, float4, float8, int2, int4, int8, bool, text.
+    timestamptz values are given as int64 nanoseconds since the epoch.
+    """
+    name: str
+    pg_type: str
+
+
+class CopyWriter:
+    """
+    Buffered writer of rows into a table through COPY ... FROM STDIN.
+    Every flush runs one COPY statement. Use it as a context manager so that the last rows are flushed.
+    In the binary format, only text columns can hold NULLs (as None).
+    """
+    def __init__(
+        self,
+        conn,
+        table_ref: TableRef,
+        columns: Sequence[CopyColumn],
+        fmt: str = "binary",
+        buffer_size: int = 8 * 1024 * 1024,
+    ):
+        if fmt not in COPY_FORMATS:
+            raise ValueError(f"fmt should be one of {COPY_FORMATS}, got {fmt}")
+        for c in columns:
+            if c.pg_type != "text" and c.pg_type not in _BINARY_DTYPES:
+                raise ValueError(f"Unsupported type {c.pg_type} for column {c.name}")
+        self.conn = conn
+        self.table_ref: TableRef = table_ref
+        self.fmt: str = fmt
+        self.buffer_size: int = buffer_size
+        # Binary rows are a fixed-width block followed by the variable-width text fields:
+        # COPY takes an explicit column list, so the fixed-width columns are simply sent first
+        fixed: List[CopyColumn] = [c for c in columns if c.pg_type != "text"]
+        self._columns: List[CopyColumn] = fixed + [c for c in columns if c.pg_type == "text"]
+        self._fixed_dtype = np.dtype(
+            [("n_fields", ">i2")]
+            + [
+                field
+                for c in fixed
+                for field in ((f"{c.name}_len", ">i4"), (c.name, _BINARY_DTYPES[c.pg_type]))
+            ]
+        )
+        self._buffer = io.BytesIO()
+        self.rows_written: int = 0
+
+    @property
+    def copy_statement(self) -> str:
+        columns = ", ".join(c.name for c in self._columns)
+        return f"COPY {self.table_ref.schema}.{self.table_ref.table} ({columns}) FROM STDIN WITH (FORMAT {self.fmt})"
+
+    def write(self, columns: Dict[str, np.ndarray]) -> int:
+        """
+        Encode a block of rows, given as one array (or list, for text columns) per column.
+        :return: the number of rows in the block
+        """
+        n: int = len(columns[self._columns[0].name])
+        if n == 0:
+            return 0
+        if self.fmt == "binary":
+            self._buffer.write(self._encode_binary(columns=columns, n=n))
+        else:
+            self._buffer.write(self._encode_text(columns=columns))
+        self.rows_written += n
+        if self._buffer.tell() >= self.buffer_size:
+            self.flush()
+        return n
+
+    def flush(self):
+        if self._buffer.tell() == 0:
+            return
+        if self.fmt == "binary":
+            data = io.BytesIO(_BINARY_HEADER + self._buffer.getvalue() + _BINARY_TRAILER)
+        else:
+            data = io.BytesIO(self._buffer.getvalue())
+        with self.conn.cursor() as cursor:
+            cursor.copy_expert(self.copy_statement, data)
+        self._buffer = io.BytesIO()
+
+    def __enter__(self) -> "CopyWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+    def _encode_binary(self, columns: Dict[str, np.ndarray], n: int) -> bytes:
+        fixed = np.empty(n, dtype=self._fixed_dtype)
+        fixed["n_fields"] = len(self._columns)
+        texts: List[List[Optional[str]]] = []
+        for c in self._columns:
+            if c.pg_type == "text":
+                texts.append(columns[c.name])
+                continue
+            values = np.asarray(columns[c.name])
+            if c.pg_type == "timestamptz":
+                values = values.astype(np.int64) // 1000 - _PG_EPOCH_US
+            fixed[f"{c.name}_len"] = fixed.dtype[c.name].itemsize
+            fixed[c.name] = values
+        if not texts:
+            return fixed.tobytes()
+        rows: np.ndarray = fixed.view(np.uint8).reshape(n, self._fixed_dtype.itemsize)
+        out = io.BytesIO()
+        for row, text_values in zip(rows, zip(*texts)):
+            out.write(row.tobytes())
+            for v in text_values:
+                if v is None:
+                    out.write(b"\xff\xff\xff\xff")
+                else:
+                    encoded = v.encode("utf-8")
+                    out.write(struct.pack(">i", len(encoded)))
+                    out.write(encoded)
+        return out.getvalue()
+
+    def _encode_text(self, columns: Dict[str, np.ndarray]) -> bytes:
+        fields: List[List[str]] = [_to_text(c.pg_type, columns[c.name]) for c in self._columns]
+        lines = "\n".join("\t".join(row) for row in zip(*fields))
+        return (lines + "\n").encode("utf-8")
+
+
+def _to_text(pg_type: str, values) -> List[str]:
+    if pg_type == "text":
+        return [r"\N" if v is None else v.translate(_TEXT_ESCAPES) for v in values]
+    values = np.asarray(values)
+    if pg_type == "timestamptz":
+        return np.datetime_as_string(values.astype("datetime64[ns]"), unit="us", timezone="UTC").tolist()
+    if pg_type == "bool":
+        return np.where(values, "t", "f").tolist()
+    return values.astype(str).tolist()
+
+
+# Postgres type to cast each numpy dtype to, so that every field of a binary row has a known width
+_BINARY_CASTS: Dict[np.dtype, Tuple[str, str]] = {
+    np.dtype(np.int64): ("int8", ">i8"),
+    np.dtype(np.int32): ("int4", ">i4"),
+    np.dtype(np.int8): ("int2", ">i2"),
+    np.dtype(np.float64): ("float8", ">f8"),
+    np.dtype(bool): ("bool", ">u1"),
+}
+
+
+def binary_select_expression(expression: str, dtype: np.dtype) -> str:
+    """
+    Cast a select expression for read_copy_binary(). NULLs are replaced as numpy does when building
+    arrays from query results: NaN for floats. Integers and booleans must not be NULL.
+    """
+    pg_type: str = _BINARY_CASTS[np.dtype(dtype)][0]
+    if pg_type == "float8":
+        return f"coalesce(({expression})::float8, 'NaN')"
+    return f"({expression})::{pg_type}"
+
+
+def read_copy_binary(cursor, query: str, dtypes: Dict[str, np.dtype]) -> Dict[str, np.ndarray]:
+    """
+    Run query through COPY (...) TO STDOUT in the binary format and parse the rows straight into arrays.
+    The query must select one expression per dtype, in order, built with binary_select_expression().
+    """
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", buffer)
+    data: bytes = buffer.getvalue()
+    # Header: signature, flags, header extension length (and the extension itself, normally empty)
+    extension_length: int = struct.unpack_from(">i", data, 15)[0]
+    body: bytes = data[19 + extension_length:-len(_BINARY_TRAILER)]
+    row_dtype = np.dtype(
+        [("n_fields", ">i2")]
+        + [field for c, dtype in dtypes.items() for field in ((f"{c}_len", ">i4"), (c, _BINARY_CASTS[np.dtype(dtype)][1]))]
+    )
+    if len(body) % row_dtype.itemsize != 0:
+        raise ValueError("Unexpected row width in COPY binary output: is a selected value NULL?")
+    rows: np.ndarray = np.frombuffer(body, dtype=row_dtype)
+    return {c: rows[c].astype(dtype) for c, dtype in dtypes.items()}
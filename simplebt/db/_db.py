@@ -1,18 +1,25 @@
 import abc
+import contextlib
 import psycopg2
 from dataclasses import dataclass
 from collections import namedtuple
-from typing import Optional
+from typing import Iterator, Optional
+from simplebt.db._pool import DbPool, forget_prepared
 from simplebt.resources.config import PGHOST, PGPORT, PGDATABASE, PGUSER, PGPASSWORD
 
 TableRef = namedtuple("TableRef", "schema table")
 
 
 class Db(metaclass=abc.ABCMeta):
-    def __init__(self, auto_open_conn: bool = True, db_connection=None):
-        if db_connection is None and auto_open_conn is True:
+    def __init__(self, auto_open_conn: bool = True, db_connection=None, pool: Optional[DbPool] = None):
+        """
+        :param db_connection: Connection to use, e.g. shared with other Db objects.
+        :param pool: Borrow a connection from this pool for every query instead. self.conn is then None.
+        """
+        if pool is None and db_connection is None and auto_open_conn is True:
             db_connection = self.open_conn()
         self.conn = db_connection
+        self.pool: Optional[DbPool] = pool
 
     @staticmethod
     def open_conn():
@@ -29,6 +36,34 @@ class Db(metaclass=abc.ABCMeta):
         conn.autocommit = True
         return conn
 
+    def acquire(self):
+        """A connection to use until release(): the pool's next free one, or self.conn"""
+        return self.pool.getconn() if self.pool is not None else self.conn
+
+    def release(self, conn):
+        if self.pool is not None:
+            self.pool.putconn(conn)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextlib.contextmanager
+    def cursor(self) -> Iterator:
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    def close(self):
+        """Close the connection of this object. Pooled connections are left to the pool"""
+        if self.conn is not None and self.pool is None:
+            forget_prepared(self.conn)
+            self.conn.close()
+
 
 @dataclass
 class QueryNoneResult:
@@ -1,16 +1,67 @@
 import psycopg2
 import psycopg2.extras
 import datetime
+import numpy as np
 from ib_insync import Contract
 from ib_insync.objects import BarDataList
-from typing import Optional
-from simplebt.db import Db, TableRef
+from typing import Dict, Optional, Tuple, Union
+from simplebt.db import Db, DbPool, TableRef
+from simplebt.db._copy import CopyColumn, CopyWriter, binary_select_expression, read_copy_binary
 from simplebt.resources.config import BARS_SCHEMA_DICT
+from simplebt.utils import to_ns
+
+COPY_COLUMNS: Tuple[CopyColumn, ...] = (
+    CopyColumn("date", "timestamptz"),
+    CopyColumn("open", "float8"),
+    CopyColumn("high", "float8"),
+    CopyColumn("low", "float8"),
+    CopyColumn("close", "float8"),
+    CopyColumn("volume", "int8"),
+    CopyColumn("average", "float8"),
+    CopyColumn("barCount", "int4"),
+)
+
+# Columns of the bars tables as arrays, date in nanoseconds since the epoch
+BAR_DTYPES: Dict[str, np.dtype] = {
+    "date": np.dtype(np.int64),
+    "open": np.dtype(np.float64),
+    "high": np.dtype(np.float64),
+    "low": np.dtype(np.float64),
+    "close": np.dtype(np.float64),
+    "volume": np.dtype(np.int64),
+    "average": np.dtype(np.float64),
+    "barCount": np.dtype(np.int64),
+}
+_DATE_NS_EXPRESSION = "(extract(epoch from date) * 1000000)::bigint * 1000"
+
+
+def _bar_date_to_ns(date: Union[datetime.date, datetime.datetime]) -> int:
+    """Daily bars are dated, not timestamped: they are stored at midnight UTC"""
+    if not isinstance(date, datetime.datetime):
+        date = datetime.datetime.combine(date, datetime.time(), tzinfo=datetime.timezone.utc)
+    return to_ns(date)
+
+
+def extract_bar_columns(bars: BarDataList) -> Dict[str, np.ndarray]:
+    """Columns of the bars table, date in nanoseconds since the epoch"""
+    n: int = len(bars)
+    return {
+        "date": np.fromiter((_bar_date_to_ns(bar.date) for bar in bars), dtype=np.int64, count=n),
+        "open": np.fromiter((bar.open for bar in bars), dtype=np.float64, count=n),
+        "high": np.fromiter((bar.high for bar in bars), dtype=np.float64, count=n),
+        "low": np.fromiter((bar.low for bar in bars), dtype=np.float64, count=n),
+        "close": np.fromiter((bar.close for bar in bars), dtype=np.float64, count=n),
+        "volume": np.fromiter((bar.volume for bar in bars), dtype=np.float64, count=n).astype(np.int64),
+        "average": np.fromiter((bar.average for bar in bars), dtype=np.float64, count=n),
+        "barCount": np.fromiter((bar.barCount for bar in bars), dtype=np.int64, count=n),
+    }
 
 
 class DbBars(Db):
-    def __init__(self, contract: Contract, bar_type: str, bar_size: str):
-        super().__init__()
+    def __init__(
+        self, contract: Contract, bar_type: str, bar_size: str, db_connection=None, pool: Optional[DbPool] = None
+    ):
+        super().__init__(db_connection=db_connection, pool=pool)
         self.contract = contract
         self.bar_type = bar_type
         self.bar_size = bar_size
@@ -36,7 +87,7 @@ class DbBars(Db):
         return TableRef(schema_name, table_name)
 
     def create_table(self):
-        with self.conn.cursor() as cursor:
+        with self.cursor() as cursor:
             cursor.execute(
                 f"""
                 create table if not exists {self.table_ref.schema}.{self.table_ref.table} (
@@ -52,6 +103,17 @@ class DbBars(Db):
             """
             )
 
+    def clone_to_temp_table(self, conn, table: str) -> "DbBars":
+        """
+        A DbBars on a temporary copy of this table, indexes included, e.g. to time writes without touching the table.
+        Temporary tables only live in the session of conn, the connection of the copy.
+        """
+        clone = DbBars(contract=self.contract, bar_type=self.bar_type, bar_size=self.bar_size, db_connection=conn)
+        clone.table_ref = TableRef("pg_temp", table)
+        with clone.cursor() as cursor:
+            cursor.execute(f"create temp table {table} (like {self.table_ref.schema}.{self.table_ref.table} including all);")
+        return clone
+
     def insert_execute_values_iterator(
         self, bars: BarDataList, page_size: int = 100
     ):
@@ -59,7 +121,7 @@ class DbBars(Db):
         THANKS: https://hakibenita.com/fast-load-data-python-postgresql
         """
         table = f"{self.table_ref.schema}.{self.table_ref.table}"
-        with self.conn.cursor() as cursor:
+        with self.cursor() as cursor:
             psycopg2.extras.execute_values(
                 cursor,
                 "insert into " + table + " values %s;",
@@ -79,13 +141,84 @@ class DbBars(Db):
                 page_size=page_size,
             )
 
+    def insert_copy(
+        self, bars: BarDataList, fmt: str = "binary", buffer_size: int = 8 * 1024 * 1024
+    ) -> int:
+        """
+        Same rows as insert_execute_values_iterator(), streamed through COPY ... FROM STDIN.
+        :param fmt: text or binary COPY format
+        :return: the number of rows inserted
+        """
+        return self.insert_columns(extract_bar_columns(bars), fmt=fmt, buffer_size=buffer_size)
+
+    def insert_columns(
+        self, columns: Dict[str, np.ndarray], fmt: str = "binary", buffer_size: int = 8 * 1024 * 1024
+    ) -> int:
+        """
+        Bulk insert bars given as one array per column of BAR_DTYPES, e.g. built from ticks.
+        :return: the number of rows inserted
+        """
+        with self.connection() as conn, CopyWriter(
+            conn=conn,
+            table_ref=self.table_ref,
+            columns=COPY_COLUMNS,
+            fmt=fmt,
+            buffer_size=buffer_size,
+        ) as writer:
+            writer.write(columns)
+        return writer.rows_written
+
+    def get_bars(
+        self,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+        binary: bool = False,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Read back the bars dated in [start, end) as one array per column of BAR_DTYPES, sorted by date.
+        :param binary: Fetch the rows in the binary COPY format.
+        """
+        conditions = ["true"]
+        if start is not None:
+            conditions.append("date >= %(start)s")
+        if end is not None:
+            conditions.append("date < %(end)s")
+        expressions = [_DATE_NS_EXPRESSION] + list(BAR_DTYPES)[1:]
+        if binary:
+            expressions = [binary_select_expression(e, dtype) for e, dtype in zip(expressions, BAR_DTYPES.values())]
+        query = f"""
+            SELECT {', '.join(expressions)}
+            FROM {self.table_ref.schema}.{self.table_ref.table}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY date ASC
+        """
+        params = {"start": start, "end": end}
+        with self.cursor() as cursor:
+            if binary:
+                # COPY takes no parameters: they are inlined
+                return read_copy_binary(cursor, query=cursor.mogrify(query, params).decode(), dtypes=BAR_DTYPES)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        if not rows:
+            return {c: np.empty(0, dtype=dtype) for c, dtype in BAR_DTYPES.items()}
+        return {c: np.array(values, dtype=dtype) for (c, dtype), values in zip(BAR_DTYPES.items(), zip(*rows))}
+
+    def delete_bars(self, start: datetime.datetime, end: datetime.datetime) -> int:
+        """Delete the bars dated in [start, end), e.g. before building them again. :return: the number of rows deleted"""
+        with self.cursor() as cursor:
+            cursor.execute(
+                f"delete from {self.table_ref.schema}.{self.table_ref.table} where date >= %(start)s and date < %(end)s;",
+                {"start": start, "end": end},
+            )
+            return cursor.rowcount
+
     def get_bar_date(
         self, func: str = "min"
     ) -> Optional[datetime.datetime]:
         if func not in ("min", "max"):
             raise ValueError("Either min or max")
         date: Optional[datetime.datetime] = None
-        with self.conn.cursor() as cursor:
+        with self.cursor() as cursor:
             cursor.execute("set TimeZone = UTC;")
             cursor.execute(
                 f"select {func}(date) from {self.table_ref.schema}.{self.table_ref.table};"
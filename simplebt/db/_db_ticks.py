@@ -1,12 +1,39 @@
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
 import datetime
+import logging
+import re
+import numpy as np
 from ib_insync import Contract
 from ib_insync.objects import HistoricalTickLast, HistoricalTickBidAsk
-from typing import Generator, List, Optional, Union, Dict, Tuple
-from simplebt.db import Db, TableRef
-from simplebt.resources.config import TICKS_SCHEMA_NAME
-from simplebt.utils import to_utc
+from typing import List, Optional, Set, Union, Dict, Tuple
+from simplebt.db import Db, DbPool, TableRef
+from simplebt.db._copy import CopyColumn, CopyWriter
+from simplebt.resources.config import TICKS_SCHEMA_NAME, TICKS_TABLE_LAYOUT, TICKS_TABLE_PARTITION
+from simplebt.utils import from_ns, to_ns, to_utc
+
+logger = logging.getLogger("DbTicks")
+
+# pk: the original layout, keyed on the "<time>_<ix>" strings of hashed_tick_info_gen, with a btree on time besides.
+# compact: keyed on (time, seq), seq being the ix of the pk as a smallint: the key doubles as the time index.
+# Prices are stored as real: exact for the binary fractions most futures tick in, and other prices are rounded
+# back to the shortest decimals of the real once read (see round_real_prices), which gives back the float8 they were
+# stored from as long as it has at most 6 significant digits, and in practice up to 7 and 8. Sizes are integers either way.
+TICK_TABLE_LAYOUTS: Tuple[str, ...] = ("pk", "compact")
+KEY_COLUMNS: Dict[str, str] = {"pk": "pk", "compact": "seq"}
+PRICE_COLUMNS: Tuple[str, ...] = ("price", "bid", "ask")
+
+# Compact tables can be range partitioned on time, by UTC day or month: the partition of each period is created
+# the first time ticks of that period are inserted, and named <table>_p<YYYYMMDD> or <table>_p<YYYYMM>.
+# Time range queries, and the min/max of the downloader, only scan the partitions they need.
+# Partitions also have a BRIN index on time, a few pages each, which gets selective once they are clustered.
+TICK_TABLE_PARTITIONS: Tuple[str, ...] = ("day", "month")
+_PARTITION_UNITS: Dict[str, str] = {"day": "D", "month": "M"}
+_PARTITION_FORMATS: Dict[str, str] = {"day": "%Y%m%d", "month": "%Y%m"}
+# Table comments: the partitioning of a table, and the partitions maintain_partitions() is done with
+PARTITION_COMMENT: str = "partitioned by {partition}"
+MAINTAINED_COMMENT: str = "maintained"
 
 
 CREATE_TABLE_QUERIES: Dict[str, str] = {
@@ -35,6 +62,108 @@ CREATE_TABLE_QUERIES: Dict[str, str] = {
     """,
 }
 
+CREATE_COMPACT_TABLE_QUERIES: Dict[str, str] = {
+    "TRADES": """
+        create table if not exists {schema}.{table} (
+             time       timestamptz not null
+            ,seq        smallint not null
+            ,price      real
+            ,size       integer
+            ,exchange   varchar(50)
+            ,primary key (time, seq)
+        );
+    """,
+    "BID_ASK": """
+        create table if not exists {schema}.{table} (
+             time           timestamptz not null
+            ,seq            smallint not null
+            ,bid            real
+            ,ask            real
+            ,bid_size       integer
+            ,ask_size       integer
+            ,bid_decrease   boolean
+            ,ask_increase   boolean
+            ,primary key (time, seq)
+        );
+    """,
+}
+
+CREATE_PARTITIONED_TABLE_QUERIES: Dict[str, str] = {
+    "TRADES": """
+        create table if not exists {schema}.{table} (
+             time       timestamptz not null
+            ,seq        smallint not null
+            ,price      real
+            ,size       integer
+            ,exchange   varchar(50)
+            ,primary key (time, seq)
+        ) partition by range (time);
+        create index if not exists {table}_time_brin on {schema}.{table} using brin(time);
+        comment on table {schema}.{table} is '{comment}';
+    """,
+    "BID_ASK": """
+        create table if not exists {schema}.{table} (
+             time           timestamptz not null
+            ,seq            smallint not null
+            ,bid            real
+            ,ask            real
+            ,bid_size       integer
+            ,ask_size       integer
+            ,bid_decrease   boolean
+            ,ask_increase   boolean
+            ,primary key (time, seq)
+        ) partition by range (time);
+        create index if not exists {table}_time_brin on {schema}.{table} using brin(time);
+        comment on table {schema}.{table} is '{comment}';
+    """,
+}
+
+CREATE_PARTITION_QUERY: str = """
+    create table if not exists {schema}.{partition} partition of {schema}.{table}
+    for values from ('{start} 00:00+00') to ('{end} 00:00+00');
+"""
+
+COPY_COLUMNS: Dict[str, Tuple[CopyColumn, ...]] = {
+    "TRADES": (
+        CopyColumn("time", "timestamptz"),
+        CopyColumn("price", "float8"),
+        CopyColumn("size", "int4"),
+        CopyColumn("exchange", "text"),
+        CopyColumn("pk", "text"),
+    ),
+    "BID_ASK": (
+        CopyColumn("time", "timestamptz"),
+        CopyColumn("bid", "float8"),
+        CopyColumn("ask", "float8"),
+        CopyColumn("bid_size", "int4"),
+        CopyColumn("ask_size", "int4"),
+        CopyColumn("bid_decrease", "bool"),
+        CopyColumn("ask_increase", "bool"),
+        CopyColumn("pk", "text"),
+    ),
+}
+
+# Same order as COPY_COLUMNS, so that the rows of sequenced_tick_info_gen line up with them
+COMPACT_COPY_COLUMNS: Dict[str, Tuple[CopyColumn, ...]] = {
+    "TRADES": (
+        CopyColumn("time", "timestamptz"),
+        CopyColumn("price", "float4"),
+        CopyColumn("size", "int4"),
+        CopyColumn("exchange", "text"),
+        CopyColumn("seq", "int2"),
+    ),
+    "BID_ASK": (
+        CopyColumn("time", "timestamptz"),
+        CopyColumn("bid", "float4"),
+        CopyColumn("ask", "float4"),
+        CopyColumn("bid_size", "int4"),
+        CopyColumn("ask_size", "int4"),
+        CopyColumn("bid_decrease", "bool"),
+        CopyColumn("ask_increase", "bool"),
+        CopyColumn("seq", "int2"),
+    ),
+}
+
 
 def extract_tick_info(
     tick: Union[HistoricalTickLast, HistoricalTickBidAsk]
@@ -56,14 +185,13 @@ def extract_tick_info(
         )
 
 
-def hashed_tick_info_gen(
+def sequenced_tick_info_gen(
     ticks: List[Union[HistoricalTickLast, HistoricalTickBidAsk]]
 ):
     """
     Based on the assumption that the IBKR API will continue to include all ticks belonging to the same second in a single request
     """
     t0 = ticks[0].time
-    hash_len = len(str(len(ticks)))
     i = 0
     for t in ticks:
         if t.time == t0:
@@ -71,20 +199,143 @@ def hashed_tick_info_gen(
         else:
             i = 0
             t0 = t.time
-        ix = str(i).zfill(hash_len)
-        hashed_tick_info = extract_tick_info(t) + (f"{t.time}_{ix}",)
-        yield hashed_tick_info
+        yield extract_tick_info(t) + (i,)
+
+
+def hashed_tick_info_gen(
+    ticks: List[Union[HistoricalTickLast, HistoricalTickBidAsk]]
+):
+    hash_len = len(str(len(ticks)))
+    for *tick_info, i in sequenced_tick_info_gen(ticks):
+        yield tuple(tick_info) + (f"{tick_info[0]}_{str(i).zfill(hash_len)}",)
+
+
+def tick_sequence(times: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of the index computed by hashed_tick_info_gen, for sorted tick times:
+    position of each tick among the ticks of the same second, starting at 1 for the first second and at 0 after.
+    """
+    n: int = len(times)
+    ix: np.ndarray = np.arange(n)
+    new_run: np.ndarray = np.ones(n, dtype=bool)
+    new_run[1:] = times[1:] != times[:-1]
+    run_start: np.ndarray = np.maximum.accumulate(np.where(new_run, ix, 0))
+    return ix - run_start + (run_start == 0)
+
+
+def tick_pks(times: np.ndarray) -> List[str]:
+    """Same pks as hashed_tick_info_gen, given the tick times in nanoseconds"""
+    if len(times) == 0:
+        return []
+    hash_len: int = len(str(len(times)))
+    seqs: List[str] = np.char.zfill(tick_sequence(times).astype(str), hash_len).tolist()
+    # Only one datetime per second is formatted
+    uniques, inverse = np.unique(times, return_inverse=True)
+    time_strs: List[str] = [str(from_ns(t)) for t in uniques.tolist()]
+    return [f"{time_strs[u]}_{seq}" for u, seq in zip(inverse.tolist(), seqs)]
+
+
+def extract_tick_columns(
+    ticks: List[Union[HistoricalTickLast, HistoricalTickBidAsk]], tick_type: str, layout: str = "pk"
+) -> Dict[str, Union[np.ndarray, List[str]]]:
+    """Columns of the ticks table, time in nanoseconds since the epoch"""
+    n: int = len(ticks)
+    times = np.fromiter((to_ns(t.time) for t in ticks), dtype=np.int64, count=n)
+    if tick_type == "TRADES":
+        columns = {
+            "time": times,
+            "price": np.fromiter((t.price for t in ticks), dtype=np.float64, count=n),
+            "size": np.fromiter((t.size for t in ticks), dtype=np.int64, count=n),
+            "exchange": [t.exchange for t in ticks],
+        }
+    elif tick_type == "BID_ASK":
+        columns = {
+            "time": times,
+            "bid": np.fromiter((t.priceBid for t in ticks), dtype=np.float64, count=n),
+            "ask": np.fromiter((t.priceAsk for t in ticks), dtype=np.float64, count=n),
+            "bid_size": np.fromiter((t.sizeBid for t in ticks), dtype=np.int64, count=n),
+            "ask_size": np.fromiter((t.sizeAsk for t in ticks), dtype=np.int64, count=n),
+            "bid_decrease": np.fromiter((t.tickAttribBidAsk.bidPastLow for t in ticks), dtype=bool, count=n),
+            "ask_increase": np.fromiter((t.tickAttribBidAsk.askPastHigh for t in ticks), dtype=bool, count=n),
+        }
+    else:
+        raise ValueError(f"Unknown tick type {tick_type}")
+    if layout == "compact":
+        columns["seq"] = tick_sequence(times)
+    else:
+        columns["pk"] = tick_pks(times)
+    return columns
+
+
+def price_select_expression(column: str, layout: str) -> str:
+    """Expression selecting a column as float8. real prices come back as e.g. 75.43000030517578: see round_real_prices()"""
+    if layout == "compact" and column in PRICE_COLUMNS:
+        return f"{column}::float8"
+    return column
+
+
+def round_real_prices(prices: np.ndarray) -> np.ndarray:
+    """
+    Round real prices read as float8 to the fewest decimals that give the same real: 75.43000030517578 to 75.43,
+    the float8 a real column was written from as long as it had at most 6 significant digits.
+    Done here rather than through ::text in the queries: a text round-trip per row, which rounds to 6 digits
+    before Postgres 12 unless extra_float_digits is set.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    reals: np.ndarray = prices.astype(np.float32)
+    rounded: np.ndarray = prices.copy()
+    todo: np.ndarray = np.arange(len(prices))
+    # A real has at most 9 significant digits: prices well below 1 are the only ones left as they are
+    for decimals in range(10):
+        if len(todo) == 0:
+            break
+        candidates: np.ndarray = np.round(prices[todo], decimals)
+        found: np.ndarray = candidates.astype(np.float32) == reals[todo]
+        rounded[todo[found]] = candidates[found]
+        todo = todo[~found]
+    return rounded
+
+
+def next_partition_start(start: datetime.date, partition: str) -> datetime.date:
+    return (np.datetime64(start, _PARTITION_UNITS[partition]) + 1).astype("datetime64[D]").item()
+
+
+def partition_starts(times: np.ndarray, partition: str) -> List[datetime.date]:
+    """First days of the partitions holding times, in nanoseconds since the epoch"""
+    starts: np.ndarray = np.unique(times.astype("datetime64[ns]").astype(f"datetime64[{_PARTITION_UNITS[partition]}]"))
+    return starts.astype("datetime64[D]").tolist()
 
 
 class DbTicks(Db):
-    def __init__(self, contract: Contract, tick_type: str, db_connection=None):
-        super().__init__(db_connection=db_connection)
+    def __init__(
+        self,
+        contract: Contract,
+        tick_type: str,
+        db_connection=None,
+        pool: Optional[DbPool] = None,
+        layout: Optional[str] = None,
+        partition: Optional[str] = TICKS_TABLE_PARTITION,
+    ):
+        """
+        An existing table keeps its layout and partitioning, looked up in the catalog. The parameters are for a new one:
+        :param layout: One of TICK_TABLE_LAYOUTS. Defaults to TICKS_TABLE_LAYOUT.
+        :param partition: One of TICK_TABLE_PARTITIONS, or None not to partition the table
+        """
+        super().__init__(db_connection=db_connection, pool=pool)
+        if layout is not None and layout not in TICK_TABLE_LAYOUTS:
+            raise ValueError(f"layout should be one of {TICK_TABLE_LAYOUTS}, got {layout}")
+        if partition is not None and partition not in TICK_TABLE_PARTITIONS:
+            raise ValueError(f"partition should be one of {TICK_TABLE_PARTITIONS} or None, got {partition}")
+        self.contract: Contract = contract
+        self.tick_type: str = tick_type
         self.table_ref: TableRef = self.get_table_reference(
             contract=contract, tick_type=tick_type
         )
-        self.create_table_query: str = CREATE_TABLE_QUERIES[tick_type].format(
-            schema=self.table_ref.schema, table=self.table_ref.table
-        )
+        self._layout: Optional[str] = layout
+        self._partition: Optional[str] = partition
+        self._described: bool = False
+        # Partitions known to exist
+        self._partitions: Set[str] = set()
 
     @staticmethod
     def get_table_reference(contract: Contract, tick_type: str) -> TableRef:
@@ -98,10 +349,199 @@ class DbTicks(Db):
         table_name: str = f"{contract.symbol}{exp}_{contract.conId}_{tick_type}".lower()
         return TableRef(TICKS_SCHEMA_NAME, table_name)
 
+    @staticmethod
+    def parse_table_name(table: str) -> Optional[Tuple[Contract, str]]:
+        """
+        The contract (symbol, expiry and conId only) and tick type of a table named by get_table_reference().
+        None if it isn't one
+        """
+        m = re.fullmatch(r"([a-z]+?)(\d{8})?_(\d+)_(trades|bid_ask)", table)
+        if m is None:
+            return None
+        symbol, expiry, con_id, tick_type = m.groups()
+        contract = Contract(
+            secType="FUT" if expiry else "",
+            symbol=symbol.upper(),
+            lastTradeDateOrContractMonth=expiry or "",
+            conId=int(con_id),
+        )
+        return contract, tick_type.upper()
+
+    @property
+    def layout(self) -> str:
+        self._describe()
+        return self._layout
+
+    @property
+    def partition(self) -> Optional[str]:
+        self._describe()
+        return self._partition
+
+    @property
+    def key_column(self) -> str:
+        """Orders the ticks of the same time as they were received"""
+        return KEY_COLUMNS[self.layout]
+
+    @property
+    def create_table_query(self) -> str:
+        if self.partition is not None:
+            if self.layout != "compact":
+                raise ValueError("Only compact tables can be partitioned: the time has to be part of their primary key")
+            return CREATE_PARTITIONED_TABLE_QUERIES[self.tick_type].format(
+                schema=self.table_ref.schema,
+                table=self.table_ref.table,
+                comment=PARTITION_COMMENT.format(partition=self.partition),
+            )
+        queries: Dict[str, str] = CREATE_COMPACT_TABLE_QUERIES if self.layout == "compact" else CREATE_TABLE_QUERIES
+        return queries[self.tick_type].format(schema=self.table_ref.schema, table=self.table_ref.table)
+
+    @property
+    def copy_columns(self) -> Tuple[CopyColumn, ...]:
+        return (COMPACT_COPY_COLUMNS if self.layout == "compact" else COPY_COLUMNS)[self.tick_type]
+
+    def clone_to_temp_table(self, conn, table: str) -> "DbTicks":
+        """
+        A DbTicks on a temporary copy of this table, indexes included, e.g. to time writes without touching the table.
+        Temporary tables only live in the session of conn, the connection of the copy. A partitioned table is copied
+        as a plain one.
+        """
+        clone = DbTicks(
+            contract=self.contract, tick_type=self.tick_type, db_connection=conn, layout=self.layout, partition=None
+        )
+        clone.table_ref = TableRef("pg_temp", table)
+        clone._described = True  # the layout is that of this table, the copy is not partitioned
+        with clone.cursor() as cursor:
+            cursor.execute(f"create temp table {table} (like {self.table_ref.schema}.{self.table_ref.table} including all);")
+        return clone
+
+    def _describe(self):
+        """Looked up once in the catalog"""
+        if self._described:
+            return
+        description: Optional[Tuple[str, Optional[str]]] = self._describe_table(table_ref=self.table_ref)
+        if description is not None:
+            self._layout, self._partition = description
+        elif self._layout is None:
+            self._layout = TICKS_TABLE_LAYOUT
+        self._described = True
+
+    def _describe_table(self, table_ref: TableRef) -> Optional[Tuple[str, Optional[str]]]:
+        """Layout and partitioning of a table. None if it doesn't exist"""
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                select
+                     c.relkind = 'p'
+                    ,coalesce(obj_description(c.oid, 'pg_class'), '')
+                    ,exists(select 1 from pg_attribute a where a.attrelid = c.oid and a.attname = 'seq' and not a.attisdropped)
+                from pg_class c join pg_namespace n on n.oid = c.relnamespace
+                where n.nspname = %s and c.relname = %s;
+                """,
+                (table_ref.schema, table_ref.table),
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        partitioned, comment, has_seq = row
+        partition: Optional[str] = None
+        if partitioned:
+            partition = next((p for p in TICK_TABLE_PARTITIONS if comment == PARTITION_COMMENT.format(partition=p)), None)
+            if partition is None:
+                raise ValueError(f"{table_ref.table} is partitioned, but not by create_table(): comment '{comment}'")
+        return ("compact" if has_seq else "pk"), partition
+
+    def _partition_name(self, start: datetime.date) -> str:
+        return f"{self.table_ref.table}_p{start.strftime(_PARTITION_FORMATS[self.partition])}"
+
+    def _create_partitions(self, times: np.ndarray):
+        """Create the partitions for ticks at times, in nanoseconds, that don't exist yet"""
+        for start in partition_starts(times=times, partition=self.partition):
+            name: str = self._partition_name(start)
+            if name in self._partitions:
+                continue
+            query: str = CREATE_PARTITION_QUERY.format(
+                schema=self.table_ref.schema,
+                table=self.table_ref.table,
+                partition=name,
+                start=start,
+                end=next_partition_start(start=start, partition=self.partition),
+            )
+            with self.cursor() as cursor:
+                try:
+                    cursor.execute(query)
+                except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+                    pass  # created meanwhile by another connection
+            self._partitions.add(name)
+            logger.debug(f"Created partition {name}")
+
+    def get_partitions(self) -> List[Tuple[str, datetime.date, datetime.date, bool]]:
+        """Name, first day, day after the last one and whether maintain_partitions() is done with it, of every partition"""
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                select c.relname, coalesce(obj_description(c.oid, 'pg_class'), '') = %s
+                from pg_inherits i join pg_class c on c.oid = i.inhrelid
+                where i.inhparent = %s::regclass
+                order by c.relname;
+                """,
+                (MAINTAINED_COMMENT, f"{self.table_ref.schema}.{self.table_ref.table}"),
+            )
+            rows = cursor.fetchall()
+        prefix: str = f"{self.table_ref.table}_p"
+        partitions: List[Tuple[str, datetime.date, datetime.date, bool]] = []
+        for name, maintained in rows:
+            start = datetime.datetime.strptime(name[len(prefix):], _PARTITION_FORMATS[self.partition]).date()
+            partitions.append((name, start, next_partition_start(start=start, partition=self.partition), maintained))
+        return partitions
+
+    def maintain_partitions(
+        self,
+        older_than: datetime.timedelta = datetime.timedelta(days=7),
+        cluster: bool = True,
+        force: bool = False,
+    ) -> List[str]:
+        """
+        Cluster the partitions that ended more than older_than ago on their primary key, then vacuum, freeze and analyze them.
+        The downloader pages backwards, so the rows of a partition are written out of time order: clustering sorts them,
+        which is what the BRIN index needs. Each partition is locked while it's clustered, the others stay available.
+        :param force: Also redo the partitions maintained already
+        :return: the partitions maintained
+        """
+        if self.partition is None:
+            raise ValueError(f"{self.table_ref.table} isn't partitioned")
+        cutoff: datetime.datetime = datetime.datetime.now(datetime.timezone.utc) - older_than
+        schema: str = self.table_ref.schema
+        maintained: List[str] = []
+        for name, _, end, done in self.get_partitions():
+            if (done and not force) or datetime.datetime.combine(end, datetime.time(), tzinfo=datetime.timezone.utc) > cutoff:
+                continue
+            with self.cursor() as cursor:
+                if cluster:
+                    cursor.execute(
+                        "select indexrelid::regclass::text from pg_index where indrelid = %s::regclass and indisprimary;",
+                        (f"{schema}.{name}",),
+                    )
+                    index: str = cursor.fetchone()[0]
+                    cursor.execute(f"cluster {schema}.{name} using {index.split('.')[-1]};")
+                # VACUUM can't run in a transaction: connections are autocommit
+                cursor.execute(f"vacuum (freeze, analyze) {schema}.{name};")
+                cursor.execute(f"comment on table {schema}.{name} is '{MAINTAINED_COMMENT}';")
+            maintained.append(name)
+            logger.info(f"Maintained partition {name}")
+        return maintained
+
     def get_oldest_timestamp(self) -> Optional[datetime.datetime]:
-        with self.conn.cursor() as cursor:
+        return self._get_timestamp(func="min")
+
+    def get_newest_timestamp(self) -> Optional[datetime.datetime]:
+        return self._get_timestamp(func="max")
+
+    def _get_timestamp(self, func: str) -> Optional[datetime.datetime]:
+        if func not in ("min", "max"):
+            raise ValueError("Either min or max")
+        with self.cursor() as cursor:
             cursor.execute(
-                f"select min(time) from {self.table_ref.schema}.{self.table_ref.table};"
+                f"select {func}(time) from {self.table_ref.schema}.{self.table_ref.table};"
             )
             t: Optional[datetime.datetime] = cursor.fetchone()[0]  # each result is a tuple, that's why the [0] slicing
         if isinstance(t, datetime.datetime):
@@ -110,7 +550,7 @@ class DbTicks(Db):
             return None
 
     def create_table(self) -> None:
-        with self.conn.cursor() as cursor:
+        with self.cursor() as cursor:
             cursor.execute(self.create_table_query)
 
     def insert_execute_values_iterator(
@@ -122,11 +562,130 @@ class DbTicks(Db):
         THANKS: https://hakibenita.com/fast-load-data-python-postgresql
         """
         table = f"{self.table_ref.schema}.{self.table_ref.table}"
-        to_insert = hashed_tick_info_gen(ticks)
-        with self.conn.cursor() as cursor:
+        columns = ", ".join(c.name for c in self.copy_columns)
+        if self.partition is not None:
+            self._create_partitions(np.fromiter((to_ns(t.time) for t in ticks), dtype=np.int64, count=len(ticks)))
+        to_insert = sequenced_tick_info_gen(ticks) if self.layout == "compact" else hashed_tick_info_gen(ticks)
+        with self.cursor() as cursor:
             psycopg2.extras.execute_values(
                 cursor,
-                "insert into " + table + " values %s;",
+                "insert into " + table + " (" + columns + ") values %s;",
                 to_insert,
                 page_size=page_size,
             )
+
+    def insert_copy(
+        self,
+        ticks: List[Union[HistoricalTickLast, HistoricalTickBidAsk]],
+        fmt: str = "binary",
+        buffer_size: int = 8 * 1024 * 1024,
+    ) -> int:
+        """
+        Same rows as insert_execute_values_iterator(), streamed through COPY ... FROM STDIN.
+        :param fmt: text or binary COPY format
+        :return: the number of rows inserted
+        """
+        columns = extract_tick_columns(ticks=ticks, tick_type=self.tick_type, layout=self.layout)
+        if self.partition is not None:
+            self._create_partitions(columns["time"])
+        with self.connection() as conn, CopyWriter(
+            conn=conn,
+            table_ref=self.table_ref,
+            columns=self.copy_columns,
+            fmt=fmt,
+            buffer_size=buffer_size,
+        ) as writer:
+            writer.write(columns)
+        return writer.rows_written
+
+    def migrate_to_compact(self, batch_size: int = 100000, check_prices: bool = True) -> int:
+        """
+        Convert the table from the pk layout to the compact one, in place and in batches: the rows are copied into
+        a new table a few seconds of ticks at a time, each batch in its own transaction. Then, in a single transaction,
+        the rows written meanwhile are copied too and the new table takes the place of the old one.
+        An interrupted migration resumes after the last batch copied. The new table isn't partitioned.
+        :param batch_size: Number of rows per batch, give or take the ticks of its last second
+        :param check_prices: Stop before a batch whose prices don't read back the same as real
+        :return: the number of rows copied
+        """
+        if self.layout == "compact":
+            logger.info(f"{self.table_ref.table} is compact already")
+            return 0
+        if self._describe_table(table_ref=self.table_ref) is None:
+            raise ValueError(f"No table {self.table_ref.schema}.{self.table_ref.table}")
+        schema, table = self.table_ref
+        new_table: str = f"{table}_compact"
+        copy_columns: Tuple[CopyColumn, ...] = COMPACT_COPY_COLUMNS[self.tick_type]
+        names: str = ", ".join(c.name for c in copy_columns)
+        # pk is "<time>_<ix>": seq is the ix
+        expressions: str = ", ".join(
+            r"substring(pk from '_(\d+)$')::smallint" if c.name == "seq" else c.name for c in copy_columns
+        )
+        prices: List[str] = [c.name for c in copy_columns if c.name in PRICE_COLUMNS]
+        insert_query: str = f"""
+            insert into {schema}.{new_table} ({names})
+            select {expressions} from {schema}.{table} where {{condition}}
+            on conflict do nothing;
+        """
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(CREATE_COMPACT_TABLE_QUERIES[self.tick_type].format(schema=schema, table=new_table))
+            cursor.execute(f"select max(time) from {schema}.{new_table};")
+            start: Optional[datetime.datetime] = cursor.fetchone()[0]
+            copied: int = 0
+            while True:
+                after: str = "true" if start is None else "time > %(start)s"
+                # Batches end on whole seconds, so that the newest time copied is always complete
+                cursor.execute(
+                    f"select time from {schema}.{table} where {after} order by time offset %(offset)s limit 1;",
+                    {"start": start, "offset": batch_size - 1},
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    break
+                condition: str = f"{after} and time <= %(end)s"
+                params: Dict[str, Optional[datetime.datetime]] = {"start": start, "end": row[0]}
+                if check_prices:
+                    self._check_real_prices(cursor=cursor, condition=condition, params=params, prices=prices)
+                cursor.execute(insert_query.format(condition=condition), params)
+                copied += cursor.rowcount
+                start = row[0]
+                logger.info(f"Copied {copied} rows of {table}, up to {start}")
+
+            # The last rows, with the old table locked against writes until it's swapped for the new one
+            after = "true" if start is None else "time > %(start)s"
+            conn.autocommit = False
+            try:
+                with conn:  # commits, or rolls back if anything fails
+                    cursor.execute(f"lock table {schema}.{table} in exclusive mode;")
+                    if check_prices:
+                        self._check_real_prices(cursor=cursor, condition=after, params={"start": start}, prices=prices)
+                    cursor.execute(insert_query.format(condition=after), {"start": start})
+                    copied += cursor.rowcount
+                    cursor.execute(
+                        f"select (select count(*) from {schema}.{table}) - (select count(*) from {schema}.{new_table});"
+                    )
+                    dropped: int = cursor.fetchone()[0]
+                    cursor.execute(f"drop table {schema}.{table};")
+                    cursor.execute(f"alter table {schema}.{new_table} rename to {table};")
+                    cursor.execute(f"alter table {schema}.{table} rename constraint {new_table}_pkey to {table}_pkey;")
+            finally:
+                conn.autocommit = True
+        if dropped:
+            logger.warning(f"{dropped} rows of {table} had the same time and seq as another one and were left out")
+        self._layout = "compact"
+        logger.info(f"Migrated {table} to the compact layout")
+        return copied
+
+    def _check_real_prices(self, cursor, condition: str, params: dict, prices: List[str]):
+        # A batch only has a few distinct prices: they are checked as the loaders will read them back
+        distinct: str = " union ".join(
+            f"select {p} from {self.table_ref.schema}.{self.table_ref.table} where ({condition}) and {p} is not null"
+            for p in prices
+        )
+        cursor.execute(f"{distinct};", params)
+        values: np.ndarray = np.array([r[0] for r in cursor.fetchall()], dtype=np.float64)
+        n: int = int(np.count_nonzero((round_real_prices(values) != values) & ~np.isnan(values)))
+        if n:
+            raise ValueError(
+                f"{n} prices of {self.table_ref.table} can't be held by real, the table was left as it is"
+            )
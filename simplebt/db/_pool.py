@@ -0,0 +1,98 @@
+"""
+Connection pool shared by the Db objects, and server-side prepared statements.
+"""
+import weakref
+import psycopg2
+import psycopg2.errors
+import psycopg2.pool
+from typing import Optional, Sequence, Set
+from simplebt.resources.config import PGHOST, PGPORT, PGDATABASE, PGUSER, PGPASSWORD
+
+_shared_pool: Optional["DbPool"] = None
+
+# Postgres truncates longer identifiers, prepared statement names included: NAMEDATALEN - 1
+MAX_IDENTIFIER_BYTES: int = 63
+
+# Names of the statements prepared on each connection. Prepared statements only live as long as their session:
+# entries go away with their connection, whoever closes it
+_prepared: "weakref.WeakKeyDictionary[object, Set[str]]" = weakref.WeakKeyDictionary()
+
+
+class DbPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    Pool of autocommit connections with the session time zone set to UTC.
+    Db objects built with pool=... borrow a connection for each query instead of holding their own.
+    Loaders streaming through a server-side cursor hold theirs until they're closed, though: maxconn has to
+    be larger than the number of streams, e.g. one per tick type and contract of a Backtester.
+    Only the public getconn() is extended: connections are set up the first time they are lent.
+    """
+    def __init__(self, minconn: int = 1, maxconn: int = 10):
+        super().__init__(
+            minconn,
+            maxconn,
+            host=PGHOST,
+            port=PGPORT,
+            user=PGUSER,
+            password=PGPASSWORD,
+            database=PGDATABASE,
+        )
+        self._set_up: "weakref.WeakSet" = weakref.WeakSet()
+
+    def getconn(self, key=None):
+        conn = super().getconn(key)
+        if conn not in self._set_up:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SET TIME ZONE 'UTC';")
+            self._set_up.add(conn)
+        return conn
+
+
+def get_shared_pool(minconn: int = 1, maxconn: int = 10) -> DbPool:
+    """One pool per process, created on first use. The sizes are only used to create it"""
+    global _shared_pool
+    if _shared_pool is None or _shared_pool.closed:
+        _shared_pool = DbPool(minconn=minconn, maxconn=maxconn)
+    return _shared_pool
+
+
+def close_shared_pool():
+    global _shared_pool
+    if _shared_pool is not None and not _shared_pool.closed:
+        _shared_pool.closeall()
+    _shared_pool = None
+
+
+def execute_prepared(cursor, name: str, query: str, types: Sequence[str], params: Sequence):
+    """
+    Run query, with placeholders $1, $2..., as the server-side prepared statement name.
+    The statement is prepared on the first execution on each connection: Postgres parses and plans it only once.
+    :param name: At most MAX_IDENTIFIER_BYTES long, or two names sharing a prefix would run the same statement
+    :param types: Postgres types of the parameters
+    """
+    if len(name.encode()) > MAX_IDENTIFIER_BYTES:
+        raise ValueError(f"Prepared statement name longer than {MAX_IDENTIFIER_BYTES} bytes: {name}")
+    prepared: Set[str] = _prepared.setdefault(cursor.connection, set())
+    if name not in prepared:
+        _prepare(cursor, name=name, query=query, types=types)
+        prepared.add(name)
+    execute: str = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})"
+    try:
+        cursor.execute(execute, tuple(params))
+    except psycopg2.errors.InvalidSqlStatementName:
+        # Deallocated behind our back (e.g. DISCARD ALL by a connection pooler): prepare it again.
+        # Connections are autocommit, so the failed EXECUTE left no transaction to roll back
+        _prepare(cursor, name=name, query=query, types=types)
+        cursor.execute(execute, tuple(params))
+
+
+def _prepare(cursor, name: str, query: str, types: Sequence[str]):
+    try:
+        cursor.execute(f"PREPARE {name} ({', '.join(types)}) AS {query}")
+    except psycopg2.errors.DuplicatePreparedStatement:
+        pass  # prepared on this session without execute_prepared()
+
+
+def forget_prepared(conn):
+    """To call when closing a connection"""
+    _prepared.pop(conn, None)
@@ -1,5 +1,9 @@
+import time
 import pandas as pd
-from typing import List
+from dataclasses import dataclass
+from ib_insync.objects import HistoricalTickBidAsk, HistoricalTickLast, TickAttribBidAsk, TickAttribLast
+from typing import List, Sequence, Tuple, Union
+from simplebt.db import DbBars, DbTicks
 
 
 def read_tables_from_info_schema(
@@ -19,3 +23,93 @@ def read_tables_from_info_schema(
                     df[c] = pd.to_datetime(df[c], utc=True)
         out[t["table_name"]] = df
     return out
+
+
+INGESTION_METHODS: Tuple[str, ...] = ("execute_values", "copy_text", "copy_binary")
+
+
+@dataclass(frozen=True)
+class IngestionBenchmark:
+    table: str
+    method: str
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+
+def benchmark_ingestion(
+    db: Union[DbTicks, DbBars],
+    rows: list,
+    methods: Sequence[str] = INGESTION_METHODS,
+) -> List[IngestionBenchmark]:
+    """
+    Time the insertion of rows (ticks or bars, as downloaded from IB) with each method.
+    Every method writes into its own temporary copy of the table, indexes included,
+    so the table itself is left untouched.
+    Temporary tables are only visible in their session, so a pooled db is pinned to one connection meanwhile.
+    """
+    with db.connection() as conn:
+        return _benchmark_ingestion(db=db, conn=conn, rows=rows, methods=methods)
+
+
+def _benchmark_ingestion(
+    db: Union[DbTicks, DbBars],
+    conn,
+    rows: list,
+    methods: Sequence[str],
+) -> List[IngestionBenchmark]:
+    results: List[IngestionBenchmark] = []
+    for method in methods:
+        bench_db: Union[DbTicks, DbBars] = db.clone_to_temp_table(conn=conn, table=f"{db.table_ref.table}_bench")
+        try:
+            start = time.perf_counter()
+            if method == "execute_values":
+                bench_db.insert_execute_values_iterator(rows)
+            elif method == "copy_text":
+                bench_db.insert_copy(rows, fmt="text")
+            elif method == "copy_binary":
+                bench_db.insert_copy(rows, fmt="binary")
+            else:
+                raise ValueError(f"Unknown ingestion method {method}")
+            seconds = time.perf_counter() - start
+        finally:
+            with bench_db.cursor() as cursor:
+                cursor.execute(f"drop table if exists pg_temp.{bench_db.table_ref.table};")
+        results.append(IngestionBenchmark(table=db.table_ref.table, method=method, rows=len(rows), seconds=seconds))
+    return results
+
+
+def format_ingestion_report(results: List[IngestionBenchmark]) -> str:
+    lines = [f"{'table':<40}{'method':<16}{'rows':>10}{'seconds':>10}{'rows/sec':>12}"]
+    for r in results:
+        lines.append(f"{r.table:<40}{r.method:<16}{r.rows:>10}{r.seconds:>10.3f}{r.rows_per_sec:>12.0f}")
+    return "\n".join(lines)
+
+
+def read_sample_ticks(db: DbTicks, limit: int = 100000) -> List[Union[HistoricalTickLast, HistoricalTickBidAsk]]:
+    """Read back the oldest ticks of a table as IB objects, e.g. to feed benchmark_ingestion()"""
+    table = f"{db.table_ref.schema}.{db.table_ref.table}"
+    with db.cursor() as cursor:
+        if db.tick_type == "TRADES":
+            cursor.execute(f"select time, price, size, exchange from {table} order by time, {db.key_column} limit {limit};")
+            return [
+                HistoricalTickLast(
+                    time=t, tickAttribLast=TickAttribLast(), price=price, size=size,
+                    exchange=exchange, specialConditions="",
+                )
+                for t, price, size, exchange in cursor.fetchall()
+            ]
+        cursor.execute(
+            f"select time, bid, ask, bid_size, ask_size, bid_decrease, ask_increase from {table} "
+            f"order by time, {db.key_column} limit {limit};"
+        )
+        return [
+            HistoricalTickBidAsk(
+                time=t, tickAttribBidAsk=TickAttribBidAsk(bidPastLow=bid_decrease, askPastHigh=ask_increase),
+                priceBid=bid, priceAsk=ask, sizeBid=bid_size, sizeAsk=ask_size,
+            )
+            for t, bid, ask, bid_size, ask_size, bid_decrease, ask_increase in cursor.fetchall()
+        ]
@@ -0,0 +1,66 @@
+import heapq
+import itertools
+from typing import Callable, Dict, List, Tuple, Type
+
+from simplebt.events.generic import Event
+from simplebt.events.market import FillEvent, PendingTickersEvent, PnLSingleEvent
+from simplebt.events.orders import OrderCanceledEvent, OrderReceivedEvent
+
+# Events put during the same step are delivered in this order, then in the order they were put
+EVENT_KIND_RANKS: Dict[Type[Event], int] = {
+    FillEvent: 0,
+    PnLSingleEvent: 1,
+    PendingTickersEvent: 2,
+    OrderReceivedEvent: 3,
+    OrderCanceledEvent: 3,
+}
+
+Callback = Callable[[Event], None]
+
+
+class EventBus:
+    """
+    Priority queue of events ordered by (step, kind rank, sequence number), with subscribers per event type.
+    The step is that of the backtester when the event was put, not the time of the event: an order stamped before
+    the current step, e.g. at the end of a batch strategy window, doesn't jump ahead of the events queued already.
+    The backtester is single-threaded, so unlike queue.Queue there is no locking, and the order of delivery
+    doesn't depend on anything but the events themselves.
+    """
+    def __init__(self, kind_ranks: Dict[Type[Event], int] = EVENT_KIND_RANKS):
+        self._kind_ranks: Dict[Type[Event], int] = kind_ranks
+        self._heap: List[Tuple] = []
+        self._seq = itertools.count()
+        self._step: int = 0
+        self._subscribers: Dict[Type[Event], List[Callback]] = {t: [] for t in kind_ranks}
+
+    def put(self, event: Event):
+        rank = self._kind_ranks.get(type(event))
+        if rank is None:
+            raise ValueError(f"Got unexpected event: {event}")
+        heapq.heappush(self._heap, (self._step, rank, next(self._seq), event))
+
+    def next_step(self):
+        """Events put from now on are delivered after those put so far"""
+        self._step += 1
+
+    def pop(self) -> Event:
+        return heapq.heappop(self._heap)[-1]
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def subscribe(self, event_type: Type[Event], callback: Callback):
+        """Callbacks of the same event type are called in the order they subscribed"""
+        if event_type not in self._subscribers:
+            raise ValueError(f"Unknown event type: {event_type}")
+        self._subscribers[event_type].append(callback)
+
+    def unsubscribe(self, event_type: Type[Event], callback: Callback):
+        self._subscribers[event_type].remove(callback)
+
+    def has_subscribers(self, event_type: Type[Event]) -> bool:
+        return len(self._subscribers[event_type]) > 0
+
+    def dispatch(self, event: Event):
+        for callback in self._subscribers[type(event)]:
+            callback(event)
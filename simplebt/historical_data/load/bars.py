@@ -0,0 +1,101 @@
+"""
+Loader replaying the DbBars tables of a contract instead of its ticks, for coarse and fast backtests.
+
+A bar only becomes known once it's complete: each bar is served at its close, i.e. its open time plus
+the bar size. Only time bars have a known close, so only they can be replayed, and the backtest clock
+has to hit the bar closes (time_step dividing the bar size, start_time on a bar boundary).
+"""
+import datetime
+import logging
+from typing import Dict, Optional, Tuple
+import numpy as np
+from ib_insync import Contract
+from simplebt.db import DbBars, DbPool
+from simplebt.historical_data.utils.bars import BarSpec, parse_bar_size
+from simplebt.ticker import AllLastTickBatch, BarBatch, BidAskTickBatch
+from simplebt.utils import from_ns, to_ns
+
+logger = logging.getLogger("BarsLoader")
+
+
+class BarsLoader:
+    """
+    Reads the TRADES and BID_ASK bars between start and end in bulk, once.
+    The Market matches orders against ticks derived from the bars:
+    - one trade per TRADES bar at its close price, of the bar volume
+    - one bid/ask tick per BID_ASK bar, with the time averaged bid and ask. IB doesn't report sizes in
+    BID_ASK bars: both sides get the volume traded during the bar, so that an order can't be filled
+    for more than what the market traded.
+    """
+    def __init__(
+            self,
+            contract: Contract,
+            bar_size: str,
+            start: datetime.datetime,
+            end: Optional[datetime.datetime] = None,
+            db_connection=None,
+            pool: Optional[DbPool] = None,
+            binary: bool = False,
+    ):
+        spec: BarSpec = parse_bar_size(bar_size)
+        if spec.kind != "time":
+            raise ValueError(f"Only time bars can be replayed: the close time of {spec.kind} bars is not stored")
+        self.bar_size: str = bar_size
+        self._duration_ns: int = int(spec.size)
+        # Bars closing at start are complete at start already
+        first_open: datetime.datetime = from_ns(to_ns(start) - self._duration_ns)
+        bars: Dict[str, BarBatch] = {}
+        for bar_type in ("TRADES", "BID_ASK"):
+            db = DbBars(contract=contract, bar_type=bar_type, bar_size=bar_size, db_connection=db_connection, pool=pool)
+            columns: Dict[str, np.ndarray] = db.get_bars(start=first_open, end=end, binary=binary)
+            db.close()
+            columns["time"] = columns.pop("date")
+            columns["bar_count"] = columns.pop("barCount")
+            bars[bar_type] = BarBatch(columns)
+        self._trade_bars: BarBatch = bars["TRADES"]
+        self._bidask_bars: BarBatch = bars["BID_ASK"]
+        self._trade_closes: np.ndarray = self._trade_bars.time + self._duration_ns
+        self._bidask_closes: np.ndarray = self._bidask_bars.time + self._duration_ns
+
+        self._trades: AllLastTickBatch = AllLastTickBatch({
+            "time": self._trade_closes,
+            "price": self._trade_bars.close,
+            "size": self._trade_bars.volume,
+        })
+        # Volume of the TRADES bar opened at the same time as each BID_ASK bar, 0 if there is none
+        ix: np.ndarray = np.minimum(np.searchsorted(self._trade_bars.time, self._bidask_bars.time), len(self._trade_bars) - 1)
+        volume: np.ndarray = np.zeros(len(self._bidask_bars), dtype=np.int64)
+        if len(self._trade_bars) > 0:
+            matched: np.ndarray = self._trade_bars.time[ix] == self._bidask_bars.time
+            volume[matched] = self._trade_bars.volume[ix[matched]]
+        self._bidasks: BidAskTickBatch = BidAskTickBatch({
+            "time": self._bidask_closes,
+            "bid": self._bidask_bars.open,
+            "ask": self._bidask_bars.close,
+            "bid_size": volume,
+            "ask_size": volume,
+        })
+        logger.debug(f"Loaded {len(self._trade_bars)} TRADES and {len(self._bidask_bars)} BID_ASK {bar_size} bars")
+
+    @staticmethod
+    def _at(closes: np.ndarray, t: int) -> slice:
+        return slice(np.searchsorted(closes, t, side="left"), np.searchsorted(closes, t, side="right"))
+
+    def get_bars_batch_by_time(self, time: datetime.datetime) -> Tuple[BarBatch, BarBatch]:
+        """TRADES and BID_ASK bars closing exactly at time"""
+        t: int = to_ns(time)
+        return self._trade_bars[self._at(self._trade_closes, t)], self._bidask_bars[self._at(self._bidask_closes, t)]
+
+    def get_ticks_batch_by_time(self, time: datetime.datetime) -> Tuple[AllLastTickBatch, BidAskTickBatch]:
+        """Ticks derived from the bars closing exactly at time"""
+        t: int = to_ns(time)
+        return self._trades[self._at(self._trade_closes, t)], self._bidasks[self._at(self._bidask_closes, t)]
+
+    def get_next_tick_time(self, time: datetime.datetime) -> Optional[datetime.datetime]:
+        """Close of the first bar closing at or after time. None if there are no more bars"""
+        t: int = to_ns(time)
+        next_closes = [
+            closes[ix] for closes in (self._trade_closes, self._bidask_closes)
+            for ix in (np.searchsorted(closes, t, side="left"),) if ix < len(closes)
+        ]
+        return from_ns(min(next_closes)) if next_closes else None
@@ -0,0 +1,107 @@
+"""
+Loaders replaying ticks from the local columnar cache instead of Postgres.
+
+The cache is built by simplebt.historical_data.utils.cache.build_ticks_cache and is laid out as
+    <cache_dir>/<DbTicks table name>/<YYYYMMDD>/<column>.npy
+with one file per column and per UTC day. Every day is sorted by time and
+the time column holds int64 nanoseconds since the epoch.
+"""
+import abc
+import bisect
+import datetime
+import logging
+import pathlib
+from typing import Dict, List, Optional
+import numpy as np
+from ib_insync import Contract
+from simplebt.db import DbTicks
+from simplebt.resources.config import TICKS_CACHE_DIR
+from simplebt.ticker import AllLastTickBatch, BidAskTickBatch
+from simplebt.utils import from_ns, to_ns
+
+logger = logging.getLogger("CachedTicksLoader")
+
+# The columns are stored with the dtypes of the batches they are loaded into: no conversion when replaying
+CACHE_COLUMNS: Dict[str, Dict[str, np.dtype]] = {
+    "TRADES": AllLastTickBatch.dtypes,
+    "BID_ASK": BidAskTickBatch.dtypes,
+}
+DAY_FORMAT = "%Y%m%d"
+
+
+def get_cache_table_dir(contract: Contract, tick_type: str, cache_dir: pathlib.Path = TICKS_CACHE_DIR) -> pathlib.Path:
+    return cache_dir / DbTicks.get_table_reference(contract=contract, tick_type=tick_type).table
+
+
+class CachedTicksLoader(abc.ABC):
+    def __init__(
+            self,
+            contract: Contract,
+            tick_type: str,
+            cache_dir: pathlib.Path = TICKS_CACHE_DIR,
+    ):
+        self._table_dir: pathlib.Path = get_cache_table_dir(contract=contract, tick_type=tick_type, cache_dir=cache_dir)
+        if not self._table_dir.exists():
+            raise FileNotFoundError(f"No tick cache in {self._table_dir}. Build it first with build_ticks_cache()")
+        self._dtypes: Dict[str, np.dtype] = CACHE_COLUMNS[tick_type]
+        self._cached_days: List[str] = sorted(
+            p.name for p in self._table_dir.iterdir() if p.is_dir() and p.name.isdigit()
+        )
+        self._day: Optional[datetime.date] = None
+        self._arrays: Dict[str, np.ndarray] = {}
+        logger.debug(f"Initialized loader on {self._table_dir}")
+
+    def _load_day(self, day: datetime.date):
+        """Memory-map the columns of a day. Days without a directory have no ticks"""
+        day_dir = self._table_dir / day.strftime(DAY_FORMAT)
+        if day_dir.exists():
+            self._arrays = {c: np.load(day_dir / f"{c}.npy", mmap_mode="r") for c in self._dtypes}
+        else:
+            self._arrays = {c: np.empty(0, dtype=dtype) for c, dtype in self._dtypes.items()}
+        self._day = day
+
+    def _get_ticks_by_time(self, time: datetime.datetime) -> Dict[str, np.ndarray]:
+        """Returns, for each column, the slice of ticks stamped exactly at time. Slices are views on the mapped files"""
+        day: datetime.date = time.astimezone(datetime.timezone.utc).date()
+        if day != self._day:
+            self._load_day(day=day)
+        times: np.ndarray = self._arrays["time"]
+        t: int = to_ns(time)
+        start, end = np.searchsorted(times, t, side="left"), np.searchsorted(times, t, side="right")
+        return {c: a[start:end] for c, a in self._arrays.items()}
+
+    def get_next_tick_time(self, time: datetime.datetime) -> Optional[datetime.datetime]:
+        """Time of the first tick at or after time. None if there are no more ticks in the cache"""
+        day: datetime.date = time.astimezone(datetime.timezone.utc).date()
+        if day != self._day:
+            self._load_day(day=day)
+        times: np.ndarray = self._arrays["time"]
+        ix: int = np.searchsorted(times, to_ns(time), side="left")
+        if ix < len(times):
+            return from_ns(times[ix])
+        # Nothing left today: the answer is the first tick of the next cached day
+        for day_name in self._cached_days[bisect.bisect_right(self._cached_days, day.strftime(DAY_FORMAT)):]:
+            next_times: np.ndarray = np.load(self._table_dir / day_name / "time.npy", mmap_mode="r")
+            if len(next_times) > 0:
+                return from_ns(next_times[0])
+        return None
+
+    @abc.abstractmethod
+    def get_ticks_batch_by_time(self, time: datetime.datetime):
+        raise NotImplementedError
+
+
+class CachedBidAskTicksLoader(CachedTicksLoader):
+    def __init__(self, contract: Contract, cache_dir: pathlib.Path = TICKS_CACHE_DIR):
+        super().__init__(contract=contract, tick_type="BID_ASK", cache_dir=cache_dir)
+
+    def get_ticks_batch_by_time(self, time: datetime.datetime) -> BidAskTickBatch:
+        return BidAskTickBatch(self._get_ticks_by_time(time=time))
+
+
+class CachedTradesTicksLoader(CachedTicksLoader):
+    def __init__(self, contract: Contract, cache_dir: pathlib.Path = TICKS_CACHE_DIR):
+        super().__init__(contract=contract, tick_type="TRADES", cache_dir=cache_dir)
+
+    def get_ticks_batch_by_time(self, time: datetime.datetime) -> AllLastTickBatch:
+        return AllLastTickBatch(self._get_ticks_by_time(time=time))
@@ -1,75 +1,368 @@
 import abc
 import datetime
+import hashlib
+import itertools
 import logging
-from typing import List
+from typing import ClassVar, Dict, Iterator, List, Optional, Tuple, Type
+import numpy as np
 from ib_insync import Contract
-from simplebt.db import DbTicks
-from simplebt.ticker import TickByTickAllLast, TickByTickBidAsk
+from simplebt.db import DbPool, DbTicks, execute_prepared
+from simplebt.db._copy import binary_select_expression, read_copy_binary
+from simplebt.db._db_ticks import price_select_expression, round_real_prices
+from simplebt.ticker import AllLastTickBatch, BidAskTickBatch, TickBatch
+from simplebt.utils import from_ns, to_ns
 
 logger = logging.getLogger("TicksLoader")
 
+_cursor_ids = itertools.count()
+
+# Time is selected as integer nanoseconds since the epoch (IB ticks have 1s resolution,
+# so going through microseconds is lossless)
+TIME_NS_EXPRESSION = "(extract(epoch from time) * 1000000)::bigint * 1000"
+SELECT_EXPRESSIONS: Dict[str, Dict[str, str]] = {
+    "TRADES": {
+        "time": TIME_NS_EXPRESSION,
+        "price": "price",
+        "size": "coalesce(size, 0)",
+    },
+    "BID_ASK": {
+        "time": TIME_NS_EXPRESSION,
+        "bid": "bid",
+        "ask": "ask",
+        "bid_size": "coalesce(bid_size, 0)",
+        "ask_size": "coalesce(ask_size, 0)",
+    },
+}
+
+
+def select_expressions(tick_type: str, layout: str = "pk") -> Dict[str, str]:
+    """SELECT_EXPRESSIONS of a table with this layout"""
+    return {c: price_select_expression(column=e, layout=layout) for c, e in SELECT_EXPRESSIONS[tick_type].items()}
+
+
+def round_prices(columns: Dict[str, np.ndarray], layout: str = "pk") -> Dict[str, np.ndarray]:
+    """Columns selected from a table with this layout. The float columns, all prices, of compact tables are real"""
+    if layout == "compact":
+        for c, a in columns.items():
+            if a.dtype.kind == "f":
+                columns[c] = round_real_prices(a)
+    return columns
+
+
+def rows_to_columns(rows: List[tuple], dtypes: Dict[str, np.dtype]) -> Dict[str, np.ndarray]:
+    """Transpose query results into one array per column"""
+    if not rows:
+        return {c: np.empty(0, dtype=dtype) for c, dtype in dtypes.items()}
+    return {c: np.array(values, dtype=dtype) for (c, dtype), values in zip(dtypes.items(), zip(*rows))}
+
 
 class TicksLoader(abc.ABC):
+    batch_cls: ClassVar[Type[TickBatch]]
+
     def __init__(
             self,
             contract: Contract,
             tick_type: str,
             date_col: str,
+            window: Optional[datetime.timedelta] = None,
+            server_side_cursor: bool = False,
+            itersize: int = 10000,
+            db_connection=None,
+            pool: Optional[DbPool] = None,
+            binary: bool = False,
     ):
-        self._db = DbTicks(contract=contract, tick_type=tick_type)
-        with self._db.conn.cursor() as cur:
-            cur.execute("SET TIME ZONE 'UTC';")
+        """
+        :param window: If set, ticks are prefetched one window at a time and get_ticks_batch_by_time() is served
+        from an in-memory buffer. Otherwise every call runs its own query.
+        :param server_side_cursor: Only used together with window. Stream the rows forward through a named cursor
+        instead of running a range query for every window. The stream holds its connection until close().
+        :param itersize: Number of rows the named cursor fetches per round-trip.
+        :param pool: Borrow a connection from this pool for every query instead of opening one.
+        :param binary: Only used together with window. Fetch the windows in the binary COPY format,
+        parsed straight into arrays.
+        """
+        self._db = DbTicks(contract=contract, tick_type=tick_type, db_connection=db_connection, pool=pool)
+        if pool is None:  # pooled connections are set to UTC already
+            with self._db.cursor() as cur:
+                cur.execute("SET TIME ZONE 'UTC';")
         self._date_col: str = date_col
+        self._select_expressions: Dict[str, str] = select_expressions(tick_type=tick_type, layout=self._db.layout)
+        self._binary: bool = binary
+        # Prepared statements are named after the table: they are shared by all the loaders of a connection.
+        # The table is hashed, as Postgres truncates names to 63 bytes and long tables would collide
+        table: str = f"{self._db.table_ref.schema}.{self._db.table_ref.table}"
+        self._statement_prefix: str = f"{type(self).__name__.lower()}_{hashlib.md5(table.encode()).hexdigest()[:16]}"
+
+        self._window: Optional[datetime.timedelta] = window
+        self._buffer: Dict[str, np.ndarray] = {}
+        self._buffer_start: Optional[datetime.datetime] = None
+        self._buffer_end: Optional[datetime.datetime] = None
+
+        self._server_side_cursor: bool = server_side_cursor
+        self._itersize: int = itersize
+        self._cursor = None
+        self._stream_conn = None
+        self._stream: Optional[Iterator[tuple]] = None
+        self._lookahead: Optional[tuple] = None
         logger.debug("Initialized loader")
 
-    def _select_query(self, time: datetime.datetime) -> str:
+    # Queries take their timestamps as named parameters: %(time)s, %(start)s, %(end)s
+
+    def _query(self, condition: str, binary: bool = False) -> str:
+        """:param binary: cast the selected expressions for read_copy_binary()"""
+        if binary:
+            pairs = zip(self._select_expressions.values(), self._dtypes.values())
+            expressions = [binary_select_expression(e, dtype) for e, dtype in pairs]
+        else:
+            expressions = list(self._select_expressions.values())
+        return f"""
+        SELECT {', '.join(expressions)}
+        FROM {self._db.table_ref.schema}.{self._db.table_ref.table}
+        WHERE {condition}
+        ORDER BY {self._date_col} ASC, {self._db.key_column} ASC
+        """
+
+    def _select_query(self) -> str:
+        return self._query(condition=f"{self._date_col} = %(time)s")
+
+    def _range_query(self, binary: bool = False) -> str:
+        return self._query(condition=f"{self._date_col} >= %(start)s AND {self._date_col} < %(end)s", binary=binary)
+
+    def _stream_query(self) -> str:
+        return self._query(condition=f"{self._date_col} >= %(start)s")
+
+    def _next_time_query(self) -> str:
         return f"""
-        SELECT * FROM {self._db.table_ref.schema}.{self._db.table_ref.table}
-        WHERE {self._date_col} = '{time}'
-        ORDER BY pk ASC
+        SELECT min({self._date_col}) FROM {self._db.table_ref.schema}.{self._db.table_ref.table}
+        WHERE {self._date_col} >= %(time)s
         """
 
-    def _get_ticks_by_time(self, time: datetime.datetime):
-        """Returns a list of tuples of different sizes depending on the table queried"""
-        with self._db.conn.cursor() as cur:
-            cur.execute(self._select_query(time=time))
+    def _execute_prepared(self, cursor, name: str, query: str, params: Dict[str, datetime.datetime]):
+        """Run query as a server-side prepared statement: Postgres plans it once per connection"""
+        for i, key in enumerate(params, start=1):
+            query = query.replace(f"%({key})s", f"${i}")
+        execute_prepared(
+            cursor,
+            name=f"{self._statement_prefix}_{name}",
+            query=query,
+            types=["timestamptz"] * len(params),
+            params=list(params.values()),
+        )
+
+    @property
+    def _dtypes(self) -> Dict[str, np.dtype]:
+        return self.batch_cls.dtypes
+
+    def _to_columns(self, rows: List[tuple]) -> Dict[str, np.ndarray]:
+        return round_prices(rows_to_columns(rows=rows, dtypes=self._dtypes), layout=self._db.layout)
+
+    def get_next_tick_time(self, time: datetime.datetime) -> Optional[datetime.datetime]:
+        """Time of the first tick at or after time. None if there are no more ticks"""
+        if self._buffer_start is not None and self._buffer_start <= time < self._buffer_end:
+            times: np.ndarray = self._buffer["time"]
+            ix: int = np.searchsorted(times, to_ns(time), side="left")
+            if ix < len(times):
+                return from_ns(times[ix])
+            time = self._buffer_end
+        if self._stream is not None and time >= self._buffer_end:
+            # Peek through the stream. Rows before time would never be requested anyway
+            t: int = to_ns(time)
+            while self._lookahead is not None and self._lookahead[0] < t:
+                self._lookahead = next(self._stream, None)
+            return from_ns(self._lookahead[0]) if self._lookahead is not None else None
+        with self._db.cursor() as cur:
+            self._execute_prepared(cur, name="next", query=self._next_time_query(), params={"time": time})
+            next_time: Optional[datetime.datetime] = cur.fetchone()[0]
+        return next_time
+
+    def _get_ticks_by_time(self, time: datetime.datetime) -> Dict[str, np.ndarray]:
+        """Returns one array per column with the ticks stamped exactly at time"""
+        if self._window is not None:
+            return self._get_buffered_ticks_by_time(time=time)
+        with self._db.cursor() as cur:
+            self._execute_prepared(cur, name="at", query=self._select_query(), params={"time": time})
             rows = cur.fetchall()
+        return self._to_columns(rows)
+
+    def _get_buffered_ticks_by_time(self, time: datetime.datetime) -> Dict[str, np.ndarray]:
+        if self._buffer_start is None or not (self._buffer_start <= time < self._buffer_end):
+            self._fill_buffer(start=time)
+        times: np.ndarray = self._buffer["time"]
+        t: int = to_ns(time)
+        start, end = np.searchsorted(times, t, side="left"), np.searchsorted(times, t, side="right")
+        return {c: a[start:end] for c, a in self._buffer.items()}
+
+    def _fill_buffer(self, start: datetime.datetime):
+        end: datetime.datetime = start + self._window
+        params = {"start": start, "end": end}
+        if self._server_side_cursor:
+            self._buffer = self._to_columns(self._stream_rows(start=start, end=end))
+        elif self._binary:
+            with self._db.cursor() as cur:
+                # COPY takes no parameters: they are inlined
+                query: str = cur.mogrify(self._range_query(binary=True), params).decode()
+                self._buffer = round_prices(read_copy_binary(cur, query=query, dtypes=self._dtypes), layout=self._db.layout)
+        else:
+            with self._db.cursor() as cur:
+                self._execute_prepared(cur, name="range", query=self._range_query(), params=params)
+                self._buffer = self._to_columns(cur.fetchall())
+        self._buffer_start, self._buffer_end = start, end
+        logger.debug(f"{type(self).__name__} buffered {len(self._buffer['time'])} rows in [{start}, {end})")
+
+    def _stream_rows(self, start: datetime.datetime, end: datetime.datetime) -> List[tuple]:
+        # The stream only moves forward: going back in time means opening a new cursor. So does skipping
+        # more than a window ahead, e.g. to resume from a checkpoint, rather than reading through all the rows between
+        if self._stream is None or start < self._buffer_end or start >= self._buffer_end + self._window:
+            self._open_stream(start=start)
+        # The first column is always the tick time in nanoseconds
+        t_start, t_end = to_ns(start), to_ns(end)
+        rows: List[tuple] = []
+        while self._lookahead is not None and self._lookahead[0] < t_end:
+            if self._lookahead[0] >= t_start:
+                rows.append(self._lookahead)
+            self._lookahead = next(self._stream, None)
         return rows
 
+    def _open_stream(self, start: datetime.datetime):
+        self.close()
+        self._stream_conn = self._db.acquire()
+        # Named cursors on an autocommit connection must be declared WITH HOLD
+        self._cursor = self._stream_conn.cursor(
+            name=f"{self._db.table_ref.table}_stream_{next(_cursor_ids)}", withhold=True
+        )
+        self._cursor.itersize = self._itersize
+        self._cursor.execute(self._stream_query(), {"start": start})
+        self._stream = iter(self._cursor)
+        self._lookahead = next(self._stream, None)
+
+    def close(self):
+        """Release the server-side cursor and its connection, if any"""
+        if self._cursor is not None and not self._cursor.closed:
+            self._cursor.close()
+        if self._stream_conn is not None:
+            self._db.release(self._stream_conn)
+        self._cursor = None
+        self._stream_conn = None
+        self._stream = None
+        self._lookahead = None
+
     @abc.abstractmethod
     def get_ticks_batch_by_time(self, time: datetime.datetime):
         raise NotImplementedError
 
 
 class BidAskTicksLoader(TicksLoader):
-    def __init__(self, contract: Contract):
+    batch_cls = BidAskTickBatch
+
+    def __init__(self, contract: Contract, **kwargs):
         super().__init__(
             contract=contract,
             tick_type="BID_ASK",
             date_col="time",
+            **kwargs,
         )
 
-    def get_ticks_batch_by_time(self, time: datetime.datetime) -> List[TickByTickBidAsk]:
-        ticks: List[TickByTickBidAsk] = []
-        ticks_db = self._get_ticks_by_time(time=time)  # iterator of tuples
-        for db_time, bid, ask, bid_size, ask_size, _, _, _ in ticks_db:
-            t = TickByTickBidAsk(bid=bid, ask=ask, bid_size=bid_size, ask_size=ask_size, time=time)
-            ticks.append(t)
-        return ticks
+    def get_ticks_batch_by_time(self, time: datetime.datetime) -> BidAskTickBatch:
+        return BidAskTickBatch(self._get_ticks_by_time(time=time))
 
 
 class TradesTicksLoader(TicksLoader):
-    def __init__(self, contract: Contract):
+    batch_cls = AllLastTickBatch
+
+    def __init__(self, contract: Contract, **kwargs):
         super().__init__(
             contract=contract,
             tick_type="TRADES",
             date_col="time",
+            **kwargs,
         )
 
-    def get_ticks_batch_by_time(self, time: datetime.datetime) -> List[TickByTickAllLast]:
-        ticks: List[TickByTickAllLast] = []
-        ticks_db = self._get_ticks_by_time(time=time)
-        for db_time, price, size, _, _ in ticks_db:
-            trade = TickByTickAllLast(price=price, size=size, time=time)
-            ticks.append(trade)
-        return ticks
+    def get_ticks_batch_by_time(self, time: datetime.datetime) -> AllLastTickBatch:
+        return AllLastTickBatch(self._get_ticks_by_time(time=time))
+
+
+class MergedTicksLoader(TicksLoader):
+    """
+    Reads both the TRADES and the BID_ASK table of a contract with a single UNION ALL query.
+    Rows are tagged with their kind: 0 for trades, 1 for bid/ask ticks.
+    """
+    merged_dtypes: Dict[str, np.dtype] = {
+        "time": np.dtype(np.int64),
+        "kind": np.dtype(np.int8),
+        "price_or_bid": np.dtype(np.float64),
+        "size_or_bid_size": np.dtype(np.int64),
+        "ask": np.dtype(np.float64),
+        "ask_size": np.dtype(np.int64),
+    }
+
+    def __init__(self, contract: Contract, **kwargs):
+        super().__init__(
+            contract=contract,
+            tick_type="TRADES",
+            date_col="time",
+            **kwargs,
+        )
+        # Shares the connection, or the pool, of the TRADES table
+        bidask_db = DbTicks(contract=contract, tick_type="BID_ASK", db_connection=self._db.conn, pool=self._db.pool)
+        if bidask_db.layout != self._db.layout:
+            raise ValueError(
+                f"{self._db.table_ref.table} and {bidask_db.table_ref.table} should have the same layout, "
+                f"got {self._db.layout} and {bidask_db.layout}"
+            )
+        self._bidask_table_ref = bidask_db.table_ref
+
+    def _query(self, condition: str, binary: bool = False) -> str:
+        layout: str = self._db.layout
+        trades = [TIME_NS_EXPRESSION, "0", price_select_expression("price", layout), "coalesce(size, 0)", "0", "0"]
+        bidasks = [
+            TIME_NS_EXPRESSION, "1", price_select_expression("bid", layout), "coalesce(bid_size, 0)",
+            price_select_expression("ask", layout), "coalesce(ask_size, 0)",
+        ]
+        if binary:
+            trades = [binary_select_expression(e, dtype) for e, dtype in zip(trades, self.merged_dtypes.values())]
+            bidasks = [binary_select_expression(e, dtype) for e, dtype in zip(bidasks, self.merged_dtypes.values())]
+        else:
+            trades[4:] = ["0::float", "0::integer"]
+        columns = list(self.merged_dtypes)
+        return f"""
+        SELECT {', '.join(columns)} FROM (
+            SELECT {', '.join(f"{e} AS {c}" for e, c in zip(trades, columns))}, {self._db.key_column} AS key
+            FROM {self._db.table_ref.schema}.{self._db.table_ref.table}
+            WHERE {condition}
+            UNION ALL
+            SELECT {', '.join(f"{e} AS {c}" for e, c in zip(bidasks, columns))}, {self._db.key_column} AS key
+            FROM {self._bidask_table_ref.schema}.{self._bidask_table_ref.table}
+            WHERE {condition}
+        ) AS ticks
+        ORDER BY time ASC, kind ASC, key ASC
+        """
+
+    def _next_time_query(self) -> str:
+        return f"""
+        SELECT least(
+            (SELECT min(time) FROM {self._db.table_ref.schema}.{self._db.table_ref.table} WHERE time >= %(time)s),
+            (SELECT min(time) FROM {self._bidask_table_ref.schema}.{self._bidask_table_ref.table} WHERE time >= %(time)s)
+        )
+        """
+
+    @property
+    def _dtypes(self) -> Dict[str, np.dtype]:
+        return self.merged_dtypes
+
+    def get_ticks_batch_by_time(self, time: datetime.datetime) -> Tuple[AllLastTickBatch, BidAskTickBatch]:
+        cols = self._get_ticks_by_time(time=time)
+        is_trade: np.ndarray = cols["kind"] == 0
+        is_bidask: np.ndarray = ~is_trade
+        trades = AllLastTickBatch({
+            "time": cols["time"][is_trade],
+            "price": cols["price_or_bid"][is_trade],
+            "size": cols["size_or_bid_size"][is_trade],
+        })
+        bidasks = BidAskTickBatch({
+            "time": cols["time"][is_bidask],
+            "bid": cols["price_or_bid"][is_bidask],
+            "ask": cols["ask"][is_bidask],
+            "bid_size": cols["size_or_bid_size"][is_bidask],
+            "ask_size": cols["ask_size"][is_bidask],
+        })
+        return trades, bidasks
@@ -0,0 +1,279 @@
+"""
+Build bars from the stored ticks with numpy, in bulk, and write them into the DbBars tables.
+
+Bars have the columns of the DbBars tables (see BAR_DTYPES), as the bars downloaded from IB:
+date is the open time of the bar, in nanoseconds since the epoch.
+Time bars ("5 secs", "1 min", "1 hour"...) are aligned on the epoch. Tick, volume and dollar bars
+("500 ticks", "1000 volume", "5000000 dollars") close once their number of trades, volume or traded value
+reaches the bar size. IB ticks have a 1 second resolution, so ticks sharing a timestamp always go
+into the same bar: bar dates are then unique, as the primary key of the bars tables requires.
+
+TRADES bars: open, high, low and close of the trade prices, volume, volume weighted average price and
+number of trades. BID_ASK bars follow IB: time averaged bid, max ask, min bid and time averaged ask,
+with volume, average and barCount set to -1. They can only be time bars.
+"""
+import datetime
+import pathlib
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+import pandas as pd
+from ib_insync import Contract
+from simplebt.db import DbBars, DbPool, DbTicks
+from simplebt.db._db_bars import BAR_DTYPES
+from simplebt.historical_data.load.cache import CACHE_COLUMNS, DAY_FORMAT, get_cache_table_dir
+from simplebt.historical_data.utils.cache import select_ticks_day
+from simplebt.utils.logger import get_logger
+
+logger = get_logger(name=__name__)
+
+_NS_PER_SEC = 1000000000
+_TIME_UNITS: Dict[str, int] = {
+    "sec": 1, "secs": 1,
+    "min": 60, "mins": 60,
+    "hour": 3600, "hours": 3600,
+    "day": 86400, "days": 86400,
+}
+ACTIVITY_UNITS = ("ticks", "volume", "dollars")
+
+
+@dataclass(frozen=True)
+class BarSpec:
+    """
+    :param kind: time, ticks, volume or dollars
+    :param size: nanoseconds for time bars, otherwise the number of trades, the volume or the traded value
+    """
+    kind: str
+    size: float
+
+    @property
+    def duration(self) -> datetime.timedelta:
+        if self.kind != "time":
+            raise ValueError(f"{self.kind} bars have no fixed duration")
+        return datetime.timedelta(microseconds=int(self.size) // 1000)
+
+
+def parse_bar_size(bar_size: str) -> BarSpec:
+    """IB bar sizes, e.g. "1 min" or "5 secs", or activity bar sizes, e.g. "500 ticks" or "1000000 dollars" """
+    try:
+        amount, unit = bar_size.split()
+        value = float(amount)
+    except ValueError:
+        raise ValueError(f"Can't parse bar size {bar_size}")
+    if value <= 0:
+        raise ValueError(f"Bar size should be positive, got {bar_size}")
+    if unit in _TIME_UNITS:
+        return BarSpec(kind="time", size=int(value * _TIME_UNITS[unit] * _NS_PER_SEC))
+    if unit in ACTIVITY_UNITS:
+        return BarSpec(kind=unit, size=value)
+    raise ValueError(f"Unknown bar size unit {unit}, should be one of {list(_TIME_UNITS) + list(ACTIVITY_UNITS)}")
+
+
+def empty_bars() -> Dict[str, np.ndarray]:
+    return {c: np.empty(0, dtype=dtype) for c, dtype in BAR_DTYPES.items()}
+
+
+def _activity(columns: Dict[str, np.ndarray], spec: BarSpec, multiplier: float) -> np.ndarray:
+    """What every trade adds to an activity bar: 1, its size or its value"""
+    if spec.kind == "ticks":
+        return np.ones(len(columns["time"]))
+    if spec.kind == "volume":
+        return columns["size"].astype(np.float64)
+    return columns["price"] * columns["size"] * multiplier
+
+
+def _bar_ids(columns: Dict[str, np.ndarray], spec: BarSpec, multiplier: float, offset: float = 0.) -> np.ndarray:
+    """
+    Non decreasing bar number of every tick.
+    :param offset: activity cumulated before these ticks, so that bars don't depend on how the ticks are chunked
+    """
+    times: np.ndarray = columns["time"]
+    if spec.kind == "time":
+        return times // int(spec.size)
+    # Cumulated activity before each timestamp: a bar closes on the timestamp that takes it past the bar size
+    ts_starts: np.ndarray = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+    per_ts: np.ndarray = np.add.reduceat(_activity(columns=columns, spec=spec, multiplier=multiplier), ts_starts)
+    ts_ids: np.ndarray = ((offset + np.cumsum(per_ts) - per_ts) // spec.size).astype(np.int64)
+    return np.repeat(ts_ids, np.diff(np.r_[ts_starts, len(times)]))
+
+
+def _trades_bars(columns: Dict[str, np.ndarray], spec: BarSpec, ids: np.ndarray, starts: np.ndarray) -> Dict[str, np.ndarray]:
+    price: np.ndarray = columns["price"].astype(np.float64)
+    size: np.ndarray = columns["size"].astype(np.int64)
+    volume: np.ndarray = np.add.reduceat(size, starts)
+    notional: np.ndarray = np.add.reduceat(price * size, starts)
+    return {
+        "date": ids[starts] * int(spec.size) if spec.kind == "time" else columns["time"][starts],
+        "open": price[starts],
+        "high": np.fmax.reduceat(price, starts),
+        "low": np.fmin.reduceat(price, starts),
+        "close": price[np.r_[starts[1:], len(price)] - 1],
+        "volume": volume,
+        "average": np.divide(notional, volume, out=np.full(len(starts), np.nan), where=volume > 0),
+        "barCount": np.diff(np.r_[starts, len(price)]),
+    }
+
+
+def _bidask_bars(columns: Dict[str, np.ndarray], spec: BarSpec, ids: np.ndarray, starts: np.ndarray) -> Dict[str, np.ndarray]:
+    times: np.ndarray = columns["time"]
+    bid: np.ndarray = columns["bid"].astype(np.float64)
+    ask: np.ndarray = columns["ask"].astype(np.float64)
+    # Every quote is weighted by the time it stood, until the next quote or the end of its bar
+    bar_end: np.ndarray = (ids + 1) * int(spec.size)
+    next_time: np.ndarray = np.r_[times[1:], bar_end[-1]]
+    weights: np.ndarray = (np.minimum(next_time, bar_end) - times).astype(np.float64)
+    total: np.ndarray = np.add.reduceat(weights, starts)
+    n: int = len(starts)
+    return {
+        "date": ids[starts] * int(spec.size),
+        "open": np.add.reduceat(weights * bid, starts) / total,
+        "high": np.fmax.reduceat(ask, starts),
+        "low": np.fmin.reduceat(bid, starts),
+        "close": np.add.reduceat(weights * ask, starts) / total,
+        "volume": np.full(n, -1, dtype=np.int64),
+        "average": np.full(n, -1.),
+        "barCount": np.full(n, -1, dtype=np.int64),
+    }
+
+
+class BarAggregator:
+    """
+    Aggregates ticks fed in time order, chunk by chunk (e.g. one day at a time).
+    The ticks of the last bar of a chunk may be followed by more in the next chunk: they are held back
+    until then, or until flush().
+    """
+    def __init__(self, tick_type: str, bar_size: str, multiplier: float = 1.):
+        """:param multiplier: contract multiplier, to value the trades of dollar bars"""
+        if tick_type not in CACHE_COLUMNS:
+            raise ValueError(f"tick_type should be one of {list(CACHE_COLUMNS)}, got {tick_type}")
+        self.tick_type: str = tick_type
+        self.spec: BarSpec = parse_bar_size(bar_size)
+        if tick_type == "BID_ASK" and self.spec.kind != "time":
+            raise ValueError("BID_ASK bars can only be time bars")
+        self.multiplier: float = multiplier
+        self._pending: Dict[str, np.ndarray] = {c: np.empty(0, dtype=dtype) for c, dtype in CACHE_COLUMNS[tick_type].items()}
+        # Activity cumulated before the ticks held back
+        self._offset: float = 0.
+
+    def update(self, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """:return: the bars completed by this chunk of ticks"""
+        ticks = {c: np.concatenate([self._pending[c], columns[c]]) for c in self._pending}
+        if len(ticks["time"]) == 0:
+            return empty_bars()
+        ids: np.ndarray = _bar_ids(columns=ticks, spec=self.spec, multiplier=self.multiplier, offset=self._offset)
+        last_start: int = int(np.searchsorted(ids, ids[-1], side="left"))
+        done = {c: a[:last_start] for c, a in ticks.items()}
+        self._pending = {c: a[last_start:] for c, a in ticks.items()}
+        if self.spec.kind != "time":
+            self._offset += _activity(columns=done, spec=self.spec, multiplier=self.multiplier).sum()
+        return self._aggregate(ticks=done, ids=ids[:last_start])
+
+    def flush(self) -> Dict[str, np.ndarray]:
+        """:return: the last bar, if any ticks are held back"""
+        ticks, self._pending = self._pending, {c: a[:0] for c, a in self._pending.items()}
+        if len(ticks["time"]) == 0:
+            return empty_bars()
+        ids: np.ndarray = _bar_ids(columns=ticks, spec=self.spec, multiplier=self.multiplier, offset=self._offset)
+        self._offset = 0.
+        return self._aggregate(ticks=ticks, ids=ids)
+
+    def _aggregate(self, ticks: Dict[str, np.ndarray], ids: np.ndarray) -> Dict[str, np.ndarray]:
+        if len(ids) == 0:
+            return empty_bars()
+        starts: np.ndarray = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        if self.tick_type == "TRADES":
+            bars = _trades_bars(columns=ticks, spec=self.spec, ids=ids, starts=starts)
+        else:
+            bars = _bidask_bars(columns=ticks, spec=self.spec, ids=ids, starts=starts)
+        return {c: bars[c].astype(dtype) for c, dtype in BAR_DTYPES.items()}
+
+
+def aggregate_ticks(
+    columns: Dict[str, np.ndarray], tick_type: str, bar_size: str, multiplier: float = 1.
+) -> Dict[str, np.ndarray]:
+    """Bars of a whole block of ticks, in the cache format (one array per column, time in nanoseconds)"""
+    aggregator = BarAggregator(tick_type=tick_type, bar_size=bar_size, multiplier=multiplier)
+    chunks: List[Dict[str, np.ndarray]] = [aggregator.update(columns), aggregator.flush()]
+    return {c: np.concatenate([chunk[c] for chunk in chunks]) for c in BAR_DTYPES}
+
+
+def _iter_cached_days(
+    contract: Contract, tick_type: str, cache_dir: pathlib.Path, start_date: datetime.date, end_date: datetime.date
+) -> Iterator[Dict[str, np.ndarray]]:
+    table_dir: pathlib.Path = get_cache_table_dir(contract=contract, tick_type=tick_type, cache_dir=cache_dir)
+    if not table_dir.exists():
+        raise FileNotFoundError(f"No tick cache in {table_dir}. Build it first with build_ticks_cache()")
+    first, last = start_date.strftime(DAY_FORMAT), end_date.strftime(DAY_FORMAT)
+    for day_dir in sorted(p for p in table_dir.iterdir() if p.is_dir() and p.name.isdigit()):
+        if first <= day_dir.name <= last:
+            yield {c: np.load(day_dir / f"{c}.npy") for c in CACHE_COLUMNS[tick_type]}
+
+
+def _iter_db_days(
+    db: DbTicks, tick_type: str, start_date: datetime.date, end_date: datetime.date
+) -> Iterator[Dict[str, np.ndarray]]:
+    day: datetime.date = start_date
+    while day <= end_date:
+        yield select_ticks_day(db=db, tick_type=tick_type, day=day)
+        day += datetime.timedelta(days=1)
+
+
+def build_bars(
+    contract: Contract,
+    tick_type: str,
+    bar_size: str,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    cache_dir: Optional[pathlib.Path] = None,
+    fmt: str = "binary",
+    db_connection=None,
+    pool: Optional[DbPool] = None,
+) -> int:
+    """
+    Aggregate the ticks of a contract into the DbBars table of bar type tick_type and size bar_size,
+    one UTC day at a time. The bars already stored between start_date and end_date are replaced.
+    :param cache_dir: Read the ticks from the local columnar cache instead of the DbTicks table.
+    :param fmt: COPY format of the insertion, text or binary.
+    :return: the number of bars written
+    """
+    db_ticks = DbTicks(contract=contract, tick_type=tick_type, db_connection=db_connection, pool=pool)
+    if start_date is None or end_date is None:
+        oldest: Optional[datetime.datetime] = db_ticks.get_oldest_timestamp()
+        newest: Optional[datetime.datetime] = db_ticks.get_newest_timestamp()
+        if oldest is None or newest is None:
+            logger.info(f"{db_ticks.table_ref.table} is empty: no bars to build")
+            return 0
+        start_date = start_date or oldest.date()
+        end_date = end_date or newest.date()
+
+    days: Iterator[Dict[str, np.ndarray]]
+    if cache_dir is not None:
+        days = _iter_cached_days(
+            contract=contract, tick_type=tick_type, cache_dir=cache_dir, start_date=start_date, end_date=end_date
+        )
+    else:
+        days = _iter_db_days(db=db_ticks, tick_type=tick_type, start_date=start_date, end_date=end_date)
+
+    db_bars = DbBars(contract=contract, bar_type=tick_type, bar_size=bar_size, db_connection=db_connection, pool=pool)
+    start = datetime.datetime.combine(start_date, datetime.time(), tzinfo=datetime.timezone.utc)
+    end = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time(), tzinfo=datetime.timezone.utc)
+    n_deleted: int = db_bars.delete_bars(start=start, end=end)
+    if n_deleted:
+        logger.info(f"Deleted {n_deleted} bars of {db_bars.table_ref.table} to build them again")
+
+    aggregator = BarAggregator(tick_type=tick_type, bar_size=bar_size, multiplier=float(contract.multiplier or 1))
+    n_bars: int = 0
+    for ticks in days:
+        n_bars += db_bars.insert_columns(aggregator.update(ticks), fmt=fmt)
+    n_bars += db_bars.insert_columns(aggregator.flush(), fmt=fmt)
+    logger.info(f"Wrote {n_bars} bars into {db_bars.table_ref.schema}.{db_bars.table_ref.table}")
+    db_bars.close()
+    db_ticks.close()
+    return n_bars
+
+
+def bars_to_frame(bars: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Bars as a DataFrame indexed by their UTC open time, e.g. to study the bars read back with DbBars.get_bars()"""
+    df = pd.DataFrame({c: a for c, a in bars.items() if c != "date"})
+    df.index = pd.to_datetime(bars["date"], unit="ns", utc=True).rename("date")
+    return df
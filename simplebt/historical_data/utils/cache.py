@@ -0,0 +1,109 @@
+"""
+Export the DbTicks tables into the per-day columnar cache read by simplebt.historical_data.load.cache.
+Once built, backtests can replay the ticks from memory-mapped .npy files with no database connection.
+"""
+import datetime
+import pathlib
+import shutil
+from typing import Dict, List, Optional
+import numpy as np
+from ib_insync import Contract
+from simplebt.db import DbTicks
+from simplebt.historical_data.load.cache import CACHE_COLUMNS, DAY_FORMAT, get_cache_table_dir
+from simplebt.historical_data.load.ticks import round_prices, rows_to_columns, select_expressions
+from simplebt.resources.config import TICKS_CACHE_DIR
+from simplebt.utils.logger import get_logger
+
+logger = get_logger(name=__name__)
+
+
+def build_ticks_cache(
+    contract: Contract,
+    tick_type: str,
+    cache_dir: pathlib.Path = TICKS_CACHE_DIR,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    overwrite: bool = False,
+) -> List[pathlib.Path]:
+    """
+    Dump a DbTicks table into one directory of .npy columns per UTC day.
+    Days already in the cache are skipped unless overwrite is True, or their ticks were still being downloaded when
+    they were cached: days whose number of ticks differs from the table are rebuilt. So are days stored with other
+    dtypes than CACHE_COLUMNS.
+    :return: the directories written
+    """
+    db = DbTicks(contract=contract, tick_type=tick_type)
+    oldest: Optional[datetime.datetime] = db.get_oldest_timestamp()
+    newest: Optional[datetime.datetime] = db.get_newest_timestamp()
+    if oldest is None or newest is None:
+        logger.info(f"{db.table_ref.table} is empty: nothing to cache")
+        return []
+    day: datetime.date = max(oldest.date(), start_date) if start_date else oldest.date()
+    last_day: datetime.date = min(newest.date(), end_date) if end_date else newest.date()
+
+    table_dir: pathlib.Path = get_cache_table_dir(contract=contract, tick_type=tick_type, cache_dir=cache_dir)
+    table_dir.mkdir(parents=True, exist_ok=True)
+    written: List[pathlib.Path] = []
+    while day <= last_day:
+        day_dir = table_dir / day.strftime(DAY_FORMAT)
+        if overwrite or not is_cached_day(day_dir=day_dir, tick_type=tick_type, n_ticks=count_ticks_day(db=db, day=day)):
+            arrays = select_ticks_day(db=db, tick_type=tick_type, day=day)
+            if len(arrays["time"]) > 0:
+                write_cache_day(day_dir=day_dir, arrays=arrays)
+                written.append(day_dir)
+                logger.info(f"Cached {len(arrays['time'])} ticks in {day_dir}")
+        day += datetime.timedelta(days=1)
+    db.close()
+    return written
+
+
+def is_cached_day(day_dir: pathlib.Path, tick_type: str, n_ticks: int) -> bool:
+    """Whether day_dir holds n_ticks ticks with the dtypes of CACHE_COLUMNS. Only the headers of the files are read"""
+    if not day_dir.exists():
+        return False
+    for c, dtype in CACHE_COLUMNS[tick_type].items():
+        column: np.ndarray = np.load(day_dir / f"{c}.npy", mmap_mode="r")
+        if column.dtype != dtype or len(column) != n_ticks:
+            return False
+    return True
+
+
+def count_ticks_day(db: DbTicks, day: datetime.date) -> int:
+    start = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(days=1)
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"SELECT count(*) FROM {db.table_ref.schema}.{db.table_ref.table} WHERE time >= '{start}' AND time < '{end}'"
+        )
+        return cursor.fetchone()[0]
+
+
+def select_ticks_day(db: DbTicks, tick_type: str, day: datetime.date) -> Dict[str, np.ndarray]:
+    """The ticks of one UTC day, in the cache format"""
+    start = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(days=1)
+    expressions: Dict[str, str] = select_expressions(tick_type=tick_type, layout=db.layout)
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT {', '.join(expressions.values())}
+            FROM {db.table_ref.schema}.{db.table_ref.table}
+            WHERE time >= '{start}' AND time < '{end}'
+            ORDER BY time ASC, {db.key_column} ASC
+            """
+        )
+        rows = cursor.fetchall()
+    return round_prices(rows_to_columns(rows=rows, dtypes=CACHE_COLUMNS[tick_type]), layout=db.layout)
+
+
+def write_cache_day(day_dir: pathlib.Path, arrays: Dict[str, np.ndarray]):
+    """Write into a temporary directory first, so that a crash never leaves a half-written day behind"""
+    tmp_dir = day_dir.with_name(day_dir.name + ".tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir()
+    for c, a in arrays.items():
+        np.save(tmp_dir / f"{c}.npy", a)
+    if day_dir.exists():
+        shutil.rmtree(day_dir)
+    tmp_dir.rename(day_dir)
@@ -0,0 +1,326 @@
+"""
+Stitch the ticks of consecutive expiries of a future into one continuous stream, written into the columnar
+tick cache under a ContFuture contract. A single Market replays it with tick_cache_dir set, in one scan.
+
+Rolls happen at the open of a session, following a roll rule:
+- "N days": N sessions before the lastTradeDateOrContractMonth of the front expiry
+- "volume": on the session after the first UTC day the next expiry trades more volume than the front one,
+  at the latest on the last trade date of the front expiry
+
+With back-adjustment, the prices before every roll are shifted by the gap between the mid quotes of the two
+expiries at the roll ("difference"), or scaled by their ratio ("ratio"), so that the stream has no jump at the
+rolls and its last expiry keeps its actual prices. Every tick keeps the conId of its expiry in the con_id column,
+and the rolls are stored next to the days, see read_rolls().
+"""
+import datetime
+import pathlib
+import shutil
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from ib_insync import ContFuture, Contract
+from simplebt.db import DbPool, DbTicks
+from simplebt.historical_data.load.cache import CACHE_COLUMNS, DAY_FORMAT, get_cache_table_dir
+from simplebt.historical_data.utils.cache import select_ticks_day, write_cache_day
+from simplebt.resources.config import TICKS_CACHE_DIR
+from simplebt.sessions import get_calendar
+from simplebt.utils import to_ns
+from simplebt.utils.logger import get_logger
+
+logger = get_logger(name=__name__)
+
+ROLL_KINDS = ("days", "volume")
+ADJUSTMENTS = ("difference", "ratio")
+ROLLS_DIR = "rolls"
+ROLL_DTYPES: Dict[str, np.dtype] = {
+    "time": np.dtype(np.int64),
+    "from_con_id": np.dtype(np.int64),
+    "to_con_id": np.dtype(np.int64),
+    # The gap (difference) or the ratio between the expiries at the roll, whether it was applied or not
+    "adjustment": np.dtype(np.float64),
+}
+_PRICE_COLUMNS: Dict[str, Tuple[str, ...]] = {"TRADES": ("price",), "BID_ASK": ("bid", "ask")}
+# Days looked back for the last quotes of the expiries before a roll
+_QUOTE_LOOKBACK_DAYS = 7
+
+
+@dataclass(frozen=True)
+class RollRule:
+    kind: str
+    days: int = 0
+
+
+def parse_roll_rule(rule: str) -> RollRule:
+    """ "volume" or "5 days" -> RollRule """
+    parts: List[str] = rule.split()
+    if parts == ["volume"]:
+        return RollRule(kind="volume")
+    if len(parts) == 2 and parts[0].isdigit() and parts[1] in ("day", "days"):
+        return RollRule(kind="days", days=int(parts[0]))
+    raise ValueError(f"Unknown roll rule {rule}, expected 'volume' or 'N days'")
+
+
+def continuous_contract(contracts: List[Contract], roll_rule: str, adjustment: Optional[str] = None) -> ContFuture:
+    """
+    The ContFuture the continuous stream of contracts is cached under. Its conId is derived from the expiries,
+    the roll rule and the adjustment: streams built differently never share a cache table.
+    """
+    expiries: List[Contract] = _sort_expiries(contracts)
+    front: Contract = expiries[0]
+    key: str = f"{front.symbol} {front.exchange} {[c.conId for c in expiries]} {roll_rule} {adjustment}"
+    return ContFuture(
+        conId=zlib.crc32(key.encode()) & 0x7FFFFFFF,
+        symbol=front.symbol,
+        exchange=front.exchange,
+        multiplier=front.multiplier,
+        currency=front.currency,
+    )
+
+
+def read_rolls(
+    contract: ContFuture, cache_dir: pathlib.Path = TICKS_CACHE_DIR, tick_type: str = "TRADES"
+) -> Dict[str, np.ndarray]:
+    """The rolls of a continuous stream built by build_continuous_future(), as columns of ROLL_DTYPES"""
+    rolls_dir: pathlib.Path = get_cache_table_dir(contract=contract, tick_type=tick_type, cache_dir=cache_dir) / ROLLS_DIR
+    if not rolls_dir.exists():
+        raise FileNotFoundError(f"No rolls in {rolls_dir}. Build the stream with build_continuous_future()")
+    return {c: np.load(rolls_dir / f"{c}.npy") for c in ROLL_DTYPES}
+
+
+def _sort_expiries(contracts: List[Contract]) -> List[Contract]:
+    return sorted(contracts, key=lambda c: c.lastTradeDateOrContractMonth)
+
+
+def _expiry_date(contract: Contract) -> datetime.date:
+    expiry: str = contract.lastTradeDateOrContractMonth
+    if len(expiry) < 8:
+        raise ValueError(f"Need the last trade date of {contract.symbol} {contract.conId}, got {expiry}")
+    return datetime.datetime.strptime(expiry[:8], "%Y%m%d").date()
+
+
+def _session_open(exchange: str, day: datetime.date, after: bool = False) -> int:
+    """Open of the session labelled day, or of the next one if day isn't a session (after: strictly after day)"""
+    schedule: pd.DataFrame = get_calendar(exchange).schedule
+    label = pd.Timestamp(day, tz=schedule.index.tz)
+    ix: int = schedule.index.searchsorted(label, side="right" if after else "left")
+    if ix >= len(schedule):
+        # Past the calendar: roll at midnight
+        midnight = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+        return to_ns(midnight + datetime.timedelta(days=int(after)))
+    return int(pd.Timestamp(schedule.market_open.iloc[ix]).value)
+
+
+class _TickSource:
+    """The ticks of one UTC day of an expiry, from the columnar cache or from its DbTicks table"""
+    def __init__(self, cache_dir: Optional[pathlib.Path], db_connection=None, pool: Optional[DbPool] = None):
+        self._cache_dir: Optional[pathlib.Path] = cache_dir
+        self._db_connection = db_connection
+        self._pool: Optional[DbPool] = pool
+        self._dbs: Dict[Tuple[int, str], DbTicks] = {}
+
+    def day(self, contract: Contract, tick_type: str, day: datetime.date) -> Dict[str, np.ndarray]:
+        if self._cache_dir is not None:
+            table_dir = get_cache_table_dir(contract=contract, tick_type=tick_type, cache_dir=self._cache_dir)
+            day_dir = table_dir / day.strftime(DAY_FORMAT)
+            if not day_dir.exists():
+                return {c: np.empty(0, dtype=dtype) for c, dtype in CACHE_COLUMNS[tick_type].items()}
+            return {c: np.load(day_dir / f"{c}.npy", mmap_mode="r") for c in CACHE_COLUMNS[tick_type]}
+        key = (contract.conId, tick_type)
+        if key not in self._dbs:
+            self._dbs[key] = DbTicks(
+                contract=contract, tick_type=tick_type, db_connection=self._db_connection, pool=self._pool
+            )
+        return select_ticks_day(db=self._dbs[key], tick_type=tick_type, day=day)
+
+    def close(self):
+        for db in self._dbs.values():
+            db.close()
+
+
+def _sessions_before_open(exchange: str, day: datetime.date, sessions: int) -> int:
+    """Open of the session that many sessions before the last one labelled day or earlier"""
+    schedule: pd.DataFrame = get_calendar(exchange).schedule
+    label = pd.Timestamp(day, tz=schedule.index.tz)
+    ix: int = schedule.index.searchsorted(label, side="right") - 1 - sessions
+    if label > schedule.index[-1] or ix < 0:
+        # Off the calendar: count business days instead, holidays included
+        roll_day = np.busday_offset(np.datetime64(day), -sessions, roll="backward").astype(datetime.date)
+        return _session_open(exchange=exchange, day=roll_day)
+    return int(pd.Timestamp(schedule.market_open.iloc[ix]).value)
+
+
+def _roll_times_by_days(contracts: List[Contract], days: int) -> List[int]:
+    """Time of the roll out of every expiry but the last"""
+    return [_sessions_before_open(exchange=c.exchange, day=_expiry_date(c), sessions=days) for c in contracts[:-1]]
+
+
+def _roll_times_by_volume(
+    contracts: List[Contract], source: _TickSource, start_date: datetime.date, end_date: datetime.date
+) -> List[int]:
+    """
+    Time of the roll out of every expiry but the last. The daily volumes are compared from start_date on:
+    the expiries whose last trade date is already past are rolled out of at that date
+    """
+    deadlines: List[int] = [_session_open(exchange=c.exchange, day=_expiry_date(c)) for c in contracts[:-1]]
+    times: List[int] = list(deadlines)
+    k: int = 0
+    day: datetime.date = start_date
+    while day <= end_date and k < len(contracts) - 1:
+        if to_ns(datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)) >= deadlines[k]:
+            k += 1
+            continue
+        front_volume: int = int(source.day(contracts[k], "TRADES", day)["size"].sum())
+        next_volume: int = int(source.day(contracts[k + 1], "TRADES", day)["size"].sum())
+        if next_volume > front_volume:
+            times[k] = min(_session_open(exchange=contracts[k].exchange, day=day, after=True), deadlines[k])
+            logger.info(f"Volume of {contracts[k + 1].lastTradeDateOrContractMonth} crossed over on {day}")
+            k += 1
+        day += datetime.timedelta(days=1)
+    # Rolls can't go back in time, even when the deadline of an expiry comes before the crossover of the previous one
+    return np.maximum.accumulate(np.array(times, dtype=np.int64)).tolist() if times else []
+
+
+def _last_mid(source: _TickSource, contract: Contract, before: int) -> Optional[float]:
+    """Mid of the last bid/ask tick of contract stamped before the time before, in nanoseconds"""
+    day: datetime.date = pd.Timestamp(before - 1, tz="UTC").date()
+    for _ in range(_QUOTE_LOOKBACK_DAYS):
+        quotes: Dict[str, np.ndarray] = source.day(contract, "BID_ASK", day)
+        ix: int = int(np.searchsorted(quotes["time"], before, side="left"))
+        if ix > 0:
+            return (float(quotes["bid"][ix - 1]) + float(quotes["ask"][ix - 1])) / 2
+        day -= datetime.timedelta(days=1)
+    return None
+
+
+def _roll_adjustments(
+    expiries: List[Contract], roll_times: List[int], source: _TickSource, adjustment: Optional[str], start: int, end: int
+) -> Dict[str, np.ndarray]:
+    """The rolls between start and end, as columns of ROLL_DTYPES"""
+    rolls: Dict[str, list] = {c: [] for c in ROLL_DTYPES}
+    for k, roll_time in enumerate(roll_times):
+        if not start < roll_time < end:
+            continue
+        front_mid: Optional[float] = _last_mid(source=source, contract=expiries[k], before=roll_time)
+        next_mid: Optional[float] = _last_mid(source=source, contract=expiries[k + 1], before=roll_time)
+        if front_mid is None or next_mid is None:
+            logger.warning(
+                f"No quotes of both expiries before the roll at {pd.Timestamp(roll_time, tz='UTC')}: not adjusted"
+            )
+            value: float = 1. if adjustment == "ratio" else 0.
+        else:
+            value = next_mid / front_mid if adjustment == "ratio" else next_mid - front_mid
+        for c, v in zip(ROLL_DTYPES, (roll_time, expiries[k].conId, expiries[k + 1].conId, value)):
+            rolls[c].append(v)
+    return {c: np.array(rolls[c], dtype=dtype) for c, dtype in ROLL_DTYPES.items()}
+
+
+def _price_adjustments(
+    roll_columns: Dict[str, np.ndarray], bounds: List[int], adjustment: Optional[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Shift and factor of the prices of every expiry: the sum, or the product, of the adjustments of the rolls after it
+    """
+    shifts: np.ndarray = np.zeros(len(bounds) - 1)
+    factors: np.ndarray = np.ones(len(bounds) - 1)
+    for roll_time, value in zip(roll_columns["time"].tolist(), roll_columns["adjustment"].tolist()):
+        before: np.ndarray = np.array(bounds[1:]) <= roll_time
+        if adjustment == "difference":
+            shifts[before] += value
+        elif adjustment == "ratio":
+            factors[before] *= value
+    return shifts, factors
+
+
+def _stream_day(
+    expiries: List[Contract],
+    bounds: List[int],
+    shifts: np.ndarray,
+    factors: np.ndarray,
+    source: _TickSource,
+    tick_type: str,
+    day: datetime.date,
+) -> Dict[str, np.ndarray]:
+    """The ticks of the stream on one UTC day, with a con_id column. Empty dict if there are none"""
+    day_start: int = to_ns(datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc))
+    day_end: int = day_start + 86400 * 1000000000
+    segments: List[Dict[str, np.ndarray]] = []
+    for k, contract in enumerate(expiries):
+        lo, hi = max(bounds[k], day_start), min(bounds[k + 1], day_end)
+        if lo >= hi:
+            continue
+        ticks: Dict[str, np.ndarray] = source.day(contract, tick_type, day)
+        i, j = np.searchsorted(ticks["time"], [lo, hi], side="left")
+        segment: Dict[str, np.ndarray] = {c: np.array(a[i:j]) for c, a in ticks.items()}
+        for c in _PRICE_COLUMNS[tick_type]:
+            segment[c] = segment[c] * factors[k] + shifts[k]
+        segment["con_id"] = np.full(j - i, contract.conId, dtype=np.int64)
+        segments.append(segment)
+    if not segments or sum(len(s["time"]) for s in segments) == 0:
+        return {}
+    return {c: np.concatenate([s[c] for s in segments]) for c in segments[0]}
+
+
+def build_continuous_future(
+    contracts: List[Contract],
+    start_date: datetime.date,
+    end_date: datetime.date,
+    roll_rule: str = "5 days",
+    adjustment: Optional[str] = None,
+    cache_dir: pathlib.Path = TICKS_CACHE_DIR,
+    source_cache_dir: Optional[pathlib.Path] = None,
+    db_connection=None,
+    pool: Optional[DbPool] = None,
+) -> ContFuture:
+    """
+    Build the continuous stream of the expiries from start_date to end_date, TRADES and BID_ASK ticks,
+    into the cache tables of continuous_contract(). The tables are rebuilt from scratch: with back-adjustment,
+    every roll moves all the prices before it.
+    :param roll_rule: "N days" or "volume"
+    :param adjustment: None, "difference" or "ratio"
+    :param source_cache_dir: Read the ticks of the expiries from the local columnar cache instead of their
+    DbTicks tables.
+    :return: the contract to backtest the stream with
+    """
+    rule: RollRule = parse_roll_rule(roll_rule)
+    if adjustment is not None and adjustment not in ADJUSTMENTS:
+        raise ValueError(f"adjustment should be None or one of {ADJUSTMENTS}, got {adjustment}")
+    expiries: List[Contract] = _sort_expiries(contracts)
+    cont: ContFuture = continuous_contract(contracts=expiries, roll_rule=roll_rule, adjustment=adjustment)
+    source = _TickSource(cache_dir=source_cache_dir, db_connection=db_connection, pool=pool)
+
+    if rule.kind == "days":
+        roll_times: List[int] = _roll_times_by_days(contracts=expiries, days=rule.days)
+    else:
+        roll_times = _roll_times_by_volume(contracts=expiries, source=source, start_date=start_date, end_date=end_date)
+    start: int = to_ns(datetime.datetime.combine(start_date, datetime.time(), tzinfo=datetime.timezone.utc))
+    end: int = to_ns(
+        datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time(), tzinfo=datetime.timezone.utc)
+    )
+    # Expiry k is streamed from bounds[k] to bounds[k + 1]
+    bounds: List[int] = [np.iinfo(np.int64).min] + roll_times + [np.iinfo(np.int64).max]
+    roll_columns: Dict[str, np.ndarray] = _roll_adjustments(
+        expiries=expiries, roll_times=roll_times, source=source, adjustment=adjustment, start=start, end=end
+    )
+    shifts, factors = _price_adjustments(roll_columns=roll_columns, bounds=bounds, adjustment=adjustment)
+
+    for tick_type in ("TRADES", "BID_ASK"):
+        table_dir: pathlib.Path = get_cache_table_dir(contract=cont, tick_type=tick_type, cache_dir=cache_dir)
+        if table_dir.exists():
+            shutil.rmtree(table_dir)
+        table_dir.mkdir(parents=True)
+        n_ticks: int = 0
+        day: datetime.date = start_date
+        while day <= end_date:
+            arrays: Dict[str, np.ndarray] = _stream_day(
+                expiries=expiries, bounds=bounds, shifts=shifts, factors=factors, source=source, tick_type=tick_type, day=day
+            )
+            if arrays:
+                write_cache_day(day_dir=table_dir / day.strftime(DAY_FORMAT), arrays=arrays)
+                n_ticks += len(arrays["time"])
+            day += datetime.timedelta(days=1)
+        write_cache_day(day_dir=table_dir / ROLLS_DIR, arrays=roll_columns)
+        logger.info(f"Cached {n_ticks} {tick_type} ticks and {len(roll_columns['time'])} rolls in {table_dir}")
+    source.close()
+    return cont
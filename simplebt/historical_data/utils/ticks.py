@@ -28,9 +28,11 @@ def download_and_store_hist_ticks(
     start_datetime: datetime.datetime,
     tick_type: str = "TRADES",
     max_attempts: int = 10,
+    use_copy: bool = False,
 ):
     """
     Download and save hist ticks to db
+    :param use_copy: insert the ticks with COPY (binary format) instead of execute_values
     TODO: consider splitting this in
         - get ticks component, yielding ticks from while lopp
         - insert into db component
@@ -60,7 +62,10 @@ def download_and_store_hist_ticks(
             end_datetime = _update_end_datetime(ticks, end_datetime)
             if len(ticks) > 0:
                 n_trials = 0
-                db.insert_execute_values_iterator(ticks=list(filter(_istick, ticks)))
+                if use_copy:
+                    db.insert_copy(ticks=list(filter(_istick, ticks)))
+                else:
+                    db.insert_execute_values_iterator(ticks=list(filter(_istick, ticks)))
             else:
                 n_trials += 1
                 logger.info(f"No ticks returned. Trial: {n_trials}/{max_attempts}")
@@ -0,0 +1,244 @@
+"""
+Concurrent version of download_and_store_hist_ticks: several contract/tick type jobs are downloaded at once
+with reqHistoricalTicksAsync, while a single writer inserts the ticks into the db.
+
+IB paces historical data requests (https://interactivebrokers.github.io/tws-api/historical_limitations.html):
+no more than 60 requests in any 10 minute period, and less than 6 requests for the same contract and tick type
+in any 2 seconds. All the jobs draw their requests from a shared PacingBudget that enforces both limits.
+"""
+import asyncio
+import collections
+import datetime
+import time
+from dataclasses import dataclass
+from typing import Deque, Dict, Hashable, Iterator, List, Optional, Tuple, Union
+from ib_insync import IB, Contract
+from ib_insync.objects import HistoricalTickLast, HistoricalTickBidAsk
+from simplebt.db import DbTicks
+from simplebt.historical_data.utils.ticks import _choose_end_date_download, _istick, _update_end_datetime
+from simplebt.utils.logger import get_logger
+from simplebt.utils.ib import start_ib
+
+logger = get_logger(name=__name__)
+
+Ticks = List[Union[HistoricalTickLast, HistoricalTickBidAsk]]
+
+
+class SlidingWindowLimit:
+    """At most max_requests in any period"""
+    def __init__(self, max_requests: int, period: datetime.timedelta):
+        self.max_requests: int = max_requests
+        self.period: float = period.total_seconds()
+        self._sent: Deque[float] = collections.deque()
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait before one more request fits in the window"""
+        while self._sent and now - self._sent[0] >= self.period:
+            self._sent.popleft()
+        if len(self._sent) < self.max_requests:
+            return 0.
+        return self._sent[0] + self.period - now
+
+    def record(self, now: float):
+        self._sent.append(now)
+
+
+class PacingBudget:
+    """
+    Global budget of requests shared by all the download jobs, plus a budget per contract and tick type.
+    Requests are granted in the order they are asked for.
+    """
+    def __init__(
+        self,
+        max_requests: int = 60,
+        period: datetime.timedelta = datetime.timedelta(minutes=10),
+        max_requests_per_key: int = 5,
+        key_period: datetime.timedelta = datetime.timedelta(seconds=2),
+    ):
+        self._global = SlidingWindowLimit(max_requests=max_requests, period=period)
+        self._max_requests_per_key: int = max_requests_per_key
+        self._key_period: datetime.timedelta = key_period
+        self._per_key: Dict[Hashable, SlidingWindowLimit] = {}
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, key: Hashable):
+        if self._lock is None:  # created here to be bound to the running loop
+            self._lock = asyncio.Lock()
+        if key not in self._per_key:
+            self._per_key[key] = SlidingWindowLimit(max_requests=self._max_requests_per_key, period=self._key_period)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(self._global.delay(now), self._per_key[key].delay(now))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self._global.record(now)
+            self._per_key[key].record(now)
+
+
+@dataclass
+class DownloadJob:
+    """
+    One contract and tick type, downloaded backward from end_datetime down to start_datetime.
+    end_datetime is the resume point: it moves back as ticks are received. If None, it's chosen
+    from the ticks already in the db, as download_and_store_hist_ticks does.
+    """
+    contract: Contract
+    tick_type: str
+    start_datetime: datetime.datetime
+    end_datetime: Optional[datetime.datetime] = None
+    n_trials: int = 0
+    n_timeouts: int = 0
+    n_ticks: int = 0
+
+    @property
+    def key(self) -> Tuple[int, str]:
+        return self.contract.conId, self.tick_type
+
+    @property
+    def name(self) -> str:
+        return f"{self.contract.symbol} {self.contract.lastTradeDateOrContractMonth} {self.tick_type}"
+
+
+def download_and_store_hist_ticks_concurrently(
+    client_id: int,
+    port: int,
+    timeout: int,
+    jobs: List[DownloadJob],
+    concurrency: int = 4,
+    max_attempts: int = 10,
+    use_copy: bool = False,
+    budget: Optional[PacingBudget] = None,
+) -> List[DownloadJob]:
+    """
+    Download and save hist ticks to db for all the jobs, at most concurrency of them at a time
+    :return: the jobs, with their final state
+    """
+    ib = start_ib(client_id=client_id, port=port, timeout=timeout)
+    try:
+        ib.run(download_hist_ticks_async(
+            ib=ib,
+            jobs=jobs,
+            port=port,
+            client_id=client_id,
+            timeout=timeout,
+            concurrency=concurrency,
+            max_attempts=max_attempts,
+            use_copy=use_copy,
+            budget=budget,
+        ))
+    finally:
+        ib.disconnect()
+    return jobs
+
+
+async def download_hist_ticks_async(
+    ib: IB,
+    jobs: List[DownloadJob],
+    port: int,
+    client_id: int,
+    timeout: int,
+    concurrency: int = 4,
+    max_attempts: int = 10,
+    use_copy: bool = False,
+    budget: Optional[PacingBudget] = None,
+    queue_size: int = 100,
+):
+    """
+    Fetchers put the ticks they receive on a queue, a single writer inserts them into the db.
+    queue_size bounds the number of responses waiting to be written.
+    """
+    budget = budget or PacingBudget()
+    dbs: Dict[Tuple[int, str], DbTicks] = {}
+    for job in jobs:
+        db = DbTicks(contract=job.contract, tick_type=job.tick_type)
+        db.create_table()
+        dbs[job.key] = db
+        if job.end_datetime is None:
+            job.end_datetime = _choose_end_date_download(db, job.contract)
+
+    queue: "asyncio.Queue[Optional[Tuple[DownloadJob, Ticks]]]" = asyncio.Queue(maxsize=queue_size)
+    reconnect_lock = asyncio.Lock()
+    pending_jobs: Iterator[DownloadJob] = iter(jobs)  # shared by the fetchers
+
+    async def fetcher():
+        for job in pending_jobs:
+            await _fetch_job(
+                ib=ib, job=job, budget=budget, queue=queue, timeout=timeout, max_attempts=max_attempts,
+                reconnect=lambda: _reconnect(ib=ib, lock=reconnect_lock, port=port, client_id=client_id),
+            )
+
+    writer = asyncio.ensure_future(_write_ticks(queue=queue, dbs=dbs, use_copy=use_copy))
+    fetchers = asyncio.ensure_future(asyncio.gather(*(fetcher() for _ in range(concurrency))))
+    # If the writer fails, the fetchers would wait forever for room in the queue
+    await asyncio.wait([writer, fetchers], return_when=asyncio.FIRST_COMPLETED)
+    if writer.done():
+        fetchers.cancel()
+        writer.result()  # raises
+    await fetchers
+    await queue.put(None)
+    await writer
+    for db in dbs.values():
+        db.close()
+
+
+async def _fetch_job(
+    ib: IB, job: DownloadJob, budget: PacingBudget, queue: asyncio.Queue, timeout: int, max_attempts: int, reconnect
+):
+    logger.info(f"Starting {job.name} from {job.end_datetime}")
+    while (job.end_datetime > job.start_datetime) and (job.n_trials < max_attempts):
+        assert job.end_datetime.tzinfo == datetime.timezone.utc
+        await budget.acquire(key=job.key)
+        try:
+            ticks = await asyncio.wait_for(
+                ib.reqHistoricalTicksAsync(
+                    contract=job.contract,
+                    startDateTime="",  # one of startDateTime / endDateTime must be blank
+                    endDateTime=job.end_datetime,
+                    numberOfTicks=1000,
+                    whatToShow=job.tick_type,
+                    useRth=False,
+                    ignoreSize=False,
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            # Only this job backs off. It resumes from the same end_datetime, all the ticks before were queued
+            job.n_timeouts += 1
+            logger.info(f"-----------Timeout----------- {job.name} at {job.end_datetime}")
+            await asyncio.sleep(timeout)
+            await reconnect()
+            continue
+        ticks = ticks or []
+        job.end_datetime = _update_end_datetime(ticks, job.end_datetime)
+        if len(ticks) > 0:
+            job.n_trials = 0
+            job.n_ticks += len(ticks)
+            await queue.put((job, list(filter(_istick, ticks))))
+        else:
+            job.n_trials += 1
+            logger.info(f"{job.name}: no ticks returned. Trial: {job.n_trials}/{max_attempts}")
+    logger.info(f"Done with {job.name}: {job.n_ticks} ticks")
+
+
+async def _reconnect(ib: IB, lock: asyncio.Lock, port: int, client_id: int):
+    """Jobs timing out together reconnect only once"""
+    async with lock:
+        if not ib.isConnected():
+            logger.info("Reconnecting")
+            await ib.connectAsync("127.0.0.1", port, clientId=client_id)
+
+
+async def _write_ticks(queue: asyncio.Queue, dbs: Dict[Tuple[int, str], DbTicks], use_copy: bool):
+    """Insert the ticks in a thread, so that the fetchers keep going in the meantime. None stops the writer"""
+    loop = asyncio.get_event_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        job, ticks = item
+        if ticks:
+            db = dbs[job.key]
+            insert = db.insert_copy if use_copy else db.insert_execute_values_iterator
+            await loop.run_in_executor(None, insert, ticks)
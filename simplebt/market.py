@@ -1,41 +1,109 @@
 import datetime
+import pathlib
 import random
+from dataclasses import dataclass
 from typing import List, Union, Optional, Tuple
 import ib_insync as ibi
-import pandas as pd
 import trading_calendars as tc
 
+from simplebt.book import PendingOrdersBook
+from simplebt.db import DbPool
 from simplebt.events.market import MktOpenEvent, MktCloseEvent, FillEvent
-from simplebt.historical_data.load.ticks import BidAskTicksLoader, TradesTicksLoader
+from simplebt.historical_data.load.bars import BarsLoader
+from simplebt.historical_data.load.cache import CachedBidAskTicksLoader, CachedTradesTicksLoader
+from simplebt.historical_data.load.ticks import BidAskTicksLoader, TradesTicksLoader, MergedTicksLoader, TicksLoader
 from simplebt.orders import Order, LmtOrder, MktOrder, OrderAction
-from simplebt.ticker import TickByTickBidAsk, TickByTickAllLast, Ticker
+from simplebt.sessions import SessionTable, get_calendar, get_session_table
+from simplebt.ticker import AllLastTickBatch, BarBatch, BidAskTickBatch, TickByTickBidAsk, Ticker
 from simplebt.trade import StrategyTrade, Fill
 
 
+@dataclass(frozen=True)
+class MarketState:
+    """What a Market needs to resume at time, see Market.get_state(). Pending trades are in order of arrival"""
+    time: datetime.datetime
+    best: TickByTickBidAsk
+    is_mkt_open: bool
+    pending_trades: List[StrategyTrade]
+
+
 class Market:
     def __init__(
         self,
         start_time: datetime.datetime,
         contract: ibi.Contract,
+        loader_window: Optional[datetime.timedelta] = None,
+        merge_tick_types: bool = False,
+        server_side_cursor: bool = False,
+        db_connection=None,
+        db_pool: Optional[DbPool] = None,
+        binary_results: bool = False,
+        tick_cache_dir: Optional[pathlib.Path] = None,
+        end_time: Optional[datetime.datetime] = None,
+        skip_closed_sessions: bool = False,
+        bar_size: Optional[str] = None,
     ):
+        """
+        :param loader_window: Prefetch ticks from the database one window at a time instead of querying every second.
+        :param merge_tick_types: Read trades and bid/ask ticks with a single query.
+        :param server_side_cursor: Fill the prefetch windows from a forward-only named cursor.
+        :param db_pool: Have the loaders borrow their connections from this pool instead of opening their own.
+        :param binary_results: Fetch the prefetch windows in the binary COPY format.
+        :param tick_cache_dir: Replay the ticks from the local columnar cache in this directory instead of the database.
+        :param end_time: Sessions are precomputed between start_time and end_time. None means until the end of the calendar.
+        :param skip_closed_sessions: Don't load any tick while the market is closed.
+        :param bar_size: Replay the TRADES and BID_ASK bars of this size (e.g. "1 min") from the DbBars tables
+        instead of the ticks. Each bar is delivered at its close. See BarsLoader.
+        """
         self.time: datetime.datetime = start_time
         self.contract = contract
 
         # NOTE: beware this might not be accurate
-        self.calendar: tc.TradingCalendar = tc.get_calendar(contract.exchange)
-        self._is_mkt_open: bool = self.calendar.is_open_on_minute(pd.Timestamp(self.time))
+        self.calendar: tc.TradingCalendar = get_calendar(contract.exchange)
+        self._sessions: SessionTable = get_session_table(exchange=contract.exchange, start=start_time, end=end_time)
+        self._is_mkt_open: bool = self._sessions.is_open(self.time)
+        self._skip_closed_sessions: bool = skip_closed_sessions
 
         self._best: TickByTickBidAsk = TickByTickBidAsk(time=start_time, bid=-1, ask=-1, bid_size=0, ask_size=0)
 
-        self._trades_loader = TradesTicksLoader(contract)
-        self._bidask_loader = BidAskTicksLoader(contract)
+        self._ticks_loader: Optional[MergedTicksLoader] = None
+        self._trades_loader: Optional[Union[TradesTicksLoader, CachedTradesTicksLoader]] = None
+        self._bidask_loader: Optional[Union[BidAskTicksLoader, CachedBidAskTicksLoader]] = None
+        self._bars_loader: Optional[BarsLoader] = None
+        loader_kwargs = dict(
+            window=loader_window,
+            server_side_cursor=server_side_cursor,
+            db_connection=db_connection,
+            pool=db_pool,
+            binary=binary_results,
+        )
+        if bar_size is not None:
+            self._bars_loader = BarsLoader(
+                contract,
+                bar_size=bar_size,
+                start=start_time,
+                end=end_time,
+                db_connection=db_connection,
+                pool=db_pool,
+                binary=binary_results,
+            )
+        elif tick_cache_dir is not None:
+            self._trades_loader = CachedTradesTicksLoader(contract, cache_dir=tick_cache_dir)
+            self._bidask_loader = CachedBidAskTicksLoader(contract, cache_dir=tick_cache_dir)
+        elif merge_tick_types:
+            self._ticks_loader = MergedTicksLoader(contract, **loader_kwargs)
+        else:
+            self._trades_loader = TradesTicksLoader(contract, **loader_kwargs)
+            self._bidask_loader = BidAskTicksLoader(contract, **loader_kwargs)
 
-        self._trades_with_pending_orders: List[StrategyTrade] = []
+        self._pending_orders: PendingOrdersBook = PendingOrdersBook()
 
         # Events
         self._cal_event: Optional[Union[MktOpenEvent, MktCloseEvent]] = None
-        self._mkt_trades: List[TickByTickAllLast] = []
-        self._change_bests: List[TickByTickBidAsk] = []
+        self._mkt_trades: AllLastTickBatch = AllLastTickBatch.empty()
+        self._change_bests: BidAskTickBatch = BidAskTickBatch.empty()
+        self._bars: BarBatch = BarBatch.empty()
+        self._bidask_bars: BarBatch = BarBatch.empty()
         self._fill_events: List[FillEvent] = []
 
         self.set_time(time=self.time)  # This method may populate the collections above
@@ -56,29 +124,68 @@ class Market:
         return self._fill_events
 
     def get_pending_ticker(self) -> Optional[Ticker]:
-        ticks: List[Union[TickByTickBidAsk, TickByTickAllLast]] = []
-        ticks += self._mkt_trades
-        ticks += self._change_bests
-        if ticks:
+        if len(self._mkt_trades) > 0 or len(self._change_bests) > 0:
             return Ticker(
                 contract=self.contract,
-                tickByTicks=ticks,
+                trades=self._mkt_trades,
+                bidasks=self._change_bests,
+                bars=self._bars if self._bars_loader is not None else None,
+                bidask_bars=self._bidask_bars if self._bars_loader is not None else None,
             )
 
     def add_order(self, order: Order) -> StrategyTrade:
         # validate order and add ID
         order.submitted()
-        trade = StrategyTrade(order)
-        self._trades_with_pending_orders.append(trade)
+        trade = StrategyTrade(order, arrival=self._best)
+        self._pending_orders.add(trade)
         return trade
 
+    def add_orders(self, orders: List[Order]) -> List[StrategyTrade]:
+        """add_order() for a batch of orders, all arriving on the same best bid and ask"""
+        best: TickByTickBidAsk = self._best
+        trades: List[StrategyTrade] = []
+        for order in orders:
+            order.submitted()
+            trade = StrategyTrade(order, arrival=best)
+            self._pending_orders.add(trade)
+            trades.append(trade)
+        return trades
+
     def cancel_order(self, order: Order) -> StrategyTrade:
-        corresponding_trade = next(filter(lambda t: t.order == order, self._trades_with_pending_orders))
-        self._trades_with_pending_orders.remove(corresponding_trade)
+        corresponding_trade = self._pending_orders.get_trade(order)
+        self._pending_orders.remove(corresponding_trade)
         order.cancelled()
         corresponding_trade.update_order(order)
         return corresponding_trade
 
+    def get_state(self) -> MarketState:
+        return MarketState(
+            time=self.time,
+            best=self._best,
+            is_mkt_open=self._is_mkt_open,
+            pending_trades=list(self._pending_orders),
+        )
+
+    def set_state(self, state: MarketState):
+        """
+        Restore a state got from get_state(), typically in another process. No tick is loaded:
+        the loaders reposition themselves at the next set_time()
+        """
+        for loader in (self._ticks_loader, self._trades_loader, self._bidask_loader):
+            if isinstance(loader, TicksLoader):
+                loader.close()  # Or its stream would read its way from start_time to the restored time
+        self.time = state.time
+        self._best = state.best
+        self._is_mkt_open = state.is_mkt_open
+        self._pending_orders = PendingOrdersBook()
+        for trade in state.pending_trades:
+            self._pending_orders.add(trade)
+        self._cal_event = None
+        self._mkt_trades = AllLastTickBatch.empty()
+        self._change_bests = BidAskTickBatch.empty()
+        self._bars = self._bidask_bars = BarBatch.empty()
+        self._fill_events = []
+
     def set_time(self, time: datetime.datetime):
         """
         Set_time() updates the collection/variables that caches mkt events.
@@ -87,15 +194,66 @@ class Market:
         if self.time != time:
             self.time = time
         self._cal_event = self._update_cal_and_get_event(time=time)
+        if self._skip_closed_sessions and not self._is_mkt_open:
+            self._mkt_trades = AllLastTickBatch.empty()
+            self._change_bests = BidAskTickBatch.empty()
+            self._bars = self._bidask_bars = BarBatch.empty()
+            self._fill_events = []
+            return
 
-        self._mkt_trades = self._trades_loader.get_ticks_batch_by_time(time=time)
-        self._change_bests = self._bidask_loader.get_ticks_batch_by_time(time=time)
+        if self._bars_loader is not None:
+            self._bars, self._bidask_bars = self._bars_loader.get_bars_batch_by_time(time=time)
+            self._mkt_trades, self._change_bests = self._bars_loader.get_ticks_batch_by_time(time=time)
+        elif self._ticks_loader is not None:
+            self._mkt_trades, self._change_bests = self._ticks_loader.get_ticks_batch_by_time(time=time)
+        else:
+            self._mkt_trades = self._trades_loader.get_ticks_batch_by_time(time=time)
+            self._change_bests = self._bidask_loader.get_ticks_batch_by_time(time=time)
         if len(self._change_bests) > 0:
             self._best = self._change_bests[-1]
         self._fill_events = self._process_pending_orders() if self._is_mkt_open else []
 
+    def skip_to(self, time: datetime.datetime):
+        """
+        Same as set_time() for a time at which the market is known to have no ticks: no loader is queried.
+        Pending orders can't be filled without new bid/ask ticks, so there is nothing to match either.
+        """
+        self.time = time
+        self._cal_event = self._update_cal_and_get_event(time=time)
+        self._mkt_trades = AllLastTickBatch.empty()
+        self._change_bests = BidAskTickBatch.empty()
+        self._bars = self._bidask_bars = BarBatch.empty()
+        self._fill_events = []
+
+    def is_open(self, time: datetime.datetime) -> bool:
+        return self._sessions.is_open(time)
+
+    def get_next_open(self, time: datetime.datetime) -> Optional[datetime.datetime]:
+        """Open of the first session opening at or after time"""
+        return self._sessions.next_open(time)
+
+    def get_next_tick_time(self, time: datetime.datetime) -> Optional[datetime.datetime]:
+        """
+        Time of the first trade or bid/ask tick at or after time. None if there are no more ticks.
+        With skip_closed_sessions, ticks printed while the market is closed are ignored.
+        """
+        next_time: Optional[datetime.datetime] = self._get_next_loaded_tick_time(time=time)
+        while self._skip_closed_sessions and next_time is not None and not self._sessions.is_open(next_time):
+            next_open: Optional[datetime.datetime] = self._sessions.next_open(next_time)
+            if next_open is None:
+                return None
+            next_time = self._get_next_loaded_tick_time(time=next_open)
+        return next_time
+
+    def _get_next_loaded_tick_time(self, time: datetime.datetime) -> Optional[datetime.datetime]:
+        if self._bars_loader is not None:
+            return self._bars_loader.get_next_tick_time(time=time)
+        loaders = (self._ticks_loader,) if self._ticks_loader is not None else (self._trades_loader, self._bidask_loader)
+        next_times = [t for t in (loader.get_next_tick_time(time=time) for loader in loaders) if t is not None]
+        return min(next_times) if next_times else None
+
     def _update_cal_and_get_event(self, time: datetime.datetime) -> Optional[Union[MktOpenEvent, MktCloseEvent]]:
-        is_mkt_open: bool = self.calendar.is_open_on_minute(pd.Timestamp(time))
+        is_mkt_open: bool = self._sessions.is_open(time)
         if is_mkt_open != self._is_mkt_open:
             # first, update the class state
             self._is_mkt_open = is_mkt_open
@@ -109,39 +267,48 @@ class Market:
     def _process_pending_orders(self) -> List[FillEvent]:
         fill_events: List[FillEvent] = []
 
-        for best_bidask in self._change_bests:
-            for trade_with_pending_order in self._trades_with_pending_orders:
+        if len(self._pending_orders) == 0:
+            return fill_events
+        for i, (bid, ask) in enumerate(zip(self._change_bests.bid.tolist(), self._change_bests.ask.tolist())):
+            # Only the orders crossed by this bid/ask can be filled: the others are not even visited.
+            # The tick object is only built when there is something to fill
+            crossed: List[StrategyTrade] = self._pending_orders.crossed(bid=bid, ask=ask)
+            if not crossed:
+                continue
+            best_bidask: TickByTickBidAsk = self._change_bests[i]
+            for trade_with_pending_order in crossed:
                 trade, fill = self._process_order(trade=trade_with_pending_order, best=best_bidask)
                 if fill:
                     fill_events.append(FillEvent(time=self.time, trade=trade, fill=fill))
                 # Using if instead of elif here
                 # because even if there was a fill, the original order might not be completely filled yet
                 if trade.filled:
-                    self._trades_with_pending_orders.remove(trade)
+                    self._pending_orders.remove(trade)
         return fill_events
 
     def _process_order(self, trade: StrategyTrade, best: TickByTickBidAsk) -> Tuple[StrategyTrade, Optional[Fill]]:
         fill: Optional[Fill] = None
         if isinstance(trade.order, MktOrder):
-            fill = self._exec_mkt_order(order=trade.order, best=best)
+            fill = self._exec_mkt_order(order=trade.order, best=best, lots=trade.remaining_lots)
         elif isinstance(trade.order, LmtOrder):
-            fill = self._exec_lmt_order(order=trade.order, best=best)
+            fill = self._exec_lmt_order(order=trade.order, best=best, lots=trade.remaining_lots)
 
         if fill:
             trade.add_fill(fill)
         return trade, fill
 
-    def _exec_mkt_order(self, order: MktOrder, best: TickByTickBidAsk) -> Optional[Fill]:
+    def _exec_mkt_order(self, order: MktOrder, best: TickByTickBidAsk, lots: int) -> Optional[Fill]:
+        """:param lots: the lots of order left to fill"""
         price: Optional[float] = None
         filled_lots: Optional[int] = None
         # pick the side according to the order type (Long vs Short)
         if order.action == OrderAction.BUY:
             # Don't have book depth. Only playing with best here
             price = best.ask
-            filled_lots = min(order.lots, best.ask_size)
+            filled_lots = min(lots, best.ask_size)
         elif order.action == OrderAction.SELL:
             price = best.bid
-            filled_lots = min(order.lots, best.bid_size)
+            filled_lots = min(lots, best.bid_size)
         else:
             raise ValueError("Unknown order Action")
         if price and filled_lots:
@@ -152,18 +319,19 @@ class Market:
                 order_action=order.action
             )
 
-    def _exec_lmt_order(self, order: LmtOrder, best: TickByTickBidAsk) -> Optional[Fill]:
+    def _exec_lmt_order(self, order: LmtOrder, best: TickByTickBidAsk, lots: int) -> Optional[Fill]:
+        """:param lots: the lots of order left to fill"""
         # pick the side according to the order type (Long vs Short)
         price: Optional[float] = None
         filled_lots: Optional[int] = None
         if order.action == OrderAction.BUY:
             if order.price >= best.ask:
                 price = best.ask
-                filled_lots = min(order.lots, best.ask_size)
+                filled_lots = min(lots, best.ask_size)
         elif order.action == OrderAction.SELL:
             if order.price <= best.bid:
                 price = best.bid
-                filled_lots = min(order.lots, best.bid_size)
+                filled_lots = min(lots, best.bid_size)
         else:
             raise ValueError("Unknown order Action")
         if price and filled_lots:
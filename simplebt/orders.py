@@ -2,7 +2,7 @@ import abc
 import datetime
 import ib_insync as ibi
 from enum import Enum
-from typing import ClassVar, Set
+from typing import ClassVar, Optional, Set
 from dataclasses import dataclass
 
 
@@ -105,3 +105,17 @@ class LmtOrder(Order):
     @property
     def price(self) -> float:
         return self._price
+
+
+@dataclass(frozen=True)
+class OrderIntent:
+    """An order to send, as returned by batch strategies: a limit order if price is set, a market order otherwise"""
+    contract: ibi.Contract
+    action: OrderAction
+    lots: int
+    price: Optional[float] = None
+
+    def to_order(self, time: datetime.datetime) -> Order:
+        if self.price is None:
+            return MktOrder(contract=self.contract, action=self.action, lots=self.lots, time=time)
+        return LmtOrder(contract=self.contract, action=self.action, lots=self.lots, price=self.price, time=time)
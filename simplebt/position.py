@@ -1,19 +1,57 @@
 import ib_insync as ibi
 import numpy as np
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, Iterator, List, Tuple, Union
 
 from simplebt.orders import OrderAction
 from simplebt.trade import Fill
 
 
+def get_multiplier(contract: ibi.Contract) -> float:
+    if isinstance(contract, (ibi.Future, ibi.ContFuture)) and contract.multiplier:
+        return float(contract.multiplier)
+    return 1.0
+
+
+def calc_unrealized_pnls(
+    bid: np.ndarray, ask: np.ndarray, position: np.ndarray, avg_cost: np.ndarray, multiplier: Union[float, np.ndarray]
+) -> np.ndarray:
+    """Unrealized PnLs of positions with these average costs. Longs are marked at the bid, shorts at the ask"""
+    delta: np.ndarray = np.where(position > 0, bid - avg_cost, avg_cost - ask)
+    return delta * np.abs(position) * multiplier
+
+
+def apply_fill(
+    position: int, avg_cost: float, realized_pnl: float, lots: int, price: float, multiplier: float
+) -> Tuple[int, float, float]:
+    """
+    Average cost accounting, O(1) per fill. Returns the position, average cost and realized PnL after the fill.
+    - a fill opening or adding to the position moves the average cost
+    - a fill reducing the position realizes the PnL of the closed lots and leaves the average cost alone
+    - a fill flipping the position closes all of it and opens the remainder at the fill price
+    :param lots: signed, positive for buys
+    """
+    new_position: int = position + lots
+    if position == 0 or (position > 0) == (lots > 0):
+        avg_cost = (avg_cost * abs(position) + price * abs(lots)) / abs(new_position)
+    else:
+        closed_lots: int = min(abs(lots), abs(position))
+        position_side: int = 1 if position > 0 else -1
+        realized_pnl += (price - avg_cost) * closed_lots * position_side * multiplier
+        if new_position == 0:
+            avg_cost = 0
+        elif (new_position > 0) != (position > 0):
+            avg_cost = price
+    return new_position, avg_cost, realized_pnl
+
+
 class Position:
     def __init__(self, contract: ibi.Contract):
         self._contract = contract
         self._position: int = 0
         self._avg_cost: float = 0
-        self._entries: List[Fill] = []
-        # self._realized_pnl: float = 0
+        self._realized_pnl: float = 0
+        self._multiplier: float = get_multiplier(contract)
 
     @property
     def contract(self) -> ibi.Contract:
@@ -27,22 +65,24 @@ class Position:
     def avg_cost(self) -> float:
         return self._avg_cost
 
-    # @property
-    # def realized_pnl(self) -> float:
-    #     return self._realized_pnl
+    @property
+    def realized_pnl(self) -> float:
+        return self._realized_pnl
+
+    @property
+    def multiplier(self) -> float:
+        return self._multiplier
 
     def update(self, fill: Fill):
-        self._entries.append(fill)
-        new_position = sum(map(lambda x: x.lots * self._order_action_to_side(x.order_action), self._entries))
-        if new_position == 0:
-            # self._realized_pnl += (fill.price - self._avg_cost) * self._order_action_to_side(fill.order_action) * int(self.fill.contract.multiplier)
-            self._position = 0
-            self._avg_cost = 0
-            self._entries = []
-        else:
-            avg_cost = sum(map(lambda x: x.lots * x.price, self._entries)) / sum(map(lambda x: abs(x.lots), self._entries))
-            self._avg_cost = avg_cost
-            self._position = new_position
+        side: int = self._order_action_to_side(fill.order_action)
+        self._position, self._avg_cost, self._realized_pnl = apply_fill(
+            position=self._position,
+            avg_cost=self._avg_cost,
+            realized_pnl=self._realized_pnl,
+            lots=side * fill.lots,
+            price=fill.price,
+            multiplier=self._multiplier,
+        )
 
     @staticmethod
     def _order_action_to_side(order_action: OrderAction) -> int:
@@ -55,6 +95,30 @@ class Position:
             raise ValueError("Unknown OrderAction")
 
 
+class Portfolio:
+    """Ledger of the Positions, keyed by conId"""
+    def __init__(self, contracts: List[ibi.Contract]):
+        self._positions: Dict[int, Position] = {c.conId: Position(c) for c in contracts}
+
+    def __getitem__(self, con_id: int) -> Position:
+        return self._positions[con_id]
+
+    def __iter__(self) -> Iterator[Position]:
+        return iter(self._positions.values())
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def update(self, con_id: int, fill: Fill) -> Position:
+        position: Position = self._positions[con_id]
+        position.update(fill=fill)
+        return position
+
+    @property
+    def realized_pnl(self) -> float:
+        return sum(p.realized_pnl for p in self._positions.values())
+
+
 @dataclass
 class PnLSingle:
     conId: int = 0
@@ -0,0 +1,80 @@
+"""
+Opt-in instrumentation of the backtest loop.
+
+The Profiler replaces the methods to measure, on the instances only, with wrappers recording
+wall time and call counts. Nothing is wrapped unless profiling is enabled, so there is no overhead otherwise.
+"""
+import functools
+import time
+from typing import Callable, Dict, List, Set, Tuple
+
+
+class PhaseStats:
+    """
+    Cumulative wall time, call count and latency histogram of one phase.
+    Bucket i of the histogram counts the calls that took less than 2**i microseconds (and at least 2**(i-1)).
+    """
+    n_buckets: int = 32
+
+    __slots__ = ("count", "total", "max", "histogram")
+
+    def __init__(self):
+        self.count: int = 0
+        self.total: float = 0.
+        self.max: float = 0.
+        self.histogram: List[int] = [0] * self.n_buckets
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.histogram[min(int(seconds * 1e6).bit_length(), self.n_buckets - 1)] += 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.
+
+    def percentile(self, q: float) -> float:
+        """Upper bound, in seconds, of the histogram bucket holding the q-th percentile (0 < q <= 100)"""
+        threshold: float = self.count * q / 100
+        cumulated: int = 0
+        for i, n in enumerate(self.histogram):
+            cumulated += n
+            if cumulated >= threshold and cumulated > 0:
+                return 2 ** i / 1e6
+        return 0.
+
+
+class Profiler:
+    def __init__(self):
+        self.stats: Dict[str, PhaseStats] = {}
+        self._wrapped: Set[Tuple[int, str]] = set()
+
+    def wrap(self, obj, method_name: str, phase: str):
+        """Time every call of obj.method_name under phase. A method is only wrapped once"""
+        if (id(obj), method_name) in self._wrapped:
+            return
+        self._wrapped.add((id(obj), method_name))
+        method: Callable = getattr(obj, method_name)
+        stats: PhaseStats = self.stats.setdefault(phase, PhaseStats())
+        perf_counter = time.perf_counter
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            t0 = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats.record(perf_counter() - t0)
+
+        setattr(obj, method_name, timed)
+
+    def report(self) -> str:
+        lines = [f"{'phase':<60}{'calls':>10}{'total s':>10}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'max us':>10}"]
+        for phase, s in sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True):
+            lines.append(
+                f"{phase:<60}{s.count:>10}{s.total:>10.3f}{s.mean * 1e6:>10.1f}"
+                f"{s.percentile(50) * 1e6:>10.0f}{s.percentile(99) * 1e6:>10.0f}{s.max * 1e6:>10.0f}"
+            )
+        return "\n".join(lines)
@@ -9,12 +9,18 @@ PGDATABASE = "gulo"
 PGPASSWORD = os.environ.get("PGPASSWORD") or ""
 
 TICKS_SCHEMA_NAME = "ticks"
+# Layout of the tick tables created from now on, "pk" or "compact": see simplebt.db._db_ticks
+TICKS_TABLE_LAYOUT = "pk"
+# Range partitioning of the tick tables created from now on, "day", "month" or None. Needs the compact layout
+TICKS_TABLE_PARTITION = None
 BARS_SCHEMA_DICT = {"TRADES": "bars_trades", "BID_ASK": "bars_bidask"}
 
 _TMP_DIR = tempfile.TemporaryDirectory()
 BASE_DIR = pathlib.Path(_TMP_DIR.name)
 DATA_DIR = BASE_DIR / "data"
 DATA_DIR.mkdir(exist_ok=True)
+# Unlike BASE_DIR, the ticks cache outlives the process: it is built once and read by every later backtest
+TICKS_CACHE_DIR = pathlib.Path(os.environ.get("SIMPLEBT_TICKS_CACHE_DIR") or pathlib.Path.home() / ".simplebt" / "ticks_cache")
 LOGS_DIR = BASE_DIR / "logs"
 LOGS_DIR.mkdir(exist_ok=True)
 BACKTEST_DIR = BASE_DIR / "backtest_results"
@@ -0,0 +1,311 @@
+"""
+Streaming storage of the backtest results, so that long runs don't have to keep their whole history in memory.
+
+A ResultsSink subscribed to the Backtester receives the order, cancel, fill and PnL events as they are
+delivered. ArrowResultsSink buffers them as rows and appends them in batches to one columnar file per table
+(orders, fills, pnl) in a run directory under BACKTEST_DIR, in the Parquet or the Arrow IPC format.
+Memory is bounded by the batch size. BacktestResults reads a run back as DataFrames, on demand.
+
+pyarrow is an optional dependency: pip install simplebt[results]
+"""
+import abc
+import datetime
+import functools
+import itertools
+import pathlib
+import shutil
+import uuid
+import weakref
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+from simplebt.events.generic import Event
+from simplebt.events.market import FillEvent, PnLSingleEvent
+from simplebt.events.orders import OrderCanceledEvent, OrderReceivedEvent
+from simplebt.orders import LmtOrder, MktOrder, Order
+from simplebt.position import get_multiplier
+from simplebt.resources.config import BACKTEST_DIR
+from simplebt.ticker import TickByTickBidAsk
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pa_ipc = pq = None
+
+RESULTS_FORMATS: Tuple[str, ...] = ("parquet", "arrow")
+_SUFFIXES: Dict[str, str] = {"parquet": ".parquet", "arrow": ".arrow"}
+RUN_ID_FORMAT = "%Y%m%dT%H%M%S"
+
+# Columns of every table, with their arrow type names
+RESULTS_COLUMNS: Dict[str, Dict[str, str]] = {
+    "orders": {
+        "time": "timestamp",
+        "event": "string",
+        "order_ref": "int64",
+        "con_id": "int64",
+        "symbol": "string",
+        "action": "string",
+        "lots": "int64",
+        "order_type": "string",
+        "limit_price": "float64",
+    },
+    "fills": {
+        "time": "timestamp",
+        "order_ref": "int64",
+        "con_id": "int64",
+        "symbol": "string",
+        "action": "string",
+        "lots": "int64",
+        "price": "float64",
+        "multiplier": "float64",
+        "arrival_bid": "float64",
+        "arrival_ask": "float64",
+    },
+    "pnl": {
+        "time": "timestamp",
+        "con_id": "int64",
+        "position": "int64",
+        "unrealized_pnl": "float64",
+        "realized_pnl": "float64",
+    },
+}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required to store the backtest results: pip install simplebt[results]")
+
+
+def _arrow_schema(table: str) -> "pa.Schema":
+    types = {
+        "timestamp": pa.timestamp("us", tz="UTC"),
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+    }
+    return pa.schema([(c, types[t]) for c, t in RESULTS_COLUMNS[table].items()])
+
+
+def new_run_dir(base_dir: pathlib.Path = BACKTEST_DIR) -> pathlib.Path:
+    """A new directory named after the current time, sortable, and unique even for runs started together"""
+    run_id = f"{datetime.datetime.now(datetime.timezone.utc).strftime(RUN_ID_FORMAT)}_{uuid.uuid4().hex[:8]}"
+    run_dir = base_dir / run_id
+    run_dir.mkdir(parents=True)
+    return run_dir
+
+
+def list_runs(base_dir: pathlib.Path = BACKTEST_DIR) -> List[pathlib.Path]:
+    """Run directories sorted by name: oldest first for the directories made by new_run_dir()"""
+    if not base_dir.exists():
+        return []
+    return sorted(p for p in base_dir.iterdir() if p.is_dir())
+
+
+def prune_runs(keep: int, base_dir: pathlib.Path = BACKTEST_DIR) -> List[pathlib.Path]:
+    """
+    Delete all but the keep most recent runs
+    :return: the directories deleted
+    """
+    runs: List[pathlib.Path] = list_runs(base_dir=base_dir)
+    deleted: List[pathlib.Path] = runs[:max(len(runs) - keep, 0)]
+    for run_dir in deleted:
+        shutil.rmtree(run_dir)
+    return deleted
+
+
+class ResultsSink(abc.ABC):
+    """Receives the events to store as the Backtester delivers them. close() is called at the end of run()"""
+    include_pnl: bool = True
+
+    @abc.abstractmethod
+    def write(self, event: Event):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def close(self):
+        raise NotImplementedError
+
+
+class ArrowResultsSink(ResultsSink):
+    def __init__(
+        self,
+        run_dir: Optional[pathlib.Path] = None,
+        fmt: str = "parquet",
+        batch_size: int = 10000,
+        include_pnl: bool = True,
+    ):
+        """
+        :param run_dir: Directory of the files of the run. By default a new directory under BACKTEST_DIR.
+        :param fmt: parquet, or arrow for the Arrow IPC file format.
+        :param batch_size: Rows buffered per table before they are appended to its file.
+        :param include_pnl: Store the PnLSingleEvents as well. They may well outnumber all the other events.
+        """
+        _require_pyarrow()
+        if fmt not in RESULTS_FORMATS:
+            raise ValueError(f"fmt should be one of {RESULTS_FORMATS}, got {fmt}")
+        self.run_dir: pathlib.Path = run_dir if run_dir is not None else new_run_dir()
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self.fmt: str = fmt
+        self.batch_size: int = batch_size
+        self.include_pnl: bool = include_pnl
+        self._rows: Dict[str, Dict[str, list]] = {t: {c: [] for c in columns} for t, columns in RESULTS_COLUMNS.items()}
+        self._writers: Dict[str, object] = {}
+        # Orders have no id: fills are tied to their order by a reference number given on first sight
+        self._order_refs: "weakref.WeakKeyDictionary[Order, int]" = weakref.WeakKeyDictionary()
+        self._next_order_ref = itertools.count()
+        self.rows_written: Dict[str, int] = {t: 0 for t in RESULTS_COLUMNS}
+        self.closed: bool = False
+
+    def write(self, event: Event):
+        if isinstance(event, FillEvent):
+            order: Order = event.trade.order
+            arrival: Optional[TickByTickBidAsk] = event.trade.arrival
+            self._append("fills", (
+                event.time,
+                self._order_ref(order),
+                order.contract.conId,
+                order.contract.symbol,
+                event.fill.order_action.name,
+                event.fill.lots,
+                event.fill.price,
+                get_multiplier(order.contract),
+                arrival.bid if arrival is not None else np.nan,
+                arrival.ask if arrival is not None else np.nan,
+            ))
+        elif isinstance(event, (OrderReceivedEvent, OrderCanceledEvent)):
+            order = event.trade.order
+            self._append("orders", (
+                event.time,
+                "received" if isinstance(event, OrderReceivedEvent) else "canceled",
+                self._order_ref(order),
+                order.contract.conId,
+                order.contract.symbol,
+                order.action.name,
+                order.lots,
+                "LMT" if isinstance(order, LmtOrder) else "MKT" if isinstance(order, MktOrder) else type(order).__name__,
+                order.price if isinstance(order, LmtOrder) else np.nan,
+            ))
+        elif isinstance(event, PnLSingleEvent):
+            pnl = event.pnl
+            self._append("pnl", (event.time, pnl.conId, pnl.position, pnl.unrealizedPnL, pnl.realizedPnL))
+        else:
+            raise ValueError(f"Got unexpected event: {event}")
+
+    def _order_ref(self, order: Order) -> int:
+        ref: Optional[int] = self._order_refs.get(order)
+        if ref is None:
+            ref = self._order_refs[order] = next(self._next_order_ref)
+        return ref
+
+    def _append(self, table: str, row: tuple):
+        columns: Dict[str, list] = self._rows[table]
+        for values, value in zip(columns.values(), row):
+            values.append(value)
+        if len(columns["time"]) >= self.batch_size:
+            self._flush_table(table)
+
+    def _flush_table(self, table: str):
+        columns: Dict[str, list] = self._rows[table]
+        schema = _arrow_schema(table)
+        writer = self._writers.get(table)
+        if writer is None:
+            path: pathlib.Path = self.run_dir / f"{table}{_SUFFIXES[self.fmt]}"
+            if self.fmt == "parquet":
+                writer = pq.ParquetWriter(str(path), schema)
+            else:
+                writer = pa_ipc.new_file(str(path), schema)
+            self._writers[table] = writer
+        if len(columns["time"]) == 0:
+            return
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns.values(), schema)], schema=schema
+        )
+        if self.fmt == "parquet":
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+        self.rows_written[table] += batch.num_rows
+        self._rows[table] = {c: [] for c in columns}
+
+    def flush(self):
+        for table in RESULTS_COLUMNS:
+            if len(self._rows[table]["time"]) > 0:
+                self._flush_table(table)
+
+    def close(self):
+        """Flush the buffers and close the files. Tables without rows get an empty file, so that every run reads the same"""
+        if self.closed:
+            return
+        for table in RESULTS_COLUMNS:
+            if table == "pnl" and not self.include_pnl:
+                continue
+            self._flush_table(table)
+            self._writers[table].close()
+        self.closed = True
+
+
+class BacktestResults:
+    """Reads the files of a run lazily: nothing is loaded before a table is asked for"""
+    def __init__(self, run_dir: pathlib.Path):
+        _require_pyarrow()
+        if not run_dir.is_dir():
+            raise FileNotFoundError(f"No backtest results in {run_dir}")
+        self.run_dir: pathlib.Path = run_dir
+
+    @classmethod
+    def latest(cls, base_dir: pathlib.Path = BACKTEST_DIR) -> "BacktestResults":
+        runs: List[pathlib.Path] = list_runs(base_dir=base_dir)
+        if not runs:
+            raise FileNotFoundError(f"No backtest results in {base_dir}")
+        return cls(runs[-1])
+
+    @property
+    def tables(self) -> List[str]:
+        return [t for t in RESULTS_COLUMNS if self._path(t) is not None]
+
+    def _path(self, table: str) -> Optional[pathlib.Path]:
+        for suffix in _SUFFIXES.values():
+            path: pathlib.Path = self.run_dir / f"{table}{suffix}"
+            if path.exists():
+                return path
+        return None
+
+    def iter_batches(self, table: str, columns: Optional[Sequence[str]] = None) -> Iterator[pd.DataFrame]:
+        """The rows of a table one stored batch at a time, to go through runs larger than memory"""
+        path: Optional[pathlib.Path] = self._path(table)
+        if path is None:
+            raise FileNotFoundError(f"No {table} table in {self.run_dir}")
+        if path.suffix == ".parquet":
+            for batch in pq.ParquetFile(str(path)).iter_batches(columns=columns):
+                yield batch.to_pandas()
+        else:
+            with pa.memory_map(str(path)) as source:
+                reader = pa_ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    df: pd.DataFrame = reader.get_batch(i).to_pandas()
+                    yield df if columns is None else df[list(columns)]
+
+    def read(self, table: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        path: Optional[pathlib.Path] = self._path(table)
+        if path is None:
+            raise FileNotFoundError(f"No {table} table in {self.run_dir}")
+        if path.suffix == ".parquet":
+            return pq.read_table(str(path), columns=columns).to_pandas()
+        with pa.memory_map(str(path)) as source:
+            df = pa_ipc.open_file(source).read_pandas()
+        return df if columns is None else df[list(columns)]
+
+    @functools.cached_property
+    def orders(self) -> pd.DataFrame:
+        return self.read("orders")
+
+    @functools.cached_property
+    def fills(self) -> pd.DataFrame:
+        return self.read("fills")
+
+    @functools.cached_property
+    def pnl(self) -> pd.DataFrame:
+        return self.read("pnl")
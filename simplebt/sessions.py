@@ -0,0 +1,71 @@
+"""
+Trading calendars shared across Markets, and their sessions precomputed as int64 arrays.
+Checking whether a market is open becomes a bisect instead of a TradingCalendar.is_open_on_minute call.
+"""
+import bisect
+import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import trading_calendars as tc
+
+from simplebt.utils import from_ns, to_ns
+
+# Sessions can open the evening before their label (e.g. futures): keep a margin around the requested range
+_MARGIN = pd.Timedelta(days=7)
+
+_calendars: Dict[str, tc.TradingCalendar] = {}
+_session_tables: Dict[Tuple[str, Optional[datetime.date], Optional[datetime.date]], "SessionTable"] = {}
+
+
+def get_calendar(exchange: str) -> tc.TradingCalendar:
+    """One calendar instance per exchange and per process"""
+    if exchange not in _calendars:
+        _calendars[exchange] = tc.get_calendar(exchange)
+    return _calendars[exchange]
+
+
+def get_session_table(
+    exchange: str,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> "SessionTable":
+    """One SessionTable per exchange and date range, shared by all the Markets that ask for it"""
+    key = (exchange, start.date() if start else None, end.date() if end else None)
+    if key not in _session_tables:
+        _session_tables[key] = SessionTable(calendar=get_calendar(exchange), start=start, end=end)
+    return _session_tables[key]
+
+
+class SessionTable:
+    """
+    Opens and closes of the sessions of a calendar, as nanoseconds since the epoch.
+    As for TradingCalendar.is_open_on_minute, a time is open if there is a session with open <= time <= close.
+    """
+    def __init__(
+        self,
+        calendar: tc.TradingCalendar,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+    ):
+        schedule: pd.DataFrame = calendar.schedule
+        mask = np.ones(len(schedule), dtype=bool)
+        if start is not None:
+            mask &= (schedule.market_close >= pd.Timestamp(start) - _MARGIN).values
+        if end is not None:
+            mask &= (schedule.market_open <= pd.Timestamp(end) + _MARGIN).values
+        self.opens: np.ndarray = schedule.market_open[mask].values.astype("datetime64[ns]").astype(np.int64)
+        self.closes: np.ndarray = schedule.market_close[mask].values.astype("datetime64[ns]").astype(np.int64)
+        # bisect on lists of python ints is faster than np.searchsorted on a single value
+        self._opens: List[int] = self.opens.tolist()
+        self._closes: List[int] = self.closes.tolist()
+
+    def is_open(self, time: datetime.datetime) -> bool:
+        t: int = to_ns(time)
+        ix: int = bisect.bisect_right(self._opens, t) - 1
+        return ix >= 0 and t <= self._closes[ix]
+
+    def next_open(self, time: datetime.datetime) -> Optional[datetime.datetime]:
+        """Open of the first session opening at or after time"""
+        ix: int = bisect.bisect_left(self._opens, to_ns(time))
+        return from_ns(self._opens[ix]) if ix < len(self._opens) else None
@@ -0,0 +1,246 @@
+"""
+Split one long backtest in time into session-aligned shards and run them in parallel, one Backtester per shard,
+over a pool of worker processes.
+
+This only gives the results of a single run for strategies that carry nothing from one session to the next.
+That is the boundary contract: at the end of every shard but the last, the strategy is flat and has no working
+order. It's verified on the results of every shard before they are merged. Every shard starts with a fresh
+strategy and fresh markets, whose best quotes are unknown until the first bid/ask tick of the shard.
+"""
+import concurrent.futures
+import datetime
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import ib_insync as ibi
+import numpy as np
+
+from simplebt import sweep
+from simplebt.backtester import Backtester
+from simplebt.events.generic import Event
+from simplebt.events.market import FillEvent
+from simplebt.position import Portfolio, Position
+from simplebt.sessions import get_session_table
+from simplebt.trade import StrategyTrade
+from simplebt.utils import from_ns, to_ns
+from simplebt.workers import init_worker, worker_db_connection
+
+logger = logging.getLogger("Shards")
+
+# Backtester parameters that hold per-process resources or would need the whole history of a single process
+_UNSHARDABLE_KWARGS: Tuple[str, ...] = (
+    "db_connection", "db_pool", "results_sink", "history_limit", "checkpoint_path", "checkpoint_every",
+)
+
+
+class ShardBoundaryError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ShardResult:
+    index: int
+    start_time: datetime.datetime
+    end_time: datetime.datetime
+    history: List[Event]
+    positions: List[Position]
+    pending_trades: List[StrategyTrade]
+
+
+@dataclass(frozen=True)
+class ShardedRun:
+    """
+    :param history: the histories of the shards one after the other, as a single run would return it
+    :param portfolio: positions replayed from the fills of history
+    """
+    history: List[Event]
+    portfolio: Portfolio
+    shards: List[ShardResult]
+
+
+BoundaryCheck = Callable[[ShardResult], None]
+
+
+def verify_flat(shard: ShardResult):
+    """The boundary contract "flat at session close": no position and no working order left at the end of the shard"""
+    open_positions: Dict[str, int] = {
+        f"{p.contract.symbol} {p.contract.conId}": p.position for p in shard.positions if p.position != 0
+    }
+    if open_positions:
+        raise ShardBoundaryError(f"Shard {shard.index} ends at {shard.end_time} with open positions {open_positions}")
+    if shard.pending_trades:
+        raise ShardBoundaryError(
+            f"Shard {shard.index} ends at {shard.end_time} with {len(shard.pending_trades)} working orders"
+        )
+
+
+def _session_boundaries(
+    contracts: List[ibi.Contract],
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    time_step: datetime.timedelta,
+) -> List[datetime.datetime]:
+    """
+    Times on the clock grid, strictly inside (start_time, end_time], at which the markets of all the contracts
+    are closed, one per break between sessions: the first time on the grid after a close
+    """
+    opens: List[np.ndarray] = []
+    closes: List[np.ndarray] = []
+    for exchange in {c.exchange for c in contracts}:
+        sessions = get_session_table(exchange=exchange, start=start_time, end=end_time)
+        opens.append(sessions.opens)
+        closes.append(sessions.closes)
+    order: np.ndarray = np.argsort(np.concatenate(opens), kind="stable")
+    all_opens: np.ndarray = np.concatenate(opens)[order]
+    all_closes: np.ndarray = np.concatenate(closes)[order]
+
+    start, end = to_ns(start_time), to_ns(end_time)
+    step: int = time_step // datetime.timedelta(microseconds=1) * 1000
+
+    def first_after(close: int) -> int:
+        # is_open() includes the close: the boundary is the first time on the grid strictly after it
+        return start + ((close - start) // step + 1) * step
+
+    boundaries: List[datetime.datetime] = []
+    # Sessions overlapping each other across exchanges are merged: only the closes after which nothing is open count
+    last_close: Optional[int] = None
+    for session_open, session_close in zip(all_opens.tolist(), all_closes.tolist()):
+        if last_close is not None and session_open > last_close:
+            boundary: int = first_after(last_close)
+            if start < boundary <= end and boundary < session_open:
+                boundaries.append(from_ns(boundary))
+        last_close = session_close if last_close is None else max(last_close, session_close)
+    if last_close is not None and start < first_after(last_close) <= end:
+        boundaries.append(from_ns(first_after(last_close)))
+    return boundaries
+
+
+def split_sessions(
+    contracts: List[ibi.Contract],
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    time_step: datetime.timedelta,
+    shards: int,
+) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Split [start_time, end_time] into at most shards consecutive ranges of about as many sessions each, cut while
+    all the markets are closed. Every range starts on the clock grid of start_time and ends one time_step before
+    the next one starts, the last one at end_time.
+    """
+    boundaries: List[datetime.datetime] = _session_boundaries(
+        contracts=contracts, start_time=start_time, end_time=end_time, time_step=time_step
+    )
+    n: int = min(shards, len(boundaries) + 1)
+    cuts: List[datetime.datetime] = [boundaries[round(i * (len(boundaries) + 1) / n) - 1] for i in range(1, n)]
+    starts: List[datetime.datetime] = [start_time] + cuts
+    ends: List[datetime.datetime] = [t - time_step for t in cuts] + [end_time]
+    return list(zip(starts, ends))
+
+
+def _run_shard(
+    index: int,
+    strategy_factory: sweep.StrategyFactory,
+    params: Dict[str, Any],
+    contracts: List[ibi.Contract],
+    run_start_time: datetime.datetime,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    time_step: datetime.timedelta,
+    backtester_kwargs: Dict[str, Any],
+) -> ShardResult:
+    # Keep beating on the heartbeats of the whole run rather than restarting them at the start of the shard
+    backtester_kwargs = {"heartbeat_origin": run_start_time, **backtester_kwargs}
+    bt = Backtester(
+        contracts=contracts,
+        start_time=start_time,
+        end_time=end_time,
+        time_step=time_step,
+        db_connection=worker_db_connection(),
+        **backtester_kwargs,
+    )
+    bt.set_strat(strategy_factory(bt, **params))
+    history: List[Event] = bt.run()
+    return ShardResult(
+        index=index,
+        start_time=start_time,
+        end_time=end_time,
+        history=history,
+        positions=bt.positions(),
+        pending_trades=[t for mkt in bt.mkts.values() for t in mkt.get_state().pending_trades],
+    )
+
+
+def merge_shards(contracts: List[ibi.Contract], shards: List[ShardResult]) -> ShardedRun:
+    """Histories are concatenated in the order of the shards and the fills replayed, so the merge is deterministic"""
+    shards = sorted(shards, key=lambda s: s.index)
+    history: List[Event] = [e for s in shards for e in s.history]
+    portfolio = Portfolio(contracts)
+    for event in history:
+        if isinstance(event, FillEvent):
+            portfolio.update(con_id=event.trade.order.contract.conId, fill=event.fill)
+    return ShardedRun(history=history, portfolio=portfolio, shards=shards)
+
+
+def run_sharded(
+    strategy_factory: sweep.StrategyFactory,
+    contracts: List[ibi.Contract],
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    time_step: datetime.timedelta = datetime.timedelta(seconds=1),
+    shards: Optional[int] = None,
+    workers: Optional[int] = None,
+    params: Optional[Dict[str, Any]] = None,
+    boundary_check: Optional[BoundaryCheck] = verify_flat,
+    **backtester_kwargs,
+) -> ShardedRun:
+    """
+    Backtest strategy_factory(backtester, **params) from start_time to end_time, one shard of sessions per job
+    :param shards: Number of shards. Defaults to the number of workers, or of CPUs.
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :param boundary_check: Called with the results of every shard but the last, raises a ShardBoundaryError
+    if the state left at its end would have changed the next shard. None skips the checks.
+    :param backtester_kwargs: Passed on to every Backtester (e.g. event_driven, tick_cache_dir)
+    """
+    unshardable: List[str] = [k for k in _UNSHARDABLE_KWARGS if backtester_kwargs.get(k) is not None]
+    if unshardable:
+        raise ValueError(f"Sharded runs don't support the Backtester parameters {unshardable}")
+    if shards is None:
+        shards = workers or os.cpu_count() or 1
+    ranges: List[Tuple[datetime.datetime, datetime.datetime]] = split_sessions(
+        contracts=contracts, start_time=start_time, end_time=end_time, time_step=time_step, shards=shards
+    )
+    logger.info(f"Running {len(ranges)} shards: {ranges}")
+
+    open_db_connection: bool = backtester_kwargs.get("tick_cache_dir") is None
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(open_db_connection,)
+    ) as executor:
+        futures = [
+            executor.submit(
+                _run_shard,
+                index,
+                strategy_factory,
+                params or {},
+                contracts,
+                start_time,
+                shard_start,
+                shard_end,
+                time_step,
+                backtester_kwargs,
+            )
+            for index, (shard_start, shard_end) in enumerate(ranges)
+        ]
+        try:
+            results: List[ShardResult] = [f.result() for f in futures]
+        except BaseException:
+            # Drop the shards not started yet. shutdown(cancel_futures=True) would do it, but only from Python 3.9
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            raise
+
+    if boundary_check is not None:
+        for shard in results[:-1]:
+            boundary_check(shard)
+    return merge_shards(contracts=contracts, shards=results)
@@ -1,7 +1,11 @@
 import abc
 import datetime
-from typing import List
+from typing import Any, ClassVar, List, Optional, Tuple, Type
 
+from simplebt.events.generic import Event
+from simplebt.events.market import FillEvent, PendingTickersEvent, PnLSingleEvent
+from simplebt.events.orders import OrderCanceledEvent, OrderReceivedEvent
+from simplebt.orders import OrderIntent
 from simplebt.ticker import Ticker
 from simplebt.trade import StrategyTrade, Fill
 from simplebt.position import PnLSingle
@@ -11,7 +15,16 @@ class StrategyInterface(abc.ABC):
     """
     This class defines the architecture of the Strategy.
     This class will have a concrete form for every different Strategy we want to write.
+    Narrow event_subscriptions to the event types the strategy uses: the others are not even computed
+    if nobody else subscribes to them (e.g. PnLSingleEvent).
     """
+    event_subscriptions: ClassVar[Tuple[Type[Event], ...]] = (
+        PendingTickersEvent,
+        OrderReceivedEvent,
+        OrderCanceledEvent,
+        FillEvent,
+        PnLSingleEvent,
+    )
 
     @abc.abstractmethod
     def set_time(self, time: datetime.datetime):
@@ -32,3 +45,41 @@ class StrategyInterface(abc.ABC):
     @abc.abstractmethod
     def on_pnl_single_event(self, pnl: PnLSingle):
         raise NotImplementedError
+
+    def get_state(self) -> Any:
+        """
+        Override to have the state of the strategy saved in the Backtester checkpoints. It's pickled together
+        with the pending trades, so references to the same trades are preserved
+        """
+        return None
+
+    def set_state(self, state: Any):
+        """Override to restore the state returned by get_state() when a Backtester resumes from a checkpoint"""
+        pass
+
+
+class BatchStrategyInterface(abc.ABC):
+    """
+    Strategies working on arrays rather than on events. Instead of the per-step callbacks, they get the ticks of
+    a whole window at once, every window of backtest time (a multiple of time_step, e.g. the bar size in bar replay
+    mode). The orders they return are sent in bulk, at the end of the window.
+    Fills and positions can still be read from the Backtester, or subscribed to with Backtester.subscribe().
+    A window still open at end_time is dropped.
+    """
+    window: ClassVar[datetime.timedelta] = datetime.timedelta(minutes=1)
+
+    @abc.abstractmethod
+    def on_ticks_window(self, time: datetime.datetime, tickers: List[Ticker]) -> Optional[List[OrderIntent]]:
+        """
+        :param time: end of the window, the window being (time - window, time]
+        :param tickers: one Ticker per contract with ticks in the window, its batches holding all of them
+        :return: the orders to send
+        """
+        raise NotImplementedError
+
+    def get_state(self) -> Any:
+        """See StrategyInterface.get_state()"""
+        return None
+
+    def set_state(self, state: Any):
+        pass
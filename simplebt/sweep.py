@@ -0,0 +1,136 @@
+"""
+Run a grid of strategy parameterizations in parallel, one Backtester per job, over a pool of worker processes.
+Workers are reused across jobs and each of them keeps a single database connection (see workers)
+and the calendars it loaded for all the runs it executes.
+"""
+import concurrent.futures
+import datetime
+import itertools
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+import ib_insync as ibi
+
+from simplebt.backtester import Backtester
+from simplebt.events.generic import Event
+from simplebt.strategy import StrategyInterface
+from simplebt.workers import init_worker, worker_db_connection
+
+logger = logging.getLogger("Sweep")
+
+# Called as strategy_factory(backtester, **params). Must be picklable, i.e. defined at module level
+StrategyFactory = Callable[..., StrategyInterface]
+Summarizer = Callable[[Backtester, List[Event]], Any]
+
+
+@dataclass(frozen=True)
+class SweepResult:
+    params: Dict[str, Any]
+    result: Any
+
+
+def expand_grid(param_grid: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """{"a": [1, 2], "b": [3]} -> [{"a": 1, "b": 3}, {"a": 2, "b": 3}]"""
+    keys = list(param_grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(param_grid[k] for k in keys))]
+
+
+def _run_job(
+    strategy_factory: StrategyFactory,
+    params: Dict[str, Any],
+    contracts: List[ibi.Contract],
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    time_step: datetime.timedelta,
+    summarize: Optional[Summarizer],
+    backtester_kwargs: Dict[str, Any],
+) -> SweepResult:
+    bt = Backtester(
+        contracts=contracts,
+        start_time=start_time,
+        end_time=end_time,
+        time_step=time_step,
+        db_connection=worker_db_connection(),
+        **backtester_kwargs,
+    )
+    bt.set_strat(strategy_factory(bt, **params))
+    history: List[Event] = bt.run()
+    return SweepResult(params=params, result=summarize(bt, history) if summarize else history)
+
+
+def run_sweep(
+    strategy_factory: StrategyFactory,
+    param_grid: Dict[str, Sequence[Any]],
+    contracts: List[ibi.Contract],
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    time_step: datetime.timedelta = datetime.timedelta(seconds=1),
+    workers: Optional[int] = None,
+    summarize: Optional[Summarizer] = None,
+    **backtester_kwargs,
+) -> Iterator[SweepResult]:
+    """
+    Backtest strategy_factory(backtester, **params) for every combination of parameters in param_grid.
+    Results are yielded as soon as each run completes, so in completion order, not in grid order.
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :param summarize: Called in the worker as summarize(backtester, history). Its return value is sent back
+    instead of the whole event history, which is cheaper to pickle.
+    :param backtester_kwargs: Passed on to every Backtester (e.g. event_driven, tick_cache_dir)
+    """
+    if "db_connection" in backtester_kwargs:
+        raise ValueError("Sweep workers open their own database connection: db_connection can't be passed on")
+    # Checked on the call rather than on the first iteration: the runs are in a generator
+    return _run_sweep_jobs(
+        strategy_factory=strategy_factory,
+        jobs=expand_grid(param_grid),
+        contracts=contracts,
+        start_time=start_time,
+        end_time=end_time,
+        time_step=time_step,
+        workers=workers,
+        summarize=summarize,
+        backtester_kwargs=backtester_kwargs,
+    )
+
+
+def _run_sweep_jobs(
+    strategy_factory: StrategyFactory,
+    jobs: List[Dict[str, Any]],
+    contracts: List[ibi.Contract],
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    time_step: datetime.timedelta,
+    workers: Optional[int],
+    summarize: Optional[Summarizer],
+    backtester_kwargs: Dict[str, Any],
+) -> Iterator[SweepResult]:
+    open_db_connection: bool = backtester_kwargs.get("tick_cache_dir") is None
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(open_db_connection,)
+    )
+    futures: List[concurrent.futures.Future] = []
+    try:
+        futures = [
+            executor.submit(
+                _run_job,
+                strategy_factory,
+                params,
+                contracts,
+                start_time,
+                end_time,
+                time_step,
+                summarize,
+                backtester_kwargs,
+            )
+            for params in jobs
+        ]
+        for n, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            result: SweepResult = future.result()
+            logger.info(f"Sweep {n}/{len(jobs)} done: {result.params}")
+            yield result
+    finally:
+        # Also reached when the caller stops iterating early or a run fails: drop the jobs not started yet.
+        # shutdown(cancel_futures=True) would do it, but only from Python 3.9
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
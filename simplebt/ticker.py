@@ -1,7 +1,12 @@
+import abc
 import datetime
+import functools
 import ib_insync as ibi
+import numpy as np
 from dataclasses import dataclass
-from typing import Union, List
+from typing import ClassVar, Dict, Iterable, Iterator, List, Optional, Union, overload
+
+from simplebt.utils import from_ns
 
 
 @dataclass(frozen=True)
@@ -20,7 +25,188 @@ class TickByTickBidAsk:
     ask_size: int
 
 
+@dataclass(frozen=True)
+class Bar:
+    """time is the open time of the bar, as the date of IB's BarData"""
+    time: datetime.datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: int
+    average: float
+    bar_count: int
+
+
+class TickBatch(abc.ABC):
+    """
+    A batch of ticks stored column-wise: one numpy array per field, time in nanoseconds since the epoch.
+    Slicing returns a batch of views on the same arrays. Indexing and iterating build the per-tick dataclasses
+    on demand, so code written against lists of ticks keeps working.
+    """
+    dtypes: ClassVar[Dict[str, np.dtype]]
+
+    __slots__ = ("_columns",)
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self._columns: Dict[str, np.ndarray] = columns
+
+    @classmethod
+    def empty(cls) -> "TickBatch":
+        return cls({c: np.empty(0, dtype=dtype) for c, dtype in cls.dtypes.items()})
+
+    @classmethod
+    def concat(cls, batches: Iterable["TickBatch"]) -> "TickBatch":
+        batches = list(batches)
+        if len(batches) == 1:
+            return batches[0]
+        if not batches:
+            return cls.empty()
+        return cls({c: np.concatenate([b.columns[c] for b in batches]) for c in cls.dtypes})
+
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        return self._columns
+
+    @property
+    def time(self) -> np.ndarray:
+        return self._columns["time"]
+
+    def __len__(self) -> int:
+        return len(self._columns["time"])
+
+    @overload
+    def __getitem__(self, ix: int) -> Union[TickByTickAllLast, TickByTickBidAsk]: ...
+
+    @overload
+    def __getitem__(self, ix: slice) -> "TickBatch": ...
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            return type(self)({c: a[ix] for c, a in self._columns.items()})
+        return self._make_tick(*(self._columns[c][ix].item() for c in self.dtypes))
+
+    def __iter__(self) -> Iterator[Union[TickByTickAllLast, TickByTickBidAsk]]:
+        for values in zip(*(self._columns[c].tolist() for c in self.dtypes)):
+            yield self._make_tick(*values)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(n={len(self)})"
+
+    @abc.abstractmethod
+    def _make_tick(self, *values) -> Union[TickByTickAllLast, TickByTickBidAsk]:
+        """Build a tick from one value per column, in the order of dtypes"""
+        raise NotImplementedError
+
+
+class AllLastTickBatch(TickBatch):
+    dtypes = {
+        "time": np.dtype(np.int64),
+        "price": np.dtype(np.float64),
+        "size": np.dtype(np.int64),
+    }
+
+    __slots__ = ()
+
+    @property
+    def price(self) -> np.ndarray:
+        return self._columns["price"]
+
+    @property
+    def size(self) -> np.ndarray:
+        return self._columns["size"]
+
+    def _make_tick(self, time: int, price: float, size: int) -> TickByTickAllLast:
+        return TickByTickAllLast(time=from_ns(time), price=price, size=size)
+
+
+class BidAskTickBatch(TickBatch):
+    dtypes = {
+        "time": np.dtype(np.int64),
+        "bid": np.dtype(np.float64),
+        "ask": np.dtype(np.float64),
+        "bid_size": np.dtype(np.int64),
+        "ask_size": np.dtype(np.int64),
+    }
+
+    __slots__ = ()
+
+    @property
+    def bid(self) -> np.ndarray:
+        return self._columns["bid"]
+
+    @property
+    def ask(self) -> np.ndarray:
+        return self._columns["ask"]
+
+    @property
+    def bid_size(self) -> np.ndarray:
+        return self._columns["bid_size"]
+
+    @property
+    def ask_size(self) -> np.ndarray:
+        return self._columns["ask_size"]
+
+    def _make_tick(self, time: int, bid: float, ask: float, bid_size: int, ask_size: int) -> TickByTickBidAsk:
+        return TickByTickBidAsk(time=from_ns(time), bid=bid, bid_size=bid_size, ask=ask, ask_size=ask_size)
+
+
+class BarBatch(TickBatch):
+    """Bars stored column-wise, as read back from the DbBars tables. time is the open time of each bar"""
+    dtypes = {
+        "time": np.dtype(np.int64),
+        "open": np.dtype(np.float64),
+        "high": np.dtype(np.float64),
+        "low": np.dtype(np.float64),
+        "close": np.dtype(np.float64),
+        "volume": np.dtype(np.int64),
+        "average": np.dtype(np.float64),
+        "bar_count": np.dtype(np.int64),
+    }
+
+    __slots__ = ()
+
+    @property
+    def open(self) -> np.ndarray:
+        return self._columns["open"]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self._columns["high"]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self._columns["low"]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self._columns["close"]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self._columns["volume"]
+
+    def _make_tick(
+        self, time: int, open: float, high: float, low: float, close: float, volume: int, average: float, bar_count: int
+    ) -> Bar:
+        return Bar(
+            time=from_ns(time), open=open, high=high, low=low, close=close, volume=volume, average=average, bar_count=bar_count
+        )
+
+
 @dataclass(frozen=True)
 class Ticker:
+    """
+    In bar replay mode, bars and bidask_bars hold the TRADES and BID_ASK bars that just closed,
+    and trades and bidasks the ticks the Market derives from them.
+    """
     contract: ibi.Contract
-    tickByTicks: List[Union[TickByTickAllLast, TickByTickBidAsk]]
+    trades: AllLastTickBatch
+    bidasks: BidAskTickBatch
+    bars: Optional[BarBatch] = None
+    bidask_bars: Optional[BarBatch] = None
+
+    @functools.cached_property
+    def tickByTicks(self) -> List[Union[TickByTickAllLast, TickByTickBidAsk]]:
+        """Per-tick objects, trades first, for strategies not reading the arrays. Built on first access only"""
+        return list(self.trades) + list(self.bidasks)
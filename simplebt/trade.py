@@ -1,7 +1,8 @@
 import datetime
-from typing import List
+from typing import List, Optional
 from dataclasses import dataclass
 from simplebt.orders import Order, OrderAction
+from simplebt.ticker import TickByTickBidAsk
 
 
 @dataclass(frozen=True)
@@ -13,8 +14,10 @@ class Fill:
 
 
 class StrategyTrade:
-    def __init__(self, order: Order):
+    def __init__(self, order: Order, arrival: Optional[TickByTickBidAsk] = None):
+        """:param arrival: the best bid and ask when the order reached the market, to measure slippage"""
         self._time = order.time
+        self._arrival: Optional[TickByTickBidAsk] = arrival
         self._fills: List[Fill] = []
         self._order: Order = order  # IBKR returns the order associated with the trade
         self._filled_lots: int = 0
@@ -23,6 +26,10 @@ class StrategyTrade:
     def time(self) -> datetime.datetime:
         return self._time
 
+    @property
+    def arrival(self) -> Optional[TickByTickBidAsk]:
+        return self._arrival
+
     @property
     def fills(self) -> List[Fill]:
         return self._fills
@@ -43,6 +50,10 @@ class StrategyTrade:
         if self._filled_lots > self._order.lots:
             raise ValueError
 
+    @property
+    def remaining_lots(self) -> int:
+        return self._order.lots - self._filled_lots
+
     @property
     def filled(self) -> bool:
         if self._filled_lots == self._order.lots:
@@ -1,3 +1,3 @@
-from ._utils import to_utc  # , is_prev_row_diff, last_valid_ix_row, sign
+from ._utils import to_utc, to_ns, from_ns  # , is_prev_row_diff, last_valid_ix_row, sign
 
-__all__ = "to_utc"  # , "is_prev_row_diff", "last_valid_ix_row", "sign")
+__all__ = ("to_utc", "to_ns", "from_ns")  # , "is_prev_row_diff", "last_valid_ix_row", "sign")
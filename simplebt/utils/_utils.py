@@ -11,6 +11,20 @@ def to_utc(t: datetime.datetime) -> datetime.datetime:
         raise e
 
 
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def to_ns(t: datetime.datetime) -> int:
+    """Nanoseconds since the epoch of a timezone-aware datetime. Exact, unlike going through t.timestamp()"""
+    delta = t - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def from_ns(ns: int) -> datetime.datetime:
+    """UTC datetime from nanoseconds since the epoch, truncated to microseconds"""
+    return _EPOCH + datetime.timedelta(microseconds=int(ns) // 1000)
+
+
 def is_prev_row_diff(s: pd.Series):
     s_1 = s.shift(1).copy(deep=True)
     diff = s != s_1
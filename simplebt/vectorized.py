@@ -0,0 +1,262 @@
+"""
+Research fast path: the fills and PnL of a target position signal, computed with numpy over the bid/ask ticks,
+without the event loop of the Backtester. Cheap enough to screen thousands of signals before backtesting
+the survivors with the full engine.
+
+The semantics are those of a strategy sending market orders for the change of its target, at the clock of
+a Backtester whose time_step is the resolution of the ticks:
+- the target is read at the last tick of every timestamp, and a change sends a market order of the difference
+- as in Market._exec_mkt_order, the order is filled from the first quote of a later timestamp with a price and
+  a size on its side, while the market is open: buys at the ask, sells at the bid. Each quote fills at most the
+  size it shows, the rest of the order waits for the next quotes. Orders don't share the size of a quote
+- positions, average costs and realized PnL follow Position, unrealized PnL marks longs at the bid, shorts at the ask
+"""
+import datetime
+import pathlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+import ib_insync as ibi
+import numpy as np
+
+from simplebt.db import DbPool, DbTicks
+from simplebt.historical_data.load.cache import CACHE_COLUMNS, DAY_FORMAT, get_cache_table_dir
+from simplebt.historical_data.utils.cache import select_ticks_day
+from simplebt.position import apply_fill, calc_unrealized_pnls, get_multiplier
+from simplebt.sessions import SessionTable, get_session_table
+from simplebt.utils import from_ns, to_ns
+
+QUOTE_DTYPES: Dict[str, np.dtype] = CACHE_COLUMNS["BID_ASK"]
+FILL_DTYPES: Dict[str, np.dtype] = {
+    "time": np.dtype(np.int64),
+    # Index of the quote the fill happened at, and of the tick the target changed at
+    "tick": np.dtype(np.int64),
+    "signal_tick": np.dtype(np.int64),
+    "lots": np.dtype(np.int64),
+    "price": np.dtype(np.float64),
+    "avg_cost": np.dtype(np.float64),
+    "realized_pnl": np.dtype(np.float64),
+}
+
+
+@dataclass(frozen=True)
+class SignalRun:
+    """
+    fills: one array per column of FILL_DTYPES, in order of execution. lots are signed: positive for buys.
+    An order bigger than the size at the touch has a fill per quote it took.
+    avg_cost and realized_pnl are those of the position after the fill.
+    The other arrays are aligned on the quotes, as of after the fills at each quote.
+    """
+    fills: Dict[str, np.ndarray]
+    position: np.ndarray
+    avg_cost: np.ndarray
+    realized_pnl: np.ndarray
+    unrealized_pnl: np.ndarray
+
+    @property
+    def pnl(self) -> np.ndarray:
+        return self.realized_pnl + self.unrealized_pnl
+
+
+def load_quotes(
+    contract: ibi.Contract,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    cache_dir: Optional[pathlib.Path] = None,
+    db_connection=None,
+    pool: Optional[DbPool] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    The bid/ask ticks of contract in [start_time, end_time), one array per column of QUOTE_DTYPES
+    :param cache_dir: Read them from the local columnar cache instead of the DbTicks table.
+    """
+    db: Optional[DbTicks] = None
+    if cache_dir is None:
+        db = DbTicks(contract=contract, tick_type="BID_ASK", db_connection=db_connection, pool=pool)
+    days: List[Dict[str, np.ndarray]] = []
+    day: datetime.date = start_time.astimezone(datetime.timezone.utc).date()
+    while day <= end_time.astimezone(datetime.timezone.utc).date():
+        if db is not None:
+            days.append(select_ticks_day(db=db, tick_type="BID_ASK", day=day))
+        else:
+            table_dir = get_cache_table_dir(contract=contract, tick_type="BID_ASK", cache_dir=cache_dir)
+            day_dir = table_dir / day.strftime(DAY_FORMAT)
+            if day_dir.exists():
+                days.append({c: np.load(day_dir / f"{c}.npy") for c in QUOTE_DTYPES})
+        day += datetime.timedelta(days=1)
+    if db is not None:
+        db.close()
+    quotes: Dict[str, np.ndarray] = {
+        c: np.concatenate([d[c] for d in days]) if days else np.empty(0, dtype=dtype) for c, dtype in QUOTE_DTYPES.items()
+    }
+    i, j = np.searchsorted(quotes["time"], [to_ns(start_time), to_ns(end_time)], side="left")
+    return {c: a[i:j] for c, a in quotes.items()}
+
+
+def _fill_side(valid: np.ndarray, size: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The indices of the quotes an order of one side can fill at, and the total size shown up to each: 0 first"""
+    ticks: np.ndarray = np.flatnonzero(valid)
+    depth: np.ndarray = np.zeros(len(ticks) + 1, dtype=np.int64)
+    np.cumsum(size[ticks], out=depth[1:])
+    return ticks, depth
+
+
+def _fill_orders(
+    ticks: np.ndarray, depth: np.ndarray, start_ticks: np.ndarray, lots: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fills of orders of one side, each taking the size of the quotes from start_ticks on until its lots are filled
+    :param ticks: with depth, from _fill_side()
+    :param lots: unsigned
+    :return: for every fill, the index of its order, of its quote, and its lots. Grouped by order.
+    """
+    first: np.ndarray = np.searchsorted(ticks, start_ticks, side="left")
+    taken: np.ndarray = depth[first]  # size of the quotes before the order, as if another order had taken it
+    # The quote that completes the order, len(ticks) if the quotes end first
+    last: np.ndarray = np.searchsorted(depth, taken + lots, side="left") - 1
+    counts: np.ndarray = last - first + (last < len(ticks))
+    orders: np.ndarray = np.repeat(np.arange(len(first)), counts)
+    quotes: np.ndarray = np.arange(len(orders)) - np.repeat(np.cumsum(counts) - counts, counts) + first[orders]
+    fill_lots: np.ndarray = np.minimum(depth[quotes + 1], (taken + lots)[orders]) - depth[quotes]
+    return orders, ticks[quotes], fill_lots
+
+
+def session_mask(contract: ibi.Contract, times: np.ndarray) -> np.ndarray:
+    """Whether the market of contract is open at each time, in nanoseconds, as SessionTable.is_open() says"""
+    if len(times) == 0:
+        return np.zeros(0, dtype=bool)
+    sessions: SessionTable = get_session_table(exchange=contract.exchange, start=from_ns(times[0]), end=from_ns(times[-1]))
+    ix: np.ndarray = np.searchsorted(sessions.opens, times, side="right") - 1
+    return (ix >= 0) & (times <= sessions.closes[np.maximum(ix, 0)])
+
+
+@dataclass(frozen=True)
+class PreparedQuotes:
+    """
+    What backtest_signal() needs from the quotes whatever the signal, to compute once for many signals
+    :param last_ticks: index of the last tick of every timestamp
+    :param buy_ticks: index of the quotes a buy can fill at
+    :param buy_depth: the ask size shown by the buy_ticks before each of them, and in total at the end
+    :param sell_ticks: with sell_depth, the same for sells and the bid size
+    """
+    contract: ibi.Contract
+    quotes: Dict[str, np.ndarray]
+    last_ticks: np.ndarray
+    buy_ticks: np.ndarray
+    buy_depth: np.ndarray
+    sell_ticks: np.ndarray
+    sell_depth: np.ndarray
+
+
+def prepare_quotes(contract: ibi.Contract, quotes: Dict[str, np.ndarray], check_sessions: bool = True) -> PreparedQuotes:
+    """
+    :param quotes: bid/ask ticks sorted by time, e.g. from load_quotes()
+    :param check_sessions: Only fill while the market is open, as Market does. Pass False to fill at any quote.
+    """
+    times: np.ndarray = quotes["time"]
+    n: int = len(times)
+    is_last: np.ndarray = np.empty(n, dtype=bool)
+    np.not_equal(times[1:], times[:-1], out=is_last[:-1])
+    is_last[-1:] = True
+    is_open: np.ndarray = session_mask(contract=contract, times=times) if check_sessions else np.ones(n, dtype=bool)
+    buy_valid: np.ndarray = (quotes["ask"] != 0) & (quotes["ask_size"] > 0) & is_open
+    sell_valid: np.ndarray = (quotes["bid"] != 0) & (quotes["bid_size"] > 0) & is_open
+    buy_ticks, buy_depth = _fill_side(valid=buy_valid, size=quotes["ask_size"])
+    sell_ticks, sell_depth = _fill_side(valid=sell_valid, size=quotes["bid_size"])
+    return PreparedQuotes(
+        contract=contract,
+        quotes=quotes,
+        last_ticks=np.flatnonzero(is_last),
+        buy_ticks=buy_ticks,
+        buy_depth=buy_depth,
+        sell_ticks=sell_ticks,
+        sell_depth=sell_depth,
+    )
+
+
+def backtest_signal(
+    contract: ibi.Contract,
+    target: np.ndarray,
+    quotes: Union[Dict[str, np.ndarray], PreparedQuotes],
+    check_sessions: bool = True,
+) -> SignalRun:
+    """
+    :param target: the position wanted after each quote, in lots
+    :param quotes: bid/ask ticks sorted by time, e.g. from load_quotes(), or the PreparedQuotes of contract
+    to screen many signals over the same quotes
+    :param check_sessions: Only fill while the market is open, as Market does. Pass False to fill at any quote.
+    Ignored for PreparedQuotes.
+    """
+    if not isinstance(quotes, PreparedQuotes):
+        quotes = prepare_quotes(contract=contract, quotes=quotes, check_sessions=check_sessions)
+    elif quotes.contract.conId != contract.conId:
+        raise ValueError(f"Quotes prepared for {quotes.contract.symbol} {quotes.contract.conId}, not {contract.conId}")
+    times: np.ndarray = quotes.quotes["time"]
+    bid, ask = quotes.quotes["bid"], quotes.quotes["ask"]
+    n: int = len(times)
+    target = np.asarray(target, dtype=np.int64)
+    if len(target) != n:
+        raise ValueError(f"target should have one value per quote: got {len(target)} for {n} quotes")
+
+    # Orders: the change of the target between the last ticks of consecutive timestamps
+    decided: np.ndarray = target[quotes.last_ticks]
+    delta: np.ndarray = np.diff(decided, prepend=0)
+    changed: np.ndarray = np.flatnonzero(delta)
+    signal_ticks: np.ndarray = quotes.last_ticks[changed]
+    order_lots: np.ndarray = delta[changed]
+
+    # Fills: from the first quote after the timestamp of the order with a price and a size on its side,
+    # as much as each quote shows until the order is filled
+    buys: np.ndarray = np.flatnonzero(order_lots > 0)
+    sells: np.ndarray = np.flatnonzero(order_lots < 0)
+    buy_orders, buy_ticks, buy_lots = _fill_orders(
+        ticks=quotes.buy_ticks, depth=quotes.buy_depth, start_ticks=signal_ticks[buys] + 1, lots=order_lots[buys]
+    )
+    sell_orders, sell_ticks, sell_lots = _fill_orders(
+        ticks=quotes.sell_ticks, depth=quotes.sell_depth, start_ticks=signal_ticks[sells] + 1, lots=-order_lots[sells]
+    )
+    fill_orders: np.ndarray = np.concatenate([buys[buy_orders], sells[sell_orders]])
+    fill_ticks: np.ndarray = np.concatenate([buy_ticks, sell_ticks])
+    fill_lots: np.ndarray = np.concatenate([buy_lots, -sell_lots])
+    # Orders filled at the same quote go in order of arrival, as in the pending orders book
+    order: np.ndarray = np.lexsort((fill_orders, fill_ticks))
+    fill_ticks, signal_ticks, fill_lots = fill_ticks[order], signal_ticks[fill_orders[order]], fill_lots[order]
+    prices: np.ndarray = np.where(fill_lots > 0, ask[fill_ticks], bid[fill_ticks])
+    fill_times: np.ndarray = times[fill_ticks]
+
+    # Average cost accounting depends on the path: the fills, far fewer than the ticks, go through the same
+    # arithmetic as Position
+    multiplier: float = get_multiplier(contract)
+    avg_costs: np.ndarray = np.empty(len(fill_ticks))
+    realized_pnls: np.ndarray = np.empty(len(fill_ticks))
+    pos, avg_cost, realized_pnl = 0, 0., 0.
+    for k, (lots, price) in enumerate(zip(fill_lots.tolist(), prices.tolist())):
+        pos, avg_cost, realized_pnl = apply_fill(
+            position=pos, avg_cost=avg_cost, realized_pnl=realized_pnl, lots=lots, price=price, multiplier=multiplier
+        )
+        avg_costs[k], realized_pnls[k] = avg_cost, realized_pnl
+
+    positions: np.ndarray = np.cumsum(np.bincount(fill_ticks, weights=fill_lots, minlength=n)).astype(np.int64)
+    # State after the last fill at or before every quote: forward fill the index of the last fill at each quote
+    last_fill: np.ndarray = np.full(n, -1, dtype=np.int64)
+    last_fill[fill_ticks] = np.arange(len(fill_ticks))  # fill_ticks is sorted: the last of equal ticks wins
+    np.maximum.accumulate(last_fill, out=last_fill)
+    has_filled: np.ndarray = last_fill >= 0
+    tick_avg_cost: np.ndarray = np.where(has_filled, avg_costs[last_fill] if len(avg_costs) else 0., 0.)
+    tick_realized: np.ndarray = np.where(has_filled, realized_pnls[last_fill] if len(realized_pnls) else 0., 0.)
+    return SignalRun(
+        fills={
+            "time": fill_times,
+            "tick": fill_ticks,
+            "signal_tick": signal_ticks,
+            "lots": fill_lots,
+            "price": prices,
+            "avg_cost": avg_costs,
+            "realized_pnl": realized_pnls,
+        },
+        position=positions,
+        avg_cost=tick_avg_cost,
+        realized_pnl=tick_realized,
+        unrealized_pnl=calc_unrealized_pnls(
+            bid=bid, ask=ask, position=positions, avg_cost=tick_avg_cost, multiplier=multiplier
+        ),
+    )
@@ -0,0 +1,22 @@
+"""
+State of the worker processes running backtests in parallel (see sweep and shards).
+Workers are reused across jobs and each of them keeps a single database connection for all the runs it executes.
+"""
+from simplebt.db import Db
+
+_db_connection = None
+
+
+def init_worker(open_db_connection: bool):
+    """
+    Initializer of the worker processes, e.g. ProcessPoolExecutor(initializer=init_worker, initargs=(True,))
+    :param open_db_connection: False when the runs don't query the database, e.g. they replay the ticks cache
+    """
+    global _db_connection
+    if open_db_connection:
+        _db_connection = Db.open_conn()
+
+
+def worker_db_connection():
+    """Connection opened by init_worker() in this process, None if it didn't open one"""
+    return _db_connection
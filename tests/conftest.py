@@ -0,0 +1,58 @@
+import datetime
+import pathlib
+from typing import Callable, List, Tuple
+import pytest
+from ib_insync import Contract
+from simplebt.backtester import Backtester
+from simplebt.benchmarks import CountingStrategy, SyntheticSession, synthetic_contracts, write_synthetic_cache
+from simplebt.events.generic import Event
+from simplebt.events.market import FillEvent
+
+# Two sessions of synthetic ticks, replayed from the columnar cache: no database needed
+DAYS: List[datetime.date] = [datetime.date(2021, 6, 1), datetime.date(2021, 6, 2)]
+SESSION = SyntheticSession(bidask_rate=0.5)
+# From the last hour of the first session to the first hour of the second one, across the overnight close
+START = datetime.datetime(2021, 6, 1, 19, tzinfo=datetime.timezone.utc)
+END = datetime.datetime(2021, 6, 2, 14, 30, tzinfo=datetime.timezone.utc)
+TIME_STEP = datetime.timedelta(seconds=1)
+
+
+@pytest.fixture(scope="session")
+def contracts() -> List[Contract]:
+    return synthetic_contracts(n=2)
+
+
+@pytest.fixture(scope="session")
+def cache_dir(tmp_path_factory, contracts: List[Contract]) -> pathlib.Path:
+    path: pathlib.Path = tmp_path_factory.mktemp("ticks_cache")
+    write_synthetic_cache(cache_dir=path, contracts=contracts, days=DAYS, seed=7, session=SESSION)
+    return path
+
+
+@pytest.fixture(scope="session")
+def run_backtest(cache_dir: pathlib.Path, contracts: List[Contract]) -> Callable[..., Tuple[Backtester, List[Event]]]:
+    """
+    run_backtest(**backtester_kwargs) -> (backtester, history) of a CountingStrategy run from START to END
+    :param restore: resume the run from its checkpoint_path
+    """
+    def run(end_time: datetime.datetime = END, restore: bool = False, **kwargs) -> Tuple[Backtester, List[Event]]:
+        bt = Backtester(
+            contracts=contracts, start_time=START, end_time=end_time, time_step=TIME_STEP, tick_cache_dir=cache_dir, **kwargs
+        )
+        bt.set_strat(CountingStrategy(bt, order_every=20))
+        if restore:
+            bt.restore()
+        return bt, bt.run()
+    return run
+
+
+def fills(history: List[Event]) -> List[Tuple[datetime.datetime, int, str, float, int]]:
+    """(time, conId, action, price, lots) of the fills of a history"""
+    return [
+        (e.time, e.trade.order.contract.conId, e.fill.order_action.name, e.fill.price, e.fill.lots)
+        for e in history if isinstance(e, FillEvent)
+    ]
+
+
+def positions(bt: Backtester) -> List[Tuple[int, float, float]]:
+    return [(p.position, p.avg_cost, p.realized_pnl) for p in bt.positions()]
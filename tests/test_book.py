@@ -0,0 +1,94 @@
+import datetime
+import pathlib
+from typing import List, Tuple
+import numpy as np
+from ib_insync import Contract
+from simplebt.book import PendingOrdersBook
+from simplebt.events.market import FillEvent
+from simplebt.market import Market
+from simplebt.orders import LmtOrder, MktOrder, Order, OrderAction
+from simplebt.ticker import BidAskTickBatch
+from simplebt.trade import StrategyTrade
+from simplebt.utils import to_ns
+
+START = datetime.datetime(2021, 6, 1, 14, tzinfo=datetime.timezone.utc)
+
+
+def _random_orders(contract: Contract, n: int, rng: np.random.Generator) -> List[Order]:
+    """Market and limit orders of up to 5 lots, limits within a few ticks of 4000"""
+    orders: List[Order] = []
+    for _ in range(n):
+        action = OrderAction.BUY if rng.random() < 0.5 else OrderAction.SELL
+        lots: int = int(rng.integers(1, 6))
+        if rng.random() < 0.2:
+            orders.append(MktOrder(contract=contract, action=action, lots=lots, time=START))
+        else:
+            price: float = 4000. + 0.25 * int(rng.integers(-8, 9))
+            orders.append(LmtOrder(contract=contract, action=action, lots=lots, price=price, time=START))
+    return orders
+
+
+def _random_quotes(n: int, rng: np.random.Generator) -> BidAskTickBatch:
+    """Bid/ask ticks of 1 to 3 lots, so that orders get partially filled"""
+    bid: np.ndarray = 4000. + np.cumsum(rng.choice(np.array([-0.25, 0., 0.25]), size=n))
+    return BidAskTickBatch({
+        "time": np.full(n, to_ns(START), dtype=np.int64),
+        "bid": bid,
+        "ask": bid + 0.25,
+        "bid_size": rng.integers(1, 4, size=n).astype(np.int64),
+        "ask_size": rng.integers(1, 4, size=n).astype(np.int64),
+    })
+
+
+def _baseline_fill_events(mkt: Market) -> List[FillEvent]:
+    """The matching loop before PendingOrdersBook: every pending trade is visited at every bid/ask tick"""
+    fill_events: List[FillEvent] = []
+    for best in mkt._change_bests:
+        for trade in list(mkt._pending_orders):
+            trade, fill = mkt._process_order(trade=trade, best=best)
+            if fill:
+                fill_events.append(FillEvent(time=mkt.time, trade=trade, fill=fill))
+            if trade.filled:
+                mkt._pending_orders.remove(trade)
+    return fill_events
+
+
+def _matched(cache_dir: pathlib.Path, contract: Contract, seed: int, baseline: bool) -> List[Tuple[int, float, int]]:
+    """(index of the order, price, lots) of the fills of random orders against random quotes"""
+    rng = np.random.default_rng(seed)
+    orders: List[Order] = _random_orders(contract=contract, n=200, rng=rng)
+    mkt = Market(start_time=START, contract=contract, tick_cache_dir=cache_dir)
+    mkt._change_bests = _random_quotes(n=500, rng=rng)
+    for order in orders:
+        mkt.add_order(order)
+    fill_events: List[FillEvent] = _baseline_fill_events(mkt) if baseline else mkt._process_pending_orders()
+    index = {id(order): i for i, order in enumerate(orders)}
+    return [(index[id(e.trade.order)], e.fill.price, e.fill.lots) for e in fill_events]
+
+
+def test_matching_same_as_baseline_loop(cache_dir: pathlib.Path, contracts: List[Contract]):
+    for seed in range(5):
+        fills = _matched(cache_dir=cache_dir, contract=contracts[0], seed=seed, baseline=False)
+        assert fills, "the orders should be crossed"
+        assert fills == _matched(cache_dir=cache_dir, contract=contracts[0], seed=seed, baseline=True)
+
+
+def test_crossed_same_as_scanning_all_orders(contracts: List[Contract]):
+    rng = np.random.default_rng(0)
+    book = PendingOrdersBook()
+    trades: List[StrategyTrade] = [StrategyTrade(order) for order in _random_orders(contracts[0], n=300, rng=rng)]
+    for trade in trades:
+        book.add(trade)
+    for trade in trades[::3]:
+        book.remove(trade)
+    pending: List[StrategyTrade] = [t for i, t in enumerate(trades) if i % 3]
+    assert list(book) == pending
+    for bid in 4000. + 0.25 * np.arange(-10, 10):
+        ask: float = bid + 0.25
+        expected: List[StrategyTrade] = [
+            t for t in pending
+            if isinstance(t.order, MktOrder)
+            or (t.order.action == OrderAction.BUY and t.order.price >= ask)
+            or (t.order.action == OrderAction.SELL and t.order.price <= bid)
+        ]
+        assert book.crossed(bid=bid, ask=ask) == expected
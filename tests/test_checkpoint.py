@@ -0,0 +1,36 @@
+import datetime
+import pathlib
+import pytest
+from conftest import fills, positions
+
+UTC = datetime.timezone.utc
+HEARTBEAT = datetime.timedelta(minutes=5)
+
+
+@pytest.mark.parametrize("crash_time", [
+    datetime.datetime(2021, 6, 1, 19, 30, tzinfo=UTC),  # during a session
+    datetime.datetime(2021, 6, 2, 3, tzinfo=UTC),  # overnight, between two sessions
+])
+def test_resumed_run_same_as_uninterrupted(run_backtest, tmp_path: pathlib.Path, crash_time: datetime.datetime):
+    bt, history = run_backtest(event_driven=True, heartbeat=HEARTBEAT)
+    checkpoint_path: pathlib.Path = tmp_path / "checkpoint.pkl"
+    _, history_before = run_backtest(
+        end_time=crash_time, event_driven=True, heartbeat=HEARTBEAT, checkpoint_path=checkpoint_path
+    )
+    resumed_bt, history_after = run_backtest(
+        restore=True, event_driven=True, heartbeat=HEARTBEAT, checkpoint_path=checkpoint_path
+    )
+    assert fills(history_before) and fills(history_after)
+    assert resumed_bt.history_offset == len(history_before)
+    assert fills(history_before + history_after) == fills(history)
+    assert positions(resumed_bt) == positions(bt)
+    assert resumed_bt.strat.get_state() == bt.strat.get_state()
+
+
+def test_periodic_checkpoints_keep_the_run(run_backtest, tmp_path: pathlib.Path):
+    bt, history = run_backtest(event_driven=True)
+    checkpointed_bt, checkpointed_history = run_backtest(
+        event_driven=True, checkpoint_path=tmp_path / "checkpoint.pkl", checkpoint_every=datetime.timedelta(minutes=10)
+    )
+    assert fills(checkpointed_history) == fills(history)
+    assert positions(checkpointed_bt) == positions(bt)
@@ -0,0 +1,17 @@
+import datetime
+from conftest import fills, positions
+
+
+def test_event_driven_same_fills_as_fixed_clock(run_backtest):
+    fixed_bt, fixed_history = run_backtest(event_driven=False)
+    bt, history = run_backtest(event_driven=True)
+    assert fills(fixed_history)
+    assert fills(history) == fills(fixed_history)
+    assert positions(bt) == positions(fixed_bt)
+    assert bt.strat.n_ticks == fixed_bt.strat.n_ticks
+
+
+def test_heartbeat_keeps_the_fills(run_backtest):
+    _, history = run_backtest(event_driven=True)
+    _, heartbeat_history = run_backtest(event_driven=True, heartbeat=datetime.timedelta(minutes=5))
+    assert fills(heartbeat_history) == fills(history)
@@ -0,0 +1,86 @@
+import datetime
+import pathlib
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pytest
+from ib_insync import Contract
+from simplebt.backtester import Backtester
+from simplebt.events.generic import Event
+from simplebt.events.market import PendingTickersEvent
+from simplebt.orders import MktOrder, OrderAction
+from simplebt.strategy import StrategyInterface
+from simplebt.ticker import Ticker
+from simplebt.utils import from_ns
+from simplebt.vectorized import SignalRun, backtest_signal, load_quotes
+from conftest import END, START, TIME_STEP, fills
+
+
+class FollowTarget(StrategyInterface):
+    """Sends the market orders that bring the position to target[i] after the i-th bid/ask tick"""
+    event_subscriptions = (PendingTickersEvent,)
+
+    def __init__(self, bt: Backtester, contract: Contract, target: np.ndarray):
+        self.bt = bt
+        self.contract = contract
+        self.target = target
+        self.time: Optional[datetime.datetime] = None
+        self._n_quotes: int = 0
+        self._sent: int = 0
+
+    def set_time(self, time: datetime.datetime):
+        self.time = time
+
+    def on_pending_tickers_event(self, tickers: List[Ticker]):
+        self._n_quotes += sum(len(t.bidasks) for t in tickers)
+        if self._n_quotes == 0:
+            return
+        wanted: int = int(self.target[self._n_quotes - 1])
+        if wanted != self._sent:
+            action = OrderAction.BUY if wanted > self._sent else OrderAction.SELL
+            self.bt.place_order(MktOrder(contract=self.contract, action=action, lots=abs(wanted - self._sent), time=self.time))
+            self._sent = wanted
+
+    def on_new_order_event(self, trade):
+        pass
+
+    def on_exec_details_event(self, trade, fill):
+        pass
+
+    def on_pnl_single_event(self, pnl):
+        pass
+
+
+def _moving_average_target(quotes: Dict[str, np.ndarray], window: int, lots: int) -> np.ndarray:
+    """Long lots above the moving average of the mid, short below it"""
+    mid: np.ndarray = (quotes["bid"] + quotes["ask"]) / 2
+    average: np.ndarray = np.convolve(mid, np.ones(window) / window, mode="full")[:len(mid)]
+    target: np.ndarray = np.where(mid > average, lots, -lots).astype(np.int64)
+    target[:window] = 0
+    return target
+
+
+@pytest.mark.parametrize("lots", [1, 3])  # 3 lots are often more than the size at the touch
+def test_fast_path_same_fills_as_market(cache_dir: pathlib.Path, contracts: List[Contract], lots: int):
+    contract: Contract = contracts[0]
+    quotes: Dict[str, np.ndarray] = load_quotes(contract, START, END + TIME_STEP, cache_dir=cache_dir)
+    target: np.ndarray = _moving_average_target(quotes, window=50, lots=lots)
+
+    bt = Backtester(
+        contracts=[contract], start_time=START, end_time=END, time_step=TIME_STEP, tick_cache_dir=cache_dir, event_driven=True
+    )
+    bt.set_strat(FollowTarget(bt, contract=contract, target=target))
+    history: List[Event] = bt.run()
+    run: SignalRun = backtest_signal(contract, target, quotes)
+
+    signed: List[Tuple[datetime.datetime, float, int]] = [
+        (time, price, n if action == OrderAction.BUY.name else -n) for time, _, action, price, n in fills(history)
+    ]
+    fast: List[Tuple[datetime.datetime, float, int]] = list(zip(
+        [from_ns(t) for t in run.fills["time"].tolist()], run.fills["price"].tolist(), run.fills["lots"].tolist()
+    ))
+    assert signed
+    assert fast == signed
+    position = bt.positions()[0]
+    assert (position.position, position.avg_cost, position.realized_pnl) == (
+        run.position[-1], run.avg_cost[-1], run.realized_pnl[-1]
+    )